@@ -1,4 +1,5 @@
 from Configuration.configuration import Configuration
+import itertools
 import numpy as np
 
 """
@@ -16,6 +17,28 @@ def id_lst(start, count):
     return (np.arange(start, start + count, 1)).tolist()
 
 
+def grid_configurations(config_map, base_config=None, start_id=1):
+    """
+    Creates one configuration per combination of the values in config_map (the cartesian product), unlike main()
+    below, which walks all the lists in parallel.
+    :param config_map: dictionary of parameter name and list of values
+    :param base_config: configuration the parameters that are not in config_map are copied from
+    :param start_id: id of the first configuration
+    :return: list of Configuration
+    """
+    parameters = list(config_map)
+    configurations = []
+    for file_id, values in enumerate(itertools.product(*(config_map[item] for item in parameters)), start_id):
+        cfg = Configuration()
+        if base_config is not None:
+            cfg.__dict__.update(base_config.__dict__)
+        for attribute, value in zip(parameters, values):
+            setattr(cfg, attribute, value)
+        setattr(cfg, "id", file_id)
+        configurations.append(cfg)
+    return configurations
+
+
 def main():
     """
     In the example below, we want to tune a parameter (max n-gram) with values between 1 to 9.
@@ -1,3 +1,9 @@
+import os
+
+# Threads of the training from a list when workers is not set
+IN_MEMORY_WORKERS = 1
+
+
 class Configuration:
     def __init__(self, config_file_path=None):
         """
@@ -16,6 +22,9 @@ class Configuration:
         self.result_vector_file_path = None
         self.skip_gram = None
         self.vector_size = None
+        # FastText worker threads; when not set, all available cores are used to train from a corpus file and a
+        # single thread to train from a list, as before
+        self.workers = None
 
         if config_file_path is not None:
             file = open(config_file_path)
@@ -39,3 +48,16 @@ class Configuration:
         for item in attribute_map:
             file.write(item + "," + str(attribute_map[item]) + "\n")
         file.close()
+
+    def get_workers(self, corpus_file=False):
+        """
+        Number of worker threads to train with: the workers parameter or, if it is not set, the number of available
+        cores for corpus_file training and IN_MEMORY_WORKERS for training from a list (the single thread the list
+        training always used, so its results and memory do not change).
+        :param corpus_file: whether the model is trained from a corpus file
+        """
+        if str(self.workers).isdigit() and int(self.workers) > 0:
+            return int(self.workers)
+        if corpus_file:
+            return os.cpu_count() or 1
+        return IN_MEMORY_WORKERS
@@ -0,0 +1,117 @@
+import csv
+import sys
+from collections import OrderedDict
+
+# ARQMath formula TSVs have very large MathML fields
+csv.field_size_limit(sys.maxsize)
+
+CHUNK_ROWS = 5000
+# OPT rows read ahead while looking for a formula id, before the oldest are dropped
+OPT_LOOKAHEAD_ROWS = 50000
+
+
+class OptFormulaLookup:
+    """
+    Streaming lookup of the OPT MathML of a formula id.
+
+    The OPT file of a pair lists the same formulas as the SLT file, in the
+    same order, so the file is read forward as the SLT rows ask for ids and
+    only the rows read ahead (question formulas not asked for yet) are
+    buffered, up to OPT_LOOKAHEAD_ROWS. Memory does not grow with the size
+    of the file; if the files are not aligned, some OPT representations may
+    be missed once the buffer is full.
+    """
+
+    def __init__(self, opt_file, lookahead_rows=OPT_LOOKAHEAD_ROWS):
+        self.lookahead_rows = lookahead_rows
+        self.buffer = OrderedDict()
+        self.rows_read = 0
+        self.dropped = 0
+        self._file = open(opt_file, "r", encoding="utf-8") if opt_file else None
+        self._rows = (
+            csv.DictReader(self._file, delimiter="\t") if self._file else iter(())
+        )
+
+    def get(self, formula_id):
+        """OPT MathML of the formula, or None"""
+        if formula_id in self.buffer:
+            return self.buffer.pop(formula_id)
+        for row in self._rows:
+            self.rows_read += 1
+            if not row.get("id") or not row.get("formula"):
+                continue
+            if row["id"] == formula_id:
+                return row["formula"]
+            if row.get("type", "question") != "question":
+                continue
+            self.buffer[row["id"]] = row["formula"]
+            if len(self.buffer) > self.lookahead_rows:
+                self.buffer.popitem(last=False)
+                self.dropped += 1
+        return None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def iter_formula_chunks(
+    slt_file, opt_lookup, post_id_index, start_row=0, chunk_rows=CHUNK_ROWS
+):
+    """
+    Stream the question formulas of an SLT file in chunks of `chunk_rows`
+    data rows. Post existence is resolved per chunk, with the PostIdIndex.
+
+    Args:
+        slt_file: SLT TSV file
+        opt_lookup: OptFormulaLookup of the matching OPT file
+        post_id_index: Local index of the posts that exist
+        start_row: Data rows before this one are skipped (already indexed)
+        chunk_rows: Data rows per chunk
+
+    Yields:
+        (rows, rows_read, next_row): rows are the (formula_id, post_id,
+        slt_text, opt_text) tuples of the question formulas of existing posts
+        in the chunk, rows_read the question formulas read, and next_row the
+        first data row after the chunk
+    """
+    with open(slt_file, "r", encoding="utf-8") as file:
+        formulas = []
+        next_row = 0
+        for row_number, row in enumerate(csv.DictReader(file, delimiter="\t")):
+            next_row = row_number + 1
+            if (
+                row.get("id")
+                and row.get("formula")
+                and row.get("post_id")
+                and row.get("type") == "question"
+            ):
+                if row_number >= start_row:
+                    formulas.append((row["id"], str(row["post_id"]), row["formula"]))
+                else:
+                    # Already indexed: the OPT file is still advanced past it, so its
+                    # row is not buffered as a formula read ahead
+                    opt_lookup.get(row["id"])
+            if next_row % chunk_rows == 0 and next_row > start_row:
+                yield _resolve_chunk(formulas, opt_lookup, post_id_index), len(formulas), next_row
+                formulas = []
+        if formulas or next_row % chunk_rows:
+            yield _resolve_chunk(formulas, opt_lookup, post_id_index), len(formulas), next_row
+
+
+def _resolve_chunk(formulas, opt_lookup, post_id_index):
+    existing_post_ids = post_id_index.filter({post_id for _, post_id, _ in formulas})
+    rows = []
+    for formula_id, post_id, slt_text in formulas:
+        # The OPT file is read for every formula, to keep it aligned with the SLT file
+        opt_text = opt_lookup.get(formula_id)
+        if post_id in existing_post_ids:
+            rows.append((formula_id, post_id, slt_text, opt_text))
+    return rows
@@ -6,65 +6,173 @@ from tqdm import tqdm
 
 from DataReader.abstract_data_reader import AbstractDataReader
 from lib.tangentS.math_tan.math_document import MathDocument
-from lib.tangentS.math_tan.math_extractor import MathExtractor
+from services.tuple_store import TupleStore, get_tuple_store, parse_slt_opt_trees
 
 
 class WikiDataReader(AbstractDataReader, ABC):
     def __init__(
-        self, collection_file_path, read_slt=True, queries_directory_path=None
+        self,
+        collection_file_path,
+        read_slt=True,
+        queries_directory_path=None,
+        tuple_store=None,
     ):
         self.read_slt = read_slt
         self.collection_file_path = collection_file_path
 
         self.queries_directory_path = queries_directory_path
+        # Com um TupleStore, documentos já convertidos não são convertidos de novo
+        self.tuple_store = tuple_store if tuple_store is not None else get_tuple_store()
         super()
 
+    def parse_contents(self, contents):
+        """
+        Converts the MathML documents (name -> content) into their formula
+        trees, reading from and writing to the tuple store in bulk when there
+        is one. The value is None for documents that could not be parsed.
+        """
+        operator = not self.read_slt
+        return {
+            name: trees[operator]
+            for name, trees in self.parse_contents_slt_opt(
+                contents, operators=(operator,)
+            ).items()
+        }
+
+    def parse_contents_slt_opt(self, contents, operators=(False, True)):
+        """
+        Same as parse_contents(), for both representations at once: the math
+        expressions of each document are extracted a single time and then
+        converted to SLT and to OPT trees.
+        The value is a dictionary of operator (False: SLT, True: OPT) and trees.
+        """
+        keys = {}
+        stored = {}
+        if self.tuple_store is not None:
+            keys = {
+                (name, operator): TupleStore.make_key(content, operator)
+                for name, content in contents.items()
+                for operator in operators
+            }
+            stored = self.tuple_store.get_many(keys.values())
+
+        result = {}
+        parsed = {}
+        for name, content in contents.items():
+            trees = {}
+            missing = []
+            for operator in operators:
+                key = keys.get((name, operator))
+                if key in stored:
+                    trees[operator] = stored[key]
+                else:
+                    missing.append(operator)
+            if missing:
+                trees.update(parse_slt_opt_trees(content, operators=missing))
+                for operator in missing:
+                    key = keys.get((name, operator))
+                    if key is not None:
+                        parsed[key] = trees[operator]
+            result[name] = trees
+
+        if self.tuple_store is not None:
+            self.tuple_store.put_many(parsed)
+        return result
+
+    def get_collection_directories(self):
+        """Article directories of the NTCIR-12 collection"""
+        root = self.collection_file_path
+        directories = []
+        for directory in os.listdir(root):
+            temp_address = root + "/" + directory + "/Articles/"
+            if os.path.isdir(temp_address):
+                directories.append(temp_address)
+        return directories
+
+    @staticmethod
+    def read_directory(directory_path, progress=True):
+        """
+        Reads the documents of an article directory
+        :return: (dictionary of file name and content, number of files that could not be read)
+        """
+        except_count = 0
+        contents = {}
+        filenames = os.listdir(directory_path)
+        for filename in tqdm(filenames) if progress else filenames:
+            file_path = directory_path + filename
+            parts = filename.split("/")
+            file_name = os.path.splitext(parts[len(parts) - 1])[0]
+            try:
+                (ext, content) = MathDocument.read_doc_file(file_path)
+                contents[file_name] = content
+            except:
+                except_count += 1
+                print(file_name)
+        return contents, except_count
+
+    @staticmethod
+    def normalize_file_name(file_name):
+        """To handle formulae with special characters, the unicode data of the file name is normalized"""
+        temp = str(unicodedata.normalize("NFKD", file_name).encode("ascii", "ignore"))
+        temp = temp[2:]
+        return temp[:-1]
+
     def get_collection(
         self,
     ):
         """
         This method read the NTCIR-12 formulae in the collection.
-        To handle formulae with special characters line 39 normalizes the unicode data.
+        To handle formulae with special characters, the file names are normalized (normalize_file_name).
         The return value is a dictionary of formula id (as key) and list of tuples (as value)
         """
         except_count = 0
         dictionary_formula_tuples = {}
-        root = self.collection_file_path
         print("Reading NTCIR-12 folders")
-        for directory in tqdm(os.listdir(root)):
-            temp_address = root + "/" + directory + "/Articles/"
-            if not os.path.isdir(temp_address):
-                continue
+        for directory_path in tqdm(self.get_collection_directories()):
+            contents, failed = self.read_directory(directory_path)
+            except_count += failed
 
-            for filename in tqdm(os.listdir(temp_address)):
-                file_path = temp_address + filename
-                parts = filename.split("/")
-                file_name = os.path.splitext(parts[len(parts) - 1])[0]
-                try:
-                    (ext, content) = MathDocument.read_doc_file(file_path)
-                    formulas = MathExtractor.parse_from_xml(
-                        content,
-                        1,
-                        operator=(not self.read_slt),
-                        missing_tags=None,
-                        problem_files=None,
-                    )
-                    temp = str(
-                        unicodedata.normalize("NFKD", file_name).encode(
-                            "ascii", "ignore"
-                        )
-                    )
-                    temp = temp[2:]
-                    file_name = temp[:-1]
-                    for key in formulas:
-                        tuples = formulas[key].get_pairs(window=2, eob=True)
-                        dictionary_formula_tuples[file_name + ":" + str(key)] = tuples
-                except:
+            for file_name, formulas in self.parse_contents(contents).items():
+                if formulas is None:
                     except_count += 1
                     print(file_name)
+                    continue
+                file_name = self.normalize_file_name(file_name)
+                for key, _, tuples in formulas:
+                    dictionary_formula_tuples[file_name + ":" + str(key)] = tuples
 
+        if self.tuple_store is not None:
+            self.tuple_store.report()
         return dictionary_formula_tuples
 
+    def get_directory_slt_opt(self, directory_path, progress=False):
+        """
+        Reads the documents of one article directory and parses each of them
+        once into both representations.
+        :return: (list of (formula id, SLT tuples, OPT tuples), number of documents that could not be read or
+        parsed); the tuples of a representation that could not be parsed are None
+        """
+        contents, except_count = self.read_directory(directory_path, progress)
+        formulas = []
+        for file_name, trees in self.parse_contents_slt_opt(contents).items():
+            slt_trees, opt_trees = trees[False], trees[True]
+            if slt_trees is None and opt_trees is None:
+                except_count += 1
+                print(file_name)
+                continue
+            file_name = self.normalize_file_name(file_name)
+            slt_tuples = {key: tuples for key, _, tuples in slt_trees or []}
+            opt_tuples = {key: tuples for key, _, tuples in opt_trees or []}
+            for key in sorted(set(slt_tuples) | set(opt_tuples)):
+                formulas.append(
+                    (
+                        file_name + ":" + str(key),
+                        slt_tuples.get(key),
+                        opt_tuples.get(key),
+                    )
+                )
+        return formulas, except_count
+
     def get_query(
         self,
     ):
@@ -75,21 +183,21 @@ class WikiDataReader(AbstractDataReader, ABC):
         """
         except_count = 0
         dictionary_query_tuples = {}
+        contents = {}
         for j in range(1, 21):
             temp_address = self.queries_directory_path + "/" + str(j) + ".html"
             try:
                 (ext, content) = MathDocument.read_doc_file(temp_address)
-                formulas = MathExtractor.parse_from_xml(
-                    content,
-                    1,
-                    operator=(not self.read_slt),
-                    missing_tags=None,
-                    problem_files=None,
-                )
-                for key in formulas:
-                    tuples = formulas[key].get_pairs(window=2, eob=True)
-                    dictionary_query_tuples[j] = tuples
+                contents[j] = content
             except:
                 except_count += 1
                 print(j)
+
+        for j, formulas in self.parse_contents(contents).items():
+            if formulas is None:
+                except_count += 1
+                print(j)
+                continue
+            for _, _, tuples in formulas:
+                dictionary_query_tuples[j] = tuples
         return dictionary_query_tuples
@@ -1,6 +1,12 @@
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
-from services.model_manager import model_manager
+from services.model_manager import check_formulas_index_format, model_manager
+from services.elasticsearch_service import (
+    close_async_elasticsearch_clients,
+    get_elasticsearch_service,
+)
+from services.cpu_executor import run_cpu_bound, shutdown_cpu_executor
+from services.formula_vector_cache import get_formula_vector_cache
 
 from app.modules.search.use_cases.separate_text_and_formulas import (
     make_separate_text_and_formulas_use_case,
@@ -28,11 +34,27 @@ from app.modules.shared.parse_html_to_text import parse_html_to_text
 
 from fastapi.responses import JSONResponse
 
+import asyncio
+import gc
+import os
 import traceback
 
 
 app = FastAPI()
 
+# Com o gunicorn --preload este módulo é importado no processo mestre antes do fork: os modelos
+# carregados aqui são herdados pelos workers (copy-on-write) em vez de serem carregados de novo
+# em cada um. Junto com CFT_MODEL_MMAP=true os arrays dos modelos ficam em uma única cópia física:
+#   PRELOAD_MODELS=true CFT_MODEL_MMAP=true gunicorn app.main:app --preload -w 4 \
+#       -k uvicorn.workers.UvicornWorker -b 0.0.0.0:8000
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "false").lower() in ("1", "true")
+if PRELOAD_MODELS:
+    print("🚀 Pré-carregando modelos antes do fork dos workers...")
+    model_manager.preload()
+    # Move os objetos já criados para fora do GC, para que as coletas nos workers
+    # não escrevam nas páginas compartilhadas
+    gc.freeze()
+
 
 @app.on_event("startup")
 async def startup_event():
@@ -41,14 +63,27 @@ async def startup_event():
     """
     print("🚀 Iniciando servidor e carregando modelos...")
 
-    # Pré-carrega todos os modelos
-    model_manager.get_model("SLT")
-    model_manager.get_model("OPT")
-    model_manager.get_model("SLT_TYPE")
+    # Pré-carrega todos os modelos (não faz nada se já foram carregados antes do fork)
+    model_manager.preload()
+
+    # Cria os índices ausentes uma única vez, fora do caminho das requisições
+    elastic_service = get_elasticsearch_service()
+    elastic_service.bootstrap_indices()
+    # Os vetores das consultas precisam vir do mesmo formato de modelo do índice de fórmulas
+    check_formulas_index_format(elastic_service)
 
     print("✅ Todos os modelos carregados! Servidor pronto.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Fecha as conexões assíncronas com o Elasticsearch e o executor de CPU
+    """
+    await close_async_elasticsearch_clients()
+    shutdown_cpu_executor()
+
+
 @app.middleware("http")
 async def catch_exceptions_middleware(request: Request, call_next):
     try:
@@ -68,26 +103,39 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "status": "ok",
+        "models": model_manager.get_stats(),
+        "formula_vector_cache": get_formula_vector_cache().get_stats(),
+    }
+
+
 class SearchReqParams(BaseModel):
     query: str
 
 
 @app.post("/search-pure-text")
 async def search_pure_text(params: SearchReqParams):
-    result = make_search_text_field_use_case().execute(params.query, 10)
+    result = await make_search_text_field_use_case().execute_async(params.query, 10)
     return {"status": "ok", "top_posts": result}
 
 
 @app.post("/search-text-with-treated-formulas")
 async def search_text_with_treated_formulas(params: SearchReqParams):
-    result = make_search_text_with_treated_formulas_use_case().execute(params.query, 10)
+    result = await make_search_text_with_treated_formulas_use_case().execute_async(
+        params.query, 10
+    )
     return {"status": "ok", "top_posts": result}
 
 
 @app.post("/search-text-vector")
 async def search_text_vector(params: SearchReqParams):
-    text_without_html = parse_html_to_text(params.query)
-    result = make_search_text_vector_use_case().execute(text_without_html, 10)
+    text_without_html = await run_cpu_bound(parse_html_to_text, params.query)
+    result = await make_search_text_vector_use_case().execute_async(
+        text_without_html, 10
+    )
     return {"status": "ok", "top_posts": result}
 
 
@@ -97,21 +145,23 @@ async def search_with_text_combined_with_combined_formula_vector(
     params: SearchReqParams,
 ):
     # 1. Separar texto e fórmulas
-    text_without_formulas, formulas, _ = (
-        make_separate_text_and_formulas_use_case().execute(params.query)
+    text_without_formulas, formulas, _ = await run_cpu_bound(
+        make_separate_text_and_formulas_use_case().execute, params.query
     )
 
-    # 2. Gerar vetores SLT para as fórmulas
-    all_formula_vectors = []
-
-    for formula in formulas:
-        vectors_dict = (
-            make_get_slt_opt_and_type_combined_formula_vector_use_case().execute(
-                formula, vector_types=["slt"]
-            )
-        )
-        if vectors_dict:
-            all_formula_vectors.append(vectors_dict["slt_vector"])
+    # 2. Gerar vetores SLT para as fórmulas (parse/encode/embed fora do event loop)
+    formula_vector_use_case = (
+        make_get_slt_opt_and_type_combined_formula_vector_use_case()
+    )
+    vectors_dicts = await asyncio.gather(
+        *[
+            run_cpu_bound(formula_vector_use_case.execute, formula, vector_types=["slt"])
+            for formula in formulas
+        ]
+    )
+    all_formula_vectors = [
+        vectors_dict["slt_vector"] for vectors_dict in vectors_dicts if vectors_dict
+    ]
 
     # 3. Criar use case de combinação
     combined_search_use_case = (
@@ -121,21 +171,10 @@ async def search_with_text_combined_with_combined_formula_vector(
         )
     )
 
-    # 4. Executar os approaches
+    # 4. Executar os approaches (as buscas são feitas uma única vez e
+    # compartilhadas por todos eles)
     result_size = 10
-
-    result_approach_1 = combined_search_use_case.approach_1_individual_formula_max(
-        top_k=result_size
-    )
-    result_approach_2 = combined_search_use_case.approach_2_mean_formula_score(
-        top_k=result_size
-    )
-    result_approach_3 = (
-        combined_search_use_case.approach_3_individual_formula_max_weighted(
-            top_k=result_size
-        )
-    )
-    result_approach_4 = combined_search_use_case.approach_4_mean_formula_score_weighted(
+    approach_results = await combined_search_use_case.execute_all_async(
         top_k=result_size
     )
 
@@ -145,12 +184,7 @@ async def search_with_text_combined_with_combined_formula_vector(
         "query": params.query,
         "text_without_formulas": text_without_formulas,
         "num_formulas": len(formulas),
-        "results": {
-            "approach_1_individual_formula_max": result_approach_1,
-            "approach_2_mean_formula_score": result_approach_2,
-            "approach_3_individual_formula_max_weighted": result_approach_3,
-            "approach_4_mean_formula_score_weighted": result_approach_4,
-        },
+        "results": approach_results,
     }
 
 
@@ -9,9 +9,16 @@ from app.modules.embedding.use_cases.encode_formula_tuples import (
 )
 
 from lib.tangentCFT.touple_encoder.encoder import TupleTokenizationMode
+from services.model_manager import model_manager
+from services.formula_vector_cache import (
+    FormulaVectorCache,
+    get_formula_vector_cache,
+)
 from enum import Enum
 from typing import List, Optional, Dict, Any
 
+import numpy as np
+
 
 class EncodeFormulaTuplesUseCaseParams(Enum):
     SLT = {
@@ -34,6 +41,8 @@ class EncodeFormulaTuplesUseCaseParams(Enum):
 
 
 class GetSLTOptAndTypeCombinedFormulaVectorUseCase:
+    def __init__(self, cache: Optional[FormulaVectorCache] = None):
+        self.cache = cache
 
     def execute(
         self,
@@ -41,7 +50,8 @@ class GetSLTOptAndTypeCombinedFormulaVectorUseCase:
         vector_types: List[str] = ["slt", "slt_type", "opt", "combined"],
     ):
         """
-        Generate formula vectors for specified representations.
+        Generate formula vectors for specified representations, serving
+        repeated formulas from the cache when one is configured.
 
         Args:
             formula: Formula string to process
@@ -57,6 +67,19 @@ class GetSLTOptAndTypeCombinedFormulaVectorUseCase:
             }
             Returns None if formula cannot be processed.
         """
+        if self.cache is None:
+            return self._compute(formula, vector_types)
+
+        key = FormulaVectorCache.make_key(formula, vector_types)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._compute(formula, vector_types)
+            # Failed formulas (or failed vector types) are not cached
+            if result and all(v is not None for v in result.values()):
+                self.cache.put(key, result)
+        return result
+
+    def _compute(self, formula: str, vector_types: List[str]):
         result = {}
 
         # Normalize vector_types to lowercase
@@ -145,10 +168,105 @@ class GetSLTOptAndTypeCombinedFormulaVectorUseCase:
         return result
 
 
+    def embed_tuples(
+        self,
+        slt_tuples_batch: List[Optional[List[str]]],
+        opt_tuples_batch: List[Optional[List[str]]],
+    ) -> List[Dict[str, Optional[np.ndarray]]]:
+        """
+        Generate the SLT, SLT_TYPE, OPT and combined vectors of many formulas
+        whose tuples were already parsed. The SLT tuples are encoded for both
+        SLT and SLT_TYPE, and each model embeds the whole batch at once.
+
+        Args:
+            slt_tuples_batch: SLT tuples of each formula (None or [] if missing)
+            opt_tuples_batch: OPT tuples of each formula (None or [] if missing)
+
+        Returns:
+            One dictionary per formula with "slt_vector", "slt_type_vector",
+            "opt_vector" and "formula_vector"; vectors that could not be
+            generated are None
+        """
+        return self.embed_encoded_tuples(
+            self.encode_tuples(slt_tuples_batch, opt_tuples_batch)
+        )
+
+    def encode_tuples(
+        self,
+        slt_tuples_batch: List[Optional[List[str]]],
+        opt_tuples_batch: List[Optional[List[str]]],
+    ) -> Dict[str, List[List[str]]]:
+        """
+        Encode the parsed tuples of many formulas for each model. New symbols
+        get their ids from the EncoderManager of this process, so the
+        encoding must happen where the encoder maps are kept and saved.
+
+        Returns:
+            Dictionary of graph type ("SLT", "SLT_TYPE", "OPT") and the
+            encoded tuples of each formula ([] if missing)
+        """
+        encode_formula_tuples_use_case = make_encode_formula_tuples_use_case()
+        return {
+            graph_type: [
+                (
+                    encode_formula_tuples_use_case.execute(
+                        tuples, **EncodeFormulaTuplesUseCaseParams[graph_type].value
+                    )
+                    if tuples
+                    else []
+                )
+                for tuples in tuples_batch
+            ]
+            for graph_type, tuples_batch in (
+                ("SLT", slt_tuples_batch),
+                ("SLT_TYPE", slt_tuples_batch),
+                ("OPT", opt_tuples_batch),
+            )
+        }
+
+    def embed_encoded_tuples(
+        self, encoded_batches: Dict[str, List[List[str]]]
+    ) -> List[Dict[str, Optional[np.ndarray]]]:
+        """
+        Vectors of many formulas already encoded by encode_tuples; only the
+        models are used, not the encoder maps.
+        """
+        vectors = {
+            graph_type: model_manager.get_model(graph_type).embed_many(encoded_batch)
+            for graph_type, encoded_batch in encoded_batches.items()
+        }
+
+        results = []
+        for slt_vector, slt_type_vector, opt_vector in zip(
+            vectors["SLT"], vectors["SLT_TYPE"], vectors["OPT"]
+        ):
+            # embed_many leaves the rows of formulas without any vector as NaN
+            slt_vector, slt_type_vector, opt_vector = (
+                None if np.isnan(vector).any() else vector
+                for vector in (slt_vector, slt_type_vector, opt_vector)
+            )
+            combined = (
+                combine_vector(slt_vector, opt_vector, slt_type_vector)
+                if slt_vector is not None
+                and opt_vector is not None
+                and slt_type_vector is not None
+                else None
+            )
+            results.append(
+                {
+                    "slt_vector": slt_vector,
+                    "slt_type_vector": slt_type_vector,
+                    "opt_vector": opt_vector,
+                    "formula_vector": combined,
+                }
+            )
+        return results
+
+
 def make_get_slt_opt_and_type_combined_formula_vector_use_case() -> (
     GetSLTOptAndTypeCombinedFormulaVectorUseCase
 ):
-    return GetSLTOptAndTypeCombinedFormulaVectorUseCase()
+    return GetSLTOptAndTypeCombinedFormulaVectorUseCase(get_formula_vector_cache())
 
 
 def combine_vector(slt_vector, opt_vector, slt_type_vector):
@@ -1,18 +1,18 @@
-from sentence_transformers import SentenceTransformer
+from services.model_manager import model_manager
+from services.text_embedding_service import TextEmbeddingService
 
 
 class GetTextVectorUseCase:
-    model: SentenceTransformer
+    text_embedding_service: TextEmbeddingService
 
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, text_embedding_service: TextEmbeddingService):
+        self.text_embedding_service = text_embedding_service
 
     def execute(self, text: str):
-        embedding = self.model.encode(
-            text, convert_to_numpy=True, normalize_embeddings=True
-        )
+        embedding = self.text_embedding_service.encode(text)
         return embedding
 
 
 def make_get_text_vector_use_case():
-    return GetTextVectorUseCase("all-MiniLM-L6-v2")
+    # O modelo é carregado uma única vez pelo gerenciador e compartilhado
+    return GetTextVectorUseCase(model_manager.get_text_model())
@@ -1,9 +1,18 @@
 # app/modules/search/use_cases/convert_formula_to_tuples.py
-from typing import List
-from lib.tangentS.math_tan.math_extractor import MathExtractor
+from typing import Dict, List, Optional, Tuple
+
+from services.tuple_store import TupleStore, get_tuple_store, parse_trees
+
+# Parâmetros da extração de tuplas
+WINDOW = 2
+EOB = True
 
 
 class ParseFormulaToTuplesUseCase:
+    def __init__(self, tuple_store: Optional[TupleStore] = None):
+        # Com um store, fórmulas já convertidas não são convertidas de novo
+        self.tuple_store = tuple_store
+
     def execute(self, formula: str, operator: bool = False) -> List[str]:
         """
         Converte uma fórmula MathML em uma lista de tuplas SLT ou OPT dependendo do valor de operator
@@ -14,36 +23,71 @@ class ParseFormulaToTuplesUseCase:
         Returns:
             Lista de tuplas SLT ou OPT
         """
-        try:
-            # Converter MathML para Symbol Layout Tree
-            # Even when send only one formula, the result is a dictionary of SymbolTrees
-            trees = MathExtractor.parse_from_xml(
-                formula,
-                content_id=1,  # ID temporário
-                operator=operator,
-                missing_tags=None,
-                problem_files=None,
-            )
-
-            for key in trees:
-                tuples = trees[key].get_pairs(window=2, eob=True)
-                """
-                Because we're only sending one formula we can return the first tuple
-                (slt_trees should have only one item any way)
-                """
-                return tuples
+        _, tuples = self.execute_with_key(formula, operator=operator)
+        return tuples
 
-            # Se não houver formulas
-            return []
+    def execute_with_key(
+        self, formula: str, operator: bool = False
+    ) -> Tuple[Optional[str], List[str]]:
+        """
+        Como execute, mas também retorna a forma canônica da árvore
+        (SymbolTree.tostring()). Fórmulas com a mesma forma canônica geram as
+        mesmas tuplas e, portanto, os mesmos vetores.
+
+        Returns:
+            (forma canônica ou None se a fórmula não pôde ser convertida, tuplas)
+        """
+        return self.execute_many_with_key([formula], operator=operator)[0]
+
+    def execute_many_with_key(
+        self, formulas: List[str], operator: bool = False
+    ) -> List[Tuple[Optional[str], List[str]]]:
+        """
+        Versão em lote de execute_with_key: o store é consultado com uma única
+        leitura, só as fórmulas ausentes são convertidas e o resultado delas é
+        gravado com uma única escrita.
+        """
+        if self.tuple_store is None:
+            return [self._first_tree(self._parse(formula, operator)) for formula in formulas]
+
+        keys = [
+            TupleStore.make_key(formula, operator, WINDOW, EOB) for formula in formulas
+        ]
+        stored = self.tuple_store.get_many(keys)
+        parsed: Dict[str, object] = {}
+        for key, formula in zip(keys, formulas):
+            if key not in stored and key not in parsed:
+                parsed[key] = self._parse(formula, operator)
+        self.tuple_store.put_many(parsed)
+        stored.update(parsed)
+        return [self._first_tree(stored[key]) for key in keys]
+
+    @staticmethod
+    def _parse(formula: str, operator: bool):
+        try:
+            # Converter MathML para Symbol Layout Tree (ou Operator Tree)
+            return parse_trees(formula, operator, WINDOW, EOB)
         except Exception as e:
             import traceback
 
             print(f"Erro ao converter fórmula para tuplas: {str(e)}")
             print("Stacktrace:")
             print(traceback.format_exc())
-            return []
+            return None
+
+    @staticmethod
+    def _first_tree(trees) -> Tuple[Optional[str], List[str]]:
+        """
+        Because we're only sending one formula we can return the first tuple
+        (slt_trees should have only one item any way)
+        """
+        if not trees:
+            # Se não houver formulas
+            return None, []
+        _, tree_string, tuples = trees[0]
+        return tree_string, tuples
 
 
 def make_parse_formula_to_tuples_use_case() -> ParseFormulaToTuplesUseCase:
     """Factory function para criar o caso de uso de conversão de fórmulas para tuplas"""
-    return ParseFormulaToTuplesUseCase()
+    return ParseFormulaToTuplesUseCase(get_tuple_store())
@@ -1,4 +1,7 @@
-from services.elasticsearch_service import ElasticsearchService
+from services.elasticsearch_service import (
+    ElasticsearchService,
+    get_elasticsearch_service,
+)
 
 FORMULAS_INDEX = "formulas"
 
@@ -26,7 +29,59 @@ class SearchFormulaVectorUseCase:
         Returns:
             List of search results with score and document id
         """
-        search_query = {
+        # Executa a busca
+        results = self.es.search_client().knn_search(
+            index=self.es.formulas_index_name,
+            body=self._build_query(formula_vector, top_k),
+        )
+        return self.format_results(results)
+
+    async def execute_async(self, formula_vector: list, top_k: int):
+        """Async counterpart of execute(), using AsyncElasticsearch."""
+        results = await self.es.async_search_client().knn_search(
+            index=self.es.formulas_index_name,
+            body=self._build_query(formula_vector, top_k),
+        )
+        return self.format_results(results)
+
+    def execute_many(self, formula_vectors: list, top_k: int):
+        """
+        Search several formula vectors in a single _msearch round trip.
+
+        Args:
+            formula_vectors: List of query vectors
+            top_k: Number of top results to return per vector
+
+        Returns:
+            One result list per vector, in the same format as execute()
+        """
+        responses = self.es.msearch(
+            [self.build_search(vector, top_k) for vector in formula_vectors]
+        )
+        return [self.format_results(response) for response in responses]
+
+    async def execute_many_async(self, formula_vectors: list, top_k: int):
+        """Async counterpart of execute_many()."""
+        responses = await self.es.msearch_async(
+            [self.build_search(vector, top_k) for vector in formula_vectors]
+        )
+        return [self.format_results(response) for response in responses]
+
+    def build_search(self, formula_vector: list, top_k: int):
+        """
+        Build the (index, body) pair of a kNN search for one formula vector,
+        to be sent with ElasticsearchService.msearch().
+        """
+        body = {
+            **self._build_query(formula_vector, top_k),
+            "size": top_k,
+            # The stored vectors are not needed by the callers
+            "_source": ["formula_id", "post_id"],
+        }
+        return self.es.formulas_index_name, body
+
+    def _build_query(self, formula_vector: list, top_k: int):
+        return {
             "knn": {
                 "field": self.vector_type,
                 "query_vector": formula_vector,
@@ -34,11 +89,9 @@ class SearchFormulaVectorUseCase:
                 "num_candidates": top_k * 2,
             }
         }
-        # Executa a busca
-        results = self.es.es.knn_search(
-            index=self.es.formulas_index_name, body=search_query
-        )
 
+    @staticmethod
+    def format_results(results):
         # Format results to return score and document id
         formatted_results = []
         for hit in results["hits"]["hits"]:
@@ -69,7 +122,5 @@ def make_search_formula_vector_use_case(vector_type: str = "formula_vector"):
     Returns:
         SearchFormulaVectorUseCase instance
     """
-    from services.elasticsearch_service import ElasticsearchService
-
-    es_service = ElasticsearchService()
+    es_service = get_elasticsearch_service()
     return SearchFormulaVectorUseCase(es_service, vector_type)
@@ -1,4 +1,7 @@
-from services.elasticsearch_service import ElasticsearchService
+from services.elasticsearch_service import (
+    ElasticsearchService,
+    get_elasticsearch_service,
+)
 from typing import List, Dict, Any
 
 
@@ -25,38 +28,71 @@ class SearchTextFieldUseCase:
             Lista dos posts encontrados, com informações relevantes
         """
         try:
-            # Prepara a query para buscar no campo especificado
-            search_query = {"query": {"match": {field: query}}, "size": size}
-
             # Executa a busca
-            results = self.elasticsearch_service.es.search(
-                index=self.elasticsearch_service.posts_index_name, body=search_query
+            results = self.elasticsearch_service.search_client().search(
+                index=self.elasticsearch_service.posts_index_name,
+                body=self._build_query(query, size, field),
             )
+            return self.format_results(results)
 
-            # Extrai e formata os resultados
-            hits = results["hits"]["hits"]
-            formatted_results = []
-
-            for hit in hits:
-                source = hit["_source"]
-                formatted_results.append(
-                    {
-                        "post_id": source.get("post_id"),
-                        "text": source.get("text"),
-                        "score": hit["_score"],
-                    }
-                )
+        except Exception as e:
+            print(f"Error searching pure text: {str(e)}")
+            raise e
 
-            return formatted_results
+    async def execute_async(
+        self, query: str, size: int = 10, field: str = "text"
+    ) -> List[Dict[str, Any]]:
+        """
+        Versão assíncrona de execute(), usando o AsyncElasticsearch.
+        """
+        try:
+            results = await self.elasticsearch_service.async_search_client().search(
+                index=self.elasticsearch_service.posts_index_name,
+                body=self._build_query(query, size, field),
+            )
+            return self.format_results(results)
 
         except Exception as e:
             print(f"Error searching pure text: {str(e)}")
             raise e
 
+    def build_search(self, query: str, size: int = 10, field: str = "text"):
+        """
+        Monta o par (índice, corpo) da busca, para ser enviado com
+        ElasticsearchService.msearch().
+        """
+        return (
+            self.elasticsearch_service.posts_index_name,
+            self._build_query(query, size, field),
+        )
+
+    @staticmethod
+    def _build_query(query: str, size: int, field: str) -> Dict[str, Any]:
+        # Prepara a query para buscar no campo especificado
+        return {"query": {"match": {field: query}}, "size": size}
+
+    @staticmethod
+    def format_results(results) -> List[Dict[str, Any]]:
+        # Extrai e formata os resultados
+        hits = results["hits"]["hits"]
+        formatted_results = []
+
+        for hit in hits:
+            source = hit["_source"]
+            formatted_results.append(
+                {
+                    "post_id": source.get("post_id"),
+                    "text": source.get("text"),
+                    "score": hit["_score"],
+                }
+            )
+
+        return formatted_results
+
 
 def make_search_text_field_use_case():
     """
     Factory function para criar o caso de uso de busca de texto puro.
     """
-    elasticsearch_service = ElasticsearchService()
+    elasticsearch_service = get_elasticsearch_service()
     return SearchTextFieldUseCase(elasticsearch_service)
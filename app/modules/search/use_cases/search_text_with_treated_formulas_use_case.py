@@ -1,4 +1,8 @@
-from services.elasticsearch_service import ElasticsearchService
+from services.elasticsearch_service import (
+    ElasticsearchService,
+    get_elasticsearch_service,
+)
+from services.cpu_executor import run_cpu_bound
 from app.modules.shared.text_celaner import clean_text
 from typing import List, Dict, Any
 from app.modules.shared.extract_latex_formulas import (
@@ -29,63 +33,85 @@ class SearchTextWithTreatedFormulasUseCase:
             Lista dos posts encontrados, com informações relevantes
         """
         try:
-            # Remove <span> tags and add $ delimiters and remove other html tags
-            text_query = parse_html_to_text_with_latex(query)
+            search_query = self._build_query(query, size)
 
-            # Sanitize latex formulas in the query for more accurate search
-            cleaned_query = clean_text(text_query)
-            raw_formulas = get_latex_formulas_larger_than_5_with_only_dollar_delimiters(
-                text_query
+            # Executa a busca
+            results = self.elasticsearch_service.search_client().search(
+                index=self.elasticsearch_service.posts_index_name, body=search_query
             )
+            return self._format_results(results)
 
-            cleaned_formulas = [
-                clean_text(f) for f in raw_formulas if len(f.strip()) > 5
-            ]
+        except Exception as e:
+            print(f"Error searching with treated latex: {str(e)}")
+            return []
 
-            should_clauses = [{"match": {"text_latex_search": cleaned_query}}] + [
-                {
-                    "match_phrase": {
-                        "text_latex_search": {
-                            "query": formula,
-                            "boost": 2,
-                        }
-                    }
-                }
-                for formula in cleaned_formulas
-            ]
-            search_query = {"query": {"bool": {"should": should_clauses}}, "size": size}
+    async def execute_async(self, query: str, size: int = 10) -> List[Dict[str, Any]]:
+        """
+        Versão assíncrona de execute(). O tratamento do HTML/LaTeX roda no
+        executor limitado para não bloquear o event loop.
+        """
+        try:
+            search_query = await run_cpu_bound(self._build_query, query, size)
 
-            # Executa a busca
-            results = self.elasticsearch_service.es.search(
+            results = await self.elasticsearch_service.async_search_client().search(
                 index=self.elasticsearch_service.posts_index_name, body=search_query
             )
-
-            # Processa os hits
-            hits = results["hits"]["hits"]
-            formatted_results = []
-            for hit in hits:
-                source = hit["_source"]
-                formatted_results.append(
-                    {
-                        "post_id": source.get("post_id"),
-                        "text": source.get("text"),
-                        "text_latex_search": source.get("text_latex_search"),
-                        "score": hit["_score"],
-                        # Inclui o texto limpo para depuração/verificação
-                        "clean_text": clean_text(source.get("text", "")),
-                    }
-                )
-
-            return formatted_results
+            return await run_cpu_bound(self._format_results, results)
 
         except Exception as e:
             print(f"Error searching with treated latex: {str(e)}")
             return []
 
+    @staticmethod
+    def _build_query(query: str, size: int) -> Dict[str, Any]:
+        # Remove <span> tags and add $ delimiters and remove other html tags
+        text_query = parse_html_to_text_with_latex(query)
+
+        # Sanitize latex formulas in the query for more accurate search
+        cleaned_query = clean_text(text_query)
+        raw_formulas = get_latex_formulas_larger_than_5_with_only_dollar_delimiters(
+            text_query
+        )
+
+        cleaned_formulas = [clean_text(f) for f in raw_formulas if len(f.strip()) > 5]
+
+        should_clauses = [{"match": {"text_latex_search": cleaned_query}}] + [
+            {
+                "match_phrase": {
+                    "text_latex_search": {
+                        "query": formula,
+                        "boost": 2,
+                    }
+                }
+            }
+            for formula in cleaned_formulas
+        ]
+        return {"query": {"bool": {"should": should_clauses}}, "size": size}
+
+    @staticmethod
+    def _format_results(results) -> List[Dict[str, Any]]:
+        # Processa os hits
+        hits = results["hits"]["hits"]
+        formatted_results = []
+        for hit in hits:
+            source = hit["_source"]
+            formatted_results.append(
+                {
+                    "post_id": source.get("post_id"),
+                    "text": source.get("text"),
+                    "text_latex_search": source.get("text_latex_search"),
+                    "score": hit["_score"],
+                    # Inclui o texto limpo para depuração/verificação
+                    "clean_text": clean_text(source.get("text", "")),
+                }
+            )
+
+        return formatted_results
+
 
 def make_search_text_with_treated_formulas_use_case():
     """
     Factory function para criar o caso de uso de busca com texto tratado.
     """
-    elasticsearch_service = ElasticsearchService()
+    elasticsearch_service = get_elasticsearch_service()
     return SearchTextWithTreatedFormulasUseCase(elasticsearch_service)
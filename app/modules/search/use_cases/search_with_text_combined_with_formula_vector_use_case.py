@@ -1,4 +1,8 @@
+from typing import TypedDict
+
 import numpy as np
+from services.cpu_executor import run_cpu_bound
+from services.elasticsearch_service import get_elasticsearch_service
 from app.modules.search.use_cases.search_text_field_use_case import (
     make_search_text_field_use_case,
 )
@@ -15,305 +19,310 @@ def weighted_score(text_score: float, formula_score: float, alpha: float, beta:
     return alpha * text_score + beta * formula_score
 
 
+def formula_weight(formula: np.ndarray) -> float:
+    return min(1.0, np.linalg.norm(formula) / 10)  # fórmula grande = peso maior
+
+
+def mean_formula_score(scores: list[float]) -> float:
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+class RetrievalCandidates(TypedDict):
+    """
+    Hits brutos de uma requisição, buscados uma única vez e compartilhados
+    por todos os approaches.
+
+    text_results: hits da busca vetorial de texto seguidos dos hits BM25
+    formula_results: uma lista de hits para cada fórmula da consulta
+    formula_weights: peso (tamanho) de cada fórmula, na mesma ordem
+    """
+
+    text_results: list[dict]
+    formula_results: list[list[dict]]
+    formula_weights: list[float]
+
+
+# -------------------- Scoring --------------------
+# Funções puras sobre o conjunto de candidatos: não fazem buscas nem alteram
+# os hits recebidos
+
+
+def _flatten_formula_results(candidates: RetrievalCandidates, weighted: bool):
+    flat_formula_results = []
+    for weight, results in zip(
+        candidates["formula_weights"], candidates["formula_results"]
+    ):
+        weight = weight if weighted else 1.0
+        for r in results:
+            flat_formula_results.append({**r, "score": r["score"] * weight})
+    return flat_formula_results
+
+
+def _combine(text_results, flat_formula_results, formula_map, top_k, alpha, beta):
+    text_map = {str(r["post_id"]): r["score"] for r in text_results}
+
+    # Combinação de scores
+    combined_scores = {}
+    all_post_ids = set(text_map) | set(formula_map)
+    for post_id in all_post_ids:
+        t_score = text_map.get(post_id, 0)
+        f_score = formula_map.get(post_id, 0)
+        combined_scores[post_id] = weighted_score(t_score, f_score, alpha, beta)
+
+    # Monta dicionário de docs, sem sobrescrever
+    id_to_doc = {}
+    for r in flat_formula_results:
+        post_id = str(r["post_id"])  # importante forçar str!
+        if post_id not in id_to_doc:
+            id_to_doc[post_id] = {"post_id": post_id}
+        id_to_doc[post_id]["_score_formula"] = r["score"]
+        if "source" in r:
+            id_to_doc[post_id].update(r["source"])
+    for r in text_results:
+        post_id = str(r["post_id"])  # importante forçar str!
+        if post_id not in id_to_doc:
+            id_to_doc[post_id] = {"post_id": post_id}
+        id_to_doc[post_id]["_score_text"] = r["score"]
+        if "source" in r:
+            id_to_doc[post_id].update(r["source"])
+
+    # Ordena pelo score combinado
+    sorted_ids = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[
+        :top_k
+    ]
+    return [
+        {**id_to_doc[pid], "_score": score}
+        for pid, score in sorted_ids
+        if pid in id_to_doc
+    ]
+
+
+def _score_max(candidates: RetrievalCandidates, top_k, alpha, beta, weighted):
+    flat_formula_results = _flatten_formula_results(candidates, weighted)
+    formula_map = {}
+    for r in flat_formula_results:
+        post_id = str(r["post_id"])
+        formula_map[post_id] = max(formula_map.get(post_id, 0), r["score"])
+
+    return _combine(
+        candidates["text_results"],
+        flat_formula_results,
+        formula_map,
+        top_k,
+        alpha,
+        beta,
+    )
+
+
+def _score_mean(candidates: RetrievalCandidates, top_k, alpha, beta, weighted):
+    flat_formula_results = _flatten_formula_results(candidates, weighted)
+    formula_score_map: dict[str, list[float]] = {}
+    for r in flat_formula_results:
+        formula_score_map.setdefault(str(r["post_id"]), []).append(r["score"])
+
+    formula_avg_map = {
+        post_id: mean_formula_score(scores)
+        for post_id, scores in formula_score_map.items()
+    }
+
+    return _combine(
+        candidates["text_results"],
+        flat_formula_results,
+        formula_avg_map,
+        top_k,
+        alpha,
+        beta,
+    )
+
+
+def score_individual_formula_max(
+    candidates: RetrievalCandidates, top_k: int = 10, alpha=0.5, beta=0.5
+):
+    """
+    Approach 01: combina resultados de texto com o maior score de qualquer fórmula individual dentro de um post.
+    """
+    return _score_max(candidates, top_k, alpha, beta, weighted=False)
+
+
+def score_mean_formula_score(
+    candidates: RetrievalCandidates, top_k: int = 10, alpha=0.5, beta=0.5
+):
+    """
+    Approach 02: combina os resultados de texto com a média dos scores de todas as fórmulas do post.
+    """
+    return _score_mean(candidates, top_k, alpha, beta, weighted=False)
+
+
+def score_individual_formula_max_weighted(
+    candidates: RetrievalCandidates, top_k: int = 10, alpha=0.5, beta=0.5
+):
+    """
+    Approach 03: igual ao approach 1, mas aplica um peso proporcional ao tamanho da fórmula em cada score.
+    """
+    return _score_max(candidates, top_k, alpha, beta, weighted=True)
+
+
+def score_mean_formula_score_weighted(
+    candidates: RetrievalCandidates, top_k: int = 10, alpha=0.5, beta=0.5
+):
+    """
+    Approach 04: igual ao approach 2, mas cada score de fórmula é ponderado pelo seu tamanho.
+    """
+    return _score_mean(candidates, top_k, alpha, beta, weighted=True)
+
+
+# Approaches executados pelo endpoint combinado. Novos approaches só precisam
+# de uma função de score registrada aqui.
+APPROACHES = {
+    "approach_1_individual_formula_max": score_individual_formula_max,
+    "approach_2_mean_formula_score": score_mean_formula_score,
+    "approach_3_individual_formula_max_weighted": score_individual_formula_max_weighted,
+    "approach_4_mean_formula_score_weighted": score_mean_formula_score_weighted,
+}
+
+
 class SearchWithTextCombinedWithFormulaVectorUseCase:
     def __init__(self, text: str, formula_vectors: list[list[float]]):
         self.text = text
         self.formula_vectors = [
             np.array(f) for f in formula_vectors if f is not None and len(f) > 0
         ]
+        # Candidatos já buscados nesta requisição, por top_k
+        self._candidates: dict[int, RetrievalCandidates] = {}
 
-    def _fetch_formula_results(self, formula_vector: np.ndarray, top_k: int):
-        return make_search_formula_vector_use_case().execute([formula_vector], top_k)
-
-    def _fetch_all_formula_results(self, top_k: int):
-        return make_search_formula_vector_use_case().execute(
-            self.formula_vectors, top_k
-        )
-
-    def _formula_weight(self, formula: np.ndarray) -> float:
-        return min(1.0, np.linalg.norm(formula) / 10)  # fórmula grande = peso maior
+        self.elasticsearch_service = get_elasticsearch_service()
+        self.text_vector_search = make_search_text_vector_use_case()
+        self.text_field_search = make_search_text_field_use_case()
+        self.formula_search = make_search_formula_vector_use_case("slt_vector")
 
-    def _mean_formula_score(self, scores: list[float]) -> float:
-        return sum(scores) / len(scores) if scores else 0.0
+    # -------------------- Retrieval --------------------
 
-    # -------------------- Approach 01 --------------------
+    def _candidates_from(self, text_results, formula_results) -> RetrievalCandidates:
+        return {
+            "text_results": text_results,
+            "formula_results": formula_results,
+            "formula_weights": [formula_weight(f) for f in self.formula_vectors],
+        }
 
-    def approach_1_individual_formula_max(
-        self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
-    ):
+    def _build_searches(self, top_k: int, query_vector):
         """
-        Combina resultados de texto com o maior score de qualquer fórmula individual dentro de um post.
+        Monta todas as buscas da requisição para um único _msearch: texto
+        vetorial (se houver vetor), texto BM25 e uma kNN por fórmula.
         """
-        # Busca textual
-        text_results = make_search_text_vector_use_case().execute(
-            self.text, top_k * 3, field_name="text_without_formula_vector"
-        )
-
-        text_results += make_search_text_field_use_case().execute(
-            "text_without_formula"
-        )
-
-        text_map = {str(r["post_id"]): r["score"] for r in text_results}
-
-        # Busca por cada fórmula (retorna uma lista de listas de resultados)
-        formula_results_nested = []
-        for formula_vector in self.formula_vectors:
-            results = make_search_formula_vector_use_case("slt_vector").execute(
-                formula_vector, top_k * 3
+        searches = []
+        if query_vector is not None:
+            searches.append(
+                self.text_vector_search.build_search(
+                    query_vector, top_k * 3, field_name="text_without_formula_vector"
+                )
             )
-            formula_results_nested.append(results)
-
-        # Flatten e pega maior score por post_id entre as fórmulas
-        formula_map = {}
-        flat_formula_results = []
-        for result_list in formula_results_nested:
-            for r in result_list:
-                post_id = str(r["post_id"])
-                score = r["score"]
-                flat_formula_results.append(r)
-                formula_map[post_id] = max(formula_map.get(post_id, 0), score)
-
-        # Combinação de scores
-        combined_scores = {}
-        all_post_ids = set(text_map.keys()) | set(formula_map.keys())
-        for post_id in all_post_ids:
-            t_score = text_map.get(post_id, 0)
-            f_score = formula_map.get(post_id, 0)
-            combined_scores[post_id] = weighted_score(t_score, f_score, alpha, beta)
-
-        # Monta dicionário de docs, sem sobrescrever
-        id_to_doc = {}
-
-        for r in flat_formula_results:
-            post_id = str(r["post_id"])  # importante forçar str!
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_formula"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-
-        for r in text_results:
-            post_id = str(r["post_id"])  # importante forçar str!
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_text"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-
-        # Ordena pelo score combinado
-        sorted_ids = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[
-            :top_k
+        searches.append(self.text_field_search.build_search("text_without_formula"))
+        searches += [
+            self.formula_search.build_search(formula_vector, top_k * 3)
+            for formula_vector in self.formula_vectors
         ]
-
-        return [
-            {**id_to_doc[post_id], "_score": score} for post_id, score in sorted_ids
+        return searches
+
+    def _demux_responses(self, responses, query_vector) -> RetrievalCandidates:
+        responses = list(responses)
+        text_results = []
+        if query_vector is not None:
+            text_results += self.text_vector_search.format_results(responses.pop(0))
+        text_results += self.text_field_search.format_results(responses.pop(0))
+
+        # Uma resposta por fórmula, na ordem de self.formula_vectors
+        formula_results = [
+            self.formula_search.format_results(response) for response in responses
         ]
+        return self._candidates_from(text_results, formula_results)
 
-    # -------------------- Approach 02 --------------------
-    def approach_2_mean_formula_score(
-        self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
-    ):
+    def retrieve_candidates(self, top_k: int) -> RetrievalCandidates:
         """
-        Combina os resultados de texto com a média dos scores de todas as fórmulas do post.
+        Executa cada busca (texto vetorial, texto BM25 e uma por fórmula) uma
+        única vez, em um único _msearch, e guarda os hits para os approaches.
         """
-        # Busca textual
-        text_results = make_search_text_vector_use_case().execute(
-            self.text, top_k * 3, field_name="text_without_formula_vector"
+        if top_k in self._candidates:
+            return self._candidates[top_k]
+
+        query_vector = self.text_vector_search.get_text_vector_use_case.execute(
+            self.text
+        )
+        responses = self.elasticsearch_service.msearch(
+            self._build_searches(top_k, query_vector)
         )
 
-        text_results += make_search_text_field_use_case().execute(
-            "text_without_formula"
+        self._candidates[top_k] = self._demux_responses(responses, query_vector)
+        return self._candidates[top_k]
+
+    async def retrieve_candidates_async(self, top_k: int) -> RetrievalCandidates:
+        """Versão assíncrona de retrieve_candidates()."""
+        if top_k in self._candidates:
+            return self._candidates[top_k]
+
+        query_vector = await run_cpu_bound(
+            self.text_vector_search.get_text_vector_use_case.execute, self.text
+        )
+        responses = await self.elasticsearch_service.msearch_async(
+            self._build_searches(top_k, query_vector)
         )
 
-        text_map = {str(r["post_id"]): r["score"] for r in text_results}
+        self._candidates[top_k] = self._demux_responses(responses, query_vector)
+        return self._candidates[top_k]
 
-        formula_results_nested = []
-        for formula_vector in self.formula_vectors:
-            results = make_search_formula_vector_use_case("slt_vector").execute(
-                formula_vector, top_k * 3
-            )
-            formula_results_nested.append(results)
-
-        formula_score_map: dict[str, list[float]] = {}
-        flat_formula_results = []
-        for result_list in formula_results_nested:
-            for r in result_list:
-                post_id = str(r["post_id"])
-                flat_formula_results.append(r)
-                formula_score_map.setdefault(post_id, []).append(r["score"])
-
-        formula_avg_map = {
-            post_id: sum(scores) / len(scores)
-            for post_id, scores in formula_score_map.items()
+    def execute_all(self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5):
+        """Executa todos os approaches registrados sobre os mesmos candidatos"""
+        candidates = self.retrieve_candidates(top_k)
+        return {
+            name: score(candidates, top_k, alpha, beta)
+            for name, score in APPROACHES.items()
         }
 
-        combined_scores = {}
-        all_post_ids = set(text_map) | set(formula_avg_map)
-        for post_id in all_post_ids:
-            t_score = text_map.get(post_id, 0)
-            f_score = formula_avg_map.get(post_id, 0)
-            combined_scores[post_id] = weighted_score(t_score, f_score, alpha, beta)
-
-        id_to_doc = {}
-        for r in flat_formula_results:
-            post_id = str(r["post_id"])
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_formula"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-        for r in text_results:
-            post_id = str(r["post_id"])
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_text"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-
-        sorted_ids = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[
-            :top_k
-        ]
-        return [
-            {**id_to_doc[pid], "_score": score}
-            for pid, score in sorted_ids
-            if pid in id_to_doc
-        ]
+    async def execute_all_async(
+        self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
+    ):
+        """Versão assíncrona de execute_all()"""
+        candidates = await self.retrieve_candidates_async(top_k)
+        return {
+            name: score(candidates, top_k, alpha, beta)
+            for name, score in APPROACHES.items()
+        }
 
-    # -------------------- Approach 03 --------------------
-    def approach_3_individual_formula_max_weighted(
+    # -------------------- Approach 01 --------------------
+
+    def approach_1_individual_formula_max(
         self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
     ):
-        """
-        Igual ao approach 1, mas aplica um peso proporcional ao tamanho da fórmula em cada score.
-        """
-        # Busca textual
-        text_results = make_search_text_vector_use_case().execute(
-            self.text, top_k * 3, field_name="text_without_formula_vector"
+        return score_individual_formula_max(
+            self.retrieve_candidates(top_k), top_k, alpha, beta
         )
 
-        text_results += make_search_text_field_use_case().execute(
-            "text_without_formula"
-        )
+    # -------------------- Approach 02 --------------------
 
-        text_map = {str(r["post_id"]): r["score"] for r in text_results}
+    def approach_2_mean_formula_score(
+        self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
+    ):
+        return score_mean_formula_score(
+            self.retrieve_candidates(top_k), top_k, alpha, beta
+        )
 
-        formula_map = {}
-        flat_formula_results = []
-        for formula_vector in self.formula_vectors:
-            weight = self._formula_weight(formula_vector)
-            results = make_search_formula_vector_use_case("slt_vector").execute(
-                formula_vector, top_k * 3
-            )
-            for r in results:
-                post_id = str(r["post_id"])
-                weighted_score_value = r["score"] * weight
-                r["score"] = weighted_score_value
-                flat_formula_results.append(r)
-                formula_map[post_id] = max(
-                    formula_map.get(post_id, 0), weighted_score_value
-                )
+    # -------------------- Approach 03 --------------------
 
-        combined_scores = {}
-        all_post_ids = set(text_map) | set(formula_map)
-        for post_id in all_post_ids:
-            t_score = text_map.get(post_id, 0)
-            f_score = formula_map.get(post_id, 0)
-            combined_scores[post_id] = weighted_score(t_score, f_score, alpha, beta)
-
-        id_to_doc = {}
-        for r in flat_formula_results:
-            post_id = str(r["post_id"])
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_formula"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-        for r in text_results:
-            post_id = str(r["post_id"])
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_text"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-
-        sorted_ids = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[
-            :top_k
-        ]
-        return [
-            {**id_to_doc[pid], "_score": score}
-            for pid, score in sorted_ids
-            if pid in id_to_doc
-        ]
+    def approach_3_individual_formula_max_weighted(
+        self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
+    ):
+        return score_individual_formula_max_weighted(
+            self.retrieve_candidates(top_k), top_k, alpha, beta
+        )
 
     # -------------------- Approach 04 --------------------
+
     def approach_4_mean_formula_score_weighted(
         self, top_k: int = 10, alpha: float = 0.5, beta: float = 0.5
     ):
-        """
-        Igual ao approach 2, mas cada score de fórmula é ponderado pelo seu tamanho.
-        """
-        # Busca textual
-        text_results = make_search_text_vector_use_case().execute(
-            self.text, top_k * 3, field_name="text_without_formula_vector"
+        return score_mean_formula_score_weighted(
+            self.retrieve_candidates(top_k), top_k, alpha, beta
         )
 
-        text_results += make_search_text_field_use_case().execute(
-            "text_without_formula"
-        )
-
-        text_map = {str(r["post_id"]): r["score"] for r in text_results}
-
-        formula_score_map: dict[str, list[float]] = {}
-        flat_formula_results = []
-        for formula_vector in self.formula_vectors:
-            weight = self._formula_weight(formula_vector)
-            results = make_search_formula_vector_use_case("slt_vector").execute(
-                formula_vector, top_k * 3
-            )
-            for r in results:
-                post_id = str(r["post_id"])
-                weighted_score_value = r["score"] * weight
-                r["score"] = weighted_score_value
-                flat_formula_results.append(r)
-                formula_score_map.setdefault(post_id, []).append(weighted_score_value)
-
-        formula_avg_map = {
-            post_id: sum(scores) / len(scores)
-            for post_id, scores in formula_score_map.items()
-        }
-
-        combined_scores = {}
-        all_post_ids = set(text_map) | set(formula_avg_map)
-        for post_id in all_post_ids:
-            t_score = text_map.get(post_id, 0)
-            f_score = formula_avg_map.get(post_id, 0)
-            combined_scores[post_id] = weighted_score(t_score, f_score, alpha, beta)
-
-        id_to_doc = {}
-        for r in flat_formula_results:
-            post_id = str(r["post_id"])
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_formula"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-        for r in text_results:
-            post_id = str(r["post_id"])
-            if post_id not in id_to_doc:
-                id_to_doc[post_id] = {"post_id": post_id}
-            id_to_doc[post_id]["_score_text"] = r["score"]
-            if "source" in r:
-                id_to_doc[post_id].update(r["source"])
-
-        sorted_ids = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[
-            :top_k
-        ]
-        return [
-            {**id_to_doc[pid], "_score": score}
-            for pid, score in sorted_ids
-            if pid in id_to_doc
-        ]
-
     # -------------------- Approach 05 --------------------
 
 
@@ -1,4 +1,8 @@
-from services.elasticsearch_service import ElasticsearchService
+from services.elasticsearch_service import (
+    ElasticsearchService,
+    get_elasticsearch_service,
+)
+from services.cpu_executor import run_cpu_bound
 from app.modules.embedding.use_cases.get_text_vector import (
     make_get_text_vector_use_case,
 )
@@ -35,43 +39,89 @@ class SearchTextVectorUseCase:
                 print("Failed to generate embedding for query")
                 return []
 
-            search_query = {
-                "knn": {
-                    "field": field_name,
-                    "query_vector": query_vector,
-                    "k": size,
-                    "num_candidates": size * 2,
-                }
-            }
             # Executa a busca
-            results = self.elasticsearch_service.es.knn_search(
-                index=self.elasticsearch_service.posts_index_name, body=search_query
+            results = self.elasticsearch_service.search_client().knn_search(
+                index=self.elasticsearch_service.posts_index_name,
+                body=self._build_query(query_vector, size, field_name),
             )
-            # Extrai e formata os resultados
-            hits = results["hits"]["hits"]
-            formatted_results = []
-
-            for hit in hits:
-                source = hit["_source"]
-                formatted_results.append(
-                    {
-                        "post_id": source.get("post_id"),
-                        "text": source.get("text"),
-                        "text_without_formula": source.get("text_without_formula"),
-                        "score": hit["_score"],
-                    }
-                )
-
-            return formatted_results
+            return self.format_results(results)
 
         except Exception as e:
             print(f"Error searching with text vector: {str(e)}")
             return []
 
+    async def execute_async(
+        self, query: str, size: int = 10, field_name: str = "text_without_html_vector"
+    ) -> List[Dict[str, Any]]:
+        """
+        Versão assíncrona de execute(). O embedding da consulta roda no
+        executor limitado e a busca usa o AsyncElasticsearch.
+        """
+        try:
+            query_vector = await run_cpu_bound(
+                self.get_text_vector_use_case.execute, query
+            )
+            if query_vector is None:
+                print("Failed to generate embedding for query")
+                return []
+
+            results = await self.elasticsearch_service.async_search_client().knn_search(
+                index=self.elasticsearch_service.posts_index_name,
+                body=self._build_query(query_vector, size, field_name),
+            )
+            return self.format_results(results)
+
+        except Exception as e:
+            print(f"Error searching with text vector: {str(e)}")
+            return []
+
+    def build_search(
+        self,
+        query_vector,
+        size: int = 10,
+        field_name: str = "text_without_html_vector",
+    ):
+        """
+        Monta o par (índice, corpo) da busca kNN para um vetor de consulta já
+        calculado, para ser enviado com ElasticsearchService.msearch().
+        """
+        body = {**self._build_query(query_vector, size, field_name), "size": size}
+        return self.elasticsearch_service.posts_index_name, body
+
+    @staticmethod
+    def _build_query(query_vector, size: int, field_name: str) -> Dict[str, Any]:
+        return {
+            "knn": {
+                "field": field_name,
+                "query_vector": query_vector,
+                "k": size,
+                "num_candidates": size * 2,
+            }
+        }
+
+    @staticmethod
+    def format_results(results) -> List[Dict[str, Any]]:
+        # Extrai e formata os resultados
+        hits = results["hits"]["hits"]
+        formatted_results = []
+
+        for hit in hits:
+            source = hit["_source"]
+            formatted_results.append(
+                {
+                    "post_id": source.get("post_id"),
+                    "text": source.get("text"),
+                    "text_without_formula": source.get("text_without_formula"),
+                    "score": hit["_score"],
+                }
+            )
+
+        return formatted_results
+
 
 def make_search_text_vector_use_case():
     """
     Factory function para criar o caso de uso de busca vetorial de texto.
     """
-    elasticsearch_service = ElasticsearchService()
+    elasticsearch_service = get_elasticsearch_service()
     return SearchTextVectorUseCase(elasticsearch_service)
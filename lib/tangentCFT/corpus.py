@@ -0,0 +1,129 @@
+import os
+
+from lib.tangentCFT.touple_encoder.encoder import TupleTokenizationMode
+
+# How the formulas of each model are read and encoded (the same encoder parameters as
+# EncodeFormulaTuplesUseCaseParams, used to embed formulas at indexing and query time)
+REPRESENTATIONS = {
+    "SLT": {
+        "read_slt": True,
+        "encoder_type": "SLT",
+        "embedding_type": TupleTokenizationMode.Both_Separated,
+        "tokenize_numbers": True,
+    },
+    "SLT_TYPE": {
+        "read_slt": True,
+        "encoder_type": "SLT_TYPE",
+        "embedding_type": TupleTokenizationMode.Type,
+        "tokenize_numbers": False,
+    },
+    "OPT": {
+        "read_slt": False,
+        "encoder_type": "OPT",
+        "embedding_type": TupleTokenizationMode.Both_Separated,
+        "tokenize_numbers": False,
+    },
+}
+
+
+class CorpusFileWriter:
+    """
+    Writes encoded formulas to a line-oriented corpus file, the input of FastText's corpus_file training mode: one
+    formula per line, its encoded tuples separated by spaces. Reading the file back splits lines on whitespace, so
+    tuples containing whitespace are left out (and counted) instead of being split into other words.
+
+    The file is written next to its final path and moved there on close(), so an interrupted run never leaves a
+    truncated corpus behind.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._temp_path = path + ".tmp"
+        self._file = open(self._temp_path, "w", encoding="utf-8")
+        self.formulas = 0
+        self.tuples = 0
+        self.skipped_tuples = 0
+
+    def write(self, encoded_tuples):
+        words = []
+        for encoded_tuple in encoded_tuples:
+            if encoded_tuple and encoded_tuple.split() == [encoded_tuple]:
+                words.append(encoded_tuple)
+            else:
+                self.skipped_tuples += 1
+        if not words:
+            return
+        self._file.write(" ".join(words))
+        self._file.write("\n")
+        self.formulas += 1
+        self.tuples += len(words)
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def report(self):
+        print(
+            f"Corpus {self.path}: {self.formulas} formulas, {self.tuples} tuples"
+            + (f", {self.skipped_tuples} tuples with whitespace skipped" if self.skipped_tuples else "")
+        )
+
+
+def write_corpus_file(path, lst_lst_encoded_tuples):
+    """
+    Writes the encoded formulas (any iterable of lists of encoded tuples) to a corpus file
+    :return: the closed CorpusFileWriter, with the counts of what was written
+    """
+    with CorpusFileWriter(path) as writer:
+        for encoded_tuples in lst_lst_encoded_tuples:
+            writer.write(encoded_tuples)
+    return writer
+
+
+def iter_corpus_file(path):
+    """Reads a corpus file back, one list of encoded tuples per formula"""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            words = line.split()
+            if words:
+                yield words
+
+
+def encode_formulas(encoder_manager, dictionary_formula_tuples, representation):
+    """
+    Encodes the tuples of each formula as the given representation (key of REPRESENTATIONS)
+    :return: dictionary of formula id and list of encoded tuples
+    """
+    params = REPRESENTATIONS[representation]
+    return {
+        formula_id: encoder_manager.encode_tuples(
+            tuples,
+            encoder_type=params["encoder_type"],
+            embedding_type=params["embedding_type"],
+            tokenize_numbers=params["tokenize_numbers"],
+        )
+        for formula_id, tuples in dictionary_formula_tuples.items()
+    }
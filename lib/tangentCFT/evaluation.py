@@ -0,0 +1,147 @@
+"""
+In-process evaluation of formula retrieval runs on the NTCIR-12 Wiki formula browsing task, so a trained model can be
+scored without writing result files and calling trec_eval.
+
+bpref follows trec_eval: documents are ranked by score (ties broken by document id, descending), only the top
+`cutoff` documents of each query are considered and the mean is over the queries of the run that are in the judge
+file. The NTCIR-12 judgements are 0-4 (the sum of two assessors' 0-2 scores); full relevance is 3 or more and partial
+relevance 1 or more.
+"""
+import numpy
+
+NTCIR12_QUERY_PREFIX = "NTCIR12-MathWiki-"
+FULL_RELEVANCE = 3
+PARTIAL_RELEVANCE = 1
+CUTOFF = 1000
+
+
+def read_qrels(judge_file_path):
+    """
+    Reads a judge file in trec_eval format (query_id iteration doc_id relevance)
+    :return: dictionary of query id and dictionary of judged doc id and relevance
+    """
+    qrels = {}
+    with open(judge_file_path, encoding="utf-8") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) < 4:
+                continue
+            qrels.setdefault(parts[0], {})[parts[2]] = float(parts[3])
+    return qrels
+
+
+def read_run(result_file_path):
+    """
+    Reads a result file in trec_eval format (query_id iteration doc_id rank score run_id)
+    :return: dictionary of query id and dictionary of doc id and score
+    """
+    run = {}
+    with open(result_file_path, encoding="utf-8") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            run.setdefault(parts[0], {})[parts[2]] = float(parts[4])
+    return run
+
+
+def run_from_retrieval(retrieval_result, query_prefix=NTCIR12_QUERY_PREFIX):
+    """Converts the retrieval result of the back end (query number -> doc id -> score) to a run"""
+    return {
+        query_prefix + str(query): {doc_id: float(score) for doc_id, score in docs.items()}
+        for query, docs in retrieval_result.items()
+    }
+
+
+def write_run(run, result_file_path, run_id):
+    """Writes a run in the same format as TangentCFTBackEnd.create_result_file"""
+    with open(result_file_path, "w", encoding="utf-8") as file:
+        for query_id, docs in run.items():
+            for rank, (doc_id, score) in enumerate(_ranked(docs), start=1):
+                file.write(f"{query_id} xxx {doc_id} {rank} {score} Run_{run_id}\n")
+
+
+def bpref(qrels, run, relevance_level=PARTIAL_RELEVANCE, cutoff=CUTOFF):
+    """
+    :return: (mean bpref, dictionary of query id and bpref)
+    """
+    per_query = {}
+    for query_id, docs in run.items():
+        judged = qrels.get(query_id)
+        if judged is None:
+            continue
+        relevant = sum(1 for relevance in judged.values() if relevance >= relevance_level)
+        non_relevant = len(judged) - relevant
+        if relevant == 0:
+            per_query[query_id] = 0.0
+            continue
+
+        score = 0.0
+        non_relevant_above = 0
+        for doc_id, _ in _ranked(docs)[:cutoff]:
+            relevance = judged.get(doc_id)
+            if relevance is None:
+                continue
+            if relevance >= relevance_level:
+                if non_relevant_above > 0:
+                    score += 1.0 - min(non_relevant_above, relevant) / min(relevant, non_relevant)
+                else:
+                    score += 1.0
+            else:
+                non_relevant_above += 1
+        per_query[query_id] = score / relevant
+
+    mean = sum(per_query.values()) / len(per_query) if per_query else 0.0
+    return mean, per_query
+
+
+def evaluate(qrels, run, cutoff=CUTOFF):
+    """bpref with full and partial relevance, as reported for Tangent-CFT"""
+    return {
+        "bpref_full": bpref(qrels, run, FULL_RELEVANCE, cutoff)[0],
+        "bpref_partial": bpref(qrels, run, PARTIAL_RELEVANCE, cutoff)[0],
+    }
+
+
+def retrieve(service, collection, queries, top_k=CUTOFF, batch_size=50000):
+    """
+    Cosine-similarity retrieval of the queries over the collection with the model of a TangentCFTService, in numpy
+    (same ranking as TangentCFTService.formula_retrieval, without building a float64 tensor of the collection).
+    :param collection: dictionary of formula id and list of encoded tuples
+    :param queries: dictionary of query number and list of encoded tuples
+    :return: retrieval result, query number -> doc id -> score
+    """
+    formula_ids = []
+    blocks = []
+    items = list(collection.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start : start + batch_size]
+        vectors = service.embed_many([encoded_tuples for _, encoded_tuples in batch])
+        # Formulas without any resolvable tuple are left out, as in index_collection_to_tensors
+        valid = ~numpy.isnan(vectors).any(axis=1)
+        formula_ids.extend(formula_id for (formula_id, _), keep in zip(batch, valid) if keep)
+        blocks.append(_normalize(vectors[valid]))
+    collection_vectors = numpy.concatenate(blocks) if blocks else numpy.zeros((0, 1), dtype=numpy.float32)
+
+    query_numbers = list(queries)
+    query_vectors = _normalize(service.embed_many([queries[query] for query in query_numbers]))
+    result = {}
+    for query, query_vector in zip(query_numbers, query_vectors):
+        if numpy.isnan(query_vector).any():
+            continue
+        scores = collection_vectors @ query_vector
+        k = min(top_k, len(scores))
+        top = numpy.argpartition(-scores, k - 1)[:k] if k else numpy.zeros(0, dtype=numpy.int64)
+        top = top[numpy.argsort(-scores[top], kind="stable")]
+        result[query] = {formula_ids[row]: float(scores[row]) for row in top}
+    return result
+
+
+def _normalize(vectors):
+    norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(numpy.float32)
+
+
+def _ranked(docs):
+    return sorted(docs.items(), key=lambda item: (item[1], item[0]), reverse=True)
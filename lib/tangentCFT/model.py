@@ -1,6 +1,18 @@
 from gensim.models import FastText
 from gensim.models.callbacks import CallbackAny2Vec
+from gensim.models.fasttext import ft_ngram_hashes
 import datetime
+import json
+import os
+import resource
+import time
+import numpy
+
+from lib.tangentCFT.corpus import write_corpus_file
+from lib.tangentCFT.tuple_vector_table import TupleVectorTable
+
+# Epochs over the new formulas in an incremental update
+INCREMENTAL_EPOCHS = 5
 
 
 class ProgressCallback(CallbackAny2Vec):
@@ -15,17 +27,255 @@ class ProgressCallback(CallbackAny2Vec):
         self.epoch += 1
 
 
+def process_rss_mb():
+    """Current RSS of the process (Linux: /proc/self/statm), or its peak RSS where that is not available"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class TrainingTelemetryCallback(CallbackAny2Vec):
+    """
+    Per-epoch telemetry of a training run: elapsed time, words/sec, ETA and process RSS. Each record is kept in
+    `records`, appended as a JSON line to `path` (if given) and passed to `reporter` (default: printed).
+
+    words/sec counts the raw words of an epoch (model.corpus_total_words), before frequent-word downsampling. gensim's
+    FastText does not compute a training loss (get_latest_training_loss() is always 0), so `loss` is only filled in
+    for models trained with compute_loss=True and is None otherwise.
+
+    gensim saves the callbacks together with the model, so the reporter is left out when the callback is pickled
+    (it can be a lambda or a bound method) and `records` is the only state kept.
+    """
+
+    def __init__(self, path=None, reporter=None, run_id=None):
+        self.path = path
+        self.reporter = reporter
+        self.run_id = run_id
+        self.records = []
+        self.epoch = 0
+        self._train_start = None
+        self._epoch_start = None
+        self._loss = 0.0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["reporter"] = None
+        return state
+
+    def on_train_begin(self, model):
+        self.epoch = 0
+        self._loss = 0.0
+        self._train_start = time.perf_counter()
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def on_epoch_begin(self, model):
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, model):
+        now = time.perf_counter()
+        self.epoch += 1
+        epoch_seconds = now - self._epoch_start
+        elapsed_seconds = now - self._train_start
+        words = int(model.corpus_total_words or 0)
+        loss = None
+        if getattr(model, "compute_loss", False):
+            # O loss do gensim é acumulado no treino inteiro
+            total_loss = model.get_latest_training_loss()
+            loss = total_loss - self._loss
+            self._loss = total_loss
+        record = {
+            "run_id": self.run_id,
+            "epoch": self.epoch,
+            "epochs": model.epochs,
+            "loss": loss,
+            "words": words,
+            "epoch_seconds": round(epoch_seconds, 3),
+            "words_per_sec": round(words / epoch_seconds, 1) if epoch_seconds > 0 else None,
+            "elapsed_seconds": round(elapsed_seconds, 3),
+            "eta_seconds": round(elapsed_seconds / self.epoch * (model.epochs - self.epoch), 3),
+            "rss_mb": round(process_rss_mb(), 1),
+            "workers": model.workers,
+        }
+        self.records.append(record)
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record) + "\n")
+        (self.reporter or print_telemetry)(record)
+
+    def summary(self):
+        """Totals of the run: epochs, train seconds, mean words/sec and max RSS"""
+        if not self.records:
+            return {}
+        speeds = [record["words_per_sec"] for record in self.records if record["words_per_sec"]]
+        return {
+            "epochs": len(self.records),
+            "seconds": self.records[-1]["elapsed_seconds"],
+            "words_per_sec": round(sum(speeds) / len(speeds), 1) if speeds else None,
+            "max_rss_mb": max(record["rss_mb"] for record in self.records),
+        }
+
+
+def print_telemetry(record):
+    print(
+        (f"[{record['run_id']}] " if record["run_id"] else "")
+        + f"Época {record['epoch']}/{record['epochs']} completa em {record['epoch_seconds']:.1f}s: "
+        f"{record['words_per_sec'] or 0:.0f} words/sec, ETA {record['eta_seconds']:.0f}s, RSS {record['rss_mb']:.0f} MB"
+        + (f", loss {record['loss']:.4f}" if record["loss"] is not None else "")
+    )
+
+
+def read_telemetry(path):
+    """Reads back the records of a telemetry JSONL file"""
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class CompactFastTextVectors:
+    """
+    Inference-only counterpart of gensim's FastTextKeyedVectors: the vocabulary vectors plus only the n-gram buckets
+    hit by the vocabulary, optionally stored as float16. It exposes the attributes TangentCftModel reads from
+    model.wv, so the same lookups are served from it.
+
+    Vocabulary vectors are the same as the full model's, but out-of-vocabulary keys are composed without the pruned
+    buckets and get other vectors: formulas indexed with the full model do not match queries embedded with the
+    artifact. The formulas index records the format it was embedded with (CFT_MODEL_FORMAT), and switching to the
+    artifact requires indexing the formulas again.
+    """
+
+    VECTORS_SUFFIX = ".inference.vectors.npy"
+    NGRAMS_SUFFIX = ".inference.ngrams.npy"
+    BUCKETS_SUFFIX = ".inference.buckets.npy"
+    META_SUFFIX = ".inference.json"
+
+    def __init__(self, index_to_key, vectors, ngram_vectors, bucket_rows, min_n, max_n, bucket):
+        self.index_to_key = index_to_key
+        self.key_to_index = {key: index for index, key in enumerate(index_to_key)}
+        self.vectors = vectors
+        self.ngram_vectors = ngram_vectors
+        # Row of each original bucket in ngram_vectors, -1 for pruned buckets
+        self.bucket_rows = bucket_rows
+        self.min_n = min_n
+        self.max_n = max_n
+        self.bucket = bucket
+        self.vector_size = vectors.shape[1]
+
+    def __getitem__(self, key):
+        index = self.key_to_index.get(key)
+        if index is not None:
+            return self.vectors[index].astype(numpy.float32)
+        vector = self.ngram_vector(key)
+        if vector is None:
+            raise KeyError(f"cannot calculate vector for {key!r}, all its n-grams were pruned")
+        return vector
+
+    def ngram_vector(self, key):
+        """
+        Composes the vector of an out-of-vocabulary key from its n-grams. Buckets that no vocabulary word hits were
+        never updated during training (they only hold their random initialization), so they are pruned and left out
+        of the mean; keys whose n-grams were all pruned cannot be resolved and None is returned.
+        """
+        ngram_hashes = ft_ngram_hashes(key, self.min_n, self.max_n, self.bucket)
+        if not ngram_hashes:
+            # Same as gensim: a key without n-grams gets the origin vector
+            return numpy.zeros(self.vector_size, dtype=numpy.float32)
+        rows = self.bucket_rows[ngram_hashes]
+        rows = rows[rows >= 0]
+        if not len(rows):
+            return None
+        return self.ngram_vectors[rows].mean(axis=0, dtype=numpy.float32)
+
+    @classmethod
+    def from_fasttext(cls, wv, float16=False):
+        """Prunes the n-gram buckets of a trained FastTextKeyedVectors"""
+        dtype = numpy.float16 if float16 else numpy.float32
+        used_buckets = numpy.unique(
+            numpy.fromiter(
+                (
+                    ngram_hash
+                    for key in wv.index_to_key
+                    for ngram_hash in ft_ngram_hashes(key, wv.min_n, wv.max_n, wv.bucket)
+                ),
+                dtype=numpy.int64,
+            )
+        )
+        bucket_rows = numpy.full(wv.bucket, -1, dtype=numpy.int32)
+        bucket_rows[used_buckets] = numpy.arange(len(used_buckets), dtype=numpy.int32)
+        return cls(
+            list(wv.index_to_key),
+            wv.vectors.astype(dtype),
+            wv.vectors_ngrams[used_buckets].astype(dtype),
+            bucket_rows,
+            wv.min_n,
+            wv.max_n,
+            wv.bucket,
+        )
+
+    def save(self, model_file_path):
+        numpy.save(model_file_path + self.VECTORS_SUFFIX, self.vectors)
+        numpy.save(model_file_path + self.NGRAMS_SUFFIX, self.ngram_vectors)
+        numpy.save(model_file_path + self.BUCKETS_SUFFIX, self.bucket_rows)
+        with open(model_file_path + self.META_SUFFIX, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "min_n": self.min_n,
+                    "max_n": self.max_n,
+                    "bucket": self.bucket,
+                    "index_to_key": self.index_to_key,
+                },
+                file,
+                ensure_ascii=False,
+            )
+
+    @classmethod
+    def load(cls, model_file_path, mmap_mode=None):
+        with open(model_file_path + cls.META_SUFFIX, encoding="utf-8") as file:
+            meta = json.load(file)
+        return cls(
+            meta["index_to_key"],
+            numpy.load(model_file_path + cls.VECTORS_SUFFIX, mmap_mode=mmap_mode),
+            numpy.load(model_file_path + cls.NGRAMS_SUFFIX, mmap_mode=mmap_mode),
+            numpy.load(model_file_path + cls.BUCKETS_SUFFIX, mmap_mode=mmap_mode),
+            meta["min_n"],
+            meta["max_n"],
+            meta["bucket"],
+        )
+
+    @classmethod
+    def exists(cls, model_file_path):
+        return os.path.exists(model_file_path + cls.META_SUFFIX)
+
+
+class CompactFastText:
+    """Holds CompactFastTextVectors under .wv, the same way gensim's FastText holds its keyed vectors"""
+
+    def __init__(self, wv):
+        self.wv = wv
+
+
 class TangentCftModel:
     def __init__(
         self,
     ):
         self.model = None
+        self.tuple_table = None
 
-    def train(self, config, fast_text_train_data):
+    def train(self, config, fast_text_train_data=None, corpus_file=None, seed=1, telemetry=None):
         """
-        Takes in the fastText parameters and the train data and trains the FastText model
+        Takes in the fastText parameters and the train data and trains the FastText model.
+        With corpus_file the model is trained with gensim's corpus_file mode, where each worker thread reads its own
+        part of a line-oriented corpus file (see lib/tangentCFT/corpus.py), so training scales with config.workers
+        instead of being bound by a single Python thread feeding the workers. If fast_text_train_data is also given,
+        it is written to corpus_file first; otherwise corpus_file must already exist.
         :param config: configuration for fastText model
-        :param fast_text_train_data: train data
+        :param fast_text_train_data: train data, list of formulas as lists of encoded tuples
+        :param corpus_file: path of the corpus file to train from
+        :param seed: seed of the random number generator of the model
+        :param telemetry: TrainingTelemetryCallback recording the epochs (default: one that only prints them)
         :return:
         """
         size = config.vector_size
@@ -37,37 +287,186 @@ class TangentCftModel:
         min_n = int(config.min)
         max_n = int(config.max)
         word_ngrams = int(config.ngram)
+        workers = config.get_workers(corpus_file=corpus_file is not None)
+
+        if corpus_file is not None and fast_text_train_data is not None:
+            write_start_time = datetime.datetime.now()
+            writer = write_corpus_file(corpus_file, fast_text_train_data)
+            writer.report()
+            print(f"Corpus written in {datetime.datetime.now() - write_start_time}")
+            fast_text_train_data = None
 
-        # Criar o objeto do callback para mostrar o progresso
-        progress_callback = ProgressCallback()
+        # Callback que mostra o progresso e registra a telemetria de cada época
+        if telemetry is None:
+            telemetry = TrainingTelemetryCallback()
 
         train_start_time = datetime.datetime.now()
-        print("Training the model")
+        print(f"Training the model with {workers} workers" + (f" from {corpus_file}" if corpus_file else ""))
         self.model = FastText(
             fast_text_train_data,
+            corpus_file=corpus_file,
             vector_size=size,
             window=window,
             sg=sg,
             hs=hs,
-            workers=1,
+            workers=workers,
             negative=negative,
             epochs=iteration,
             min_n=min_n,
             max_n=max_n,
             word_ngrams=word_ngrams,
-            callbacks=[progress_callback],
+            seed=seed,
+            callbacks=[telemetry],
         )
 
         train_end_time = datetime.datetime.now()
         "Returns the train time of the model"
         return train_end_time - train_start_time
 
+    def update(
+        self, fast_text_train_data=None, corpus_file=None, epochs=INCREMENTAL_EPOCHS, workers=None, telemetry=None
+    ):
+        """
+        Incremental training of the loaded model on new formulas only: the vocabulary is extended with the new
+        tuples (build_vocab with update=True) and the model is trained for a few epochs over the new data. Only the
+        vectors of the tuples in the new data, and the n-gram buckets they use, are changed.
+        The model must be the full FastText model, loaded without mmap. A loaded tuple-vector table is dropped, since
+        its vectors are stale after the update.
+        :param fast_text_train_data: new formulas, list of lists of encoded tuples
+        :param corpus_file: corpus file of the new formulas (see lib/tangentCFT/corpus.py), instead of the list
+        :param epochs: epochs over the new data
+        :param workers: worker threads (default: the ones the model was trained with)
+        :param telemetry: TrainingTelemetryCallback recording the epochs (default: one that only prints them)
+        :return: the update time
+        """
+        if not isinstance(self.model, FastText):
+            raise ValueError("Only a full FastText model can be updated, not an inference-only model")
+        if workers:
+            self.model.workers = workers
+        self.tuple_table = None
+        if telemetry is None:
+            telemetry = TrainingTelemetryCallback()
+
+        start_time = datetime.datetime.now()
+        print(f"Updating the model with {epochs} epochs over the new formulas")
+        if corpus_file is not None:
+            self.model.build_vocab(corpus_file=corpus_file, update=True)
+            self.model.train(
+                corpus_file=corpus_file,
+                total_examples=self.model.corpus_count,
+                total_words=self.model.corpus_total_words,
+                epochs=epochs,
+                callbacks=[telemetry],
+            )
+        else:
+            self.model.build_vocab(corpus_iterable=fast_text_train_data, update=True)
+            self.model.train(
+                corpus_iterable=fast_text_train_data,
+                total_examples=self.model.corpus_count,
+                epochs=epochs,
+                callbacks=[telemetry],
+            )
+        return datetime.datetime.now() - start_time
+
+    def touched_buckets(self, encoded_tuples):
+        """
+        Boolean mask of the n-gram buckets used by the given tuples, i.e. the buckets that training on them can change
+        """
+        wv = self.model.wv
+        mask = numpy.zeros(wv.bucket, dtype=bool)
+        for encoded_tuple in encoded_tuples:
+            mask[ft_ngram_hashes(encoded_tuple, wv.min_n, wv.max_n, wv.bucket)] = True
+        return mask
+
+    def keys_using_buckets(self, bucket_mask):
+        """Vocabulary keys with at least one n-gram in the masked buckets"""
+        wv = self.model.wv
+        return [
+            key
+            for key, buckets in zip(wv.index_to_key, wv.buckets_word)
+            if len(buckets) and bucket_mask[buckets].any()
+        ]
+
     def save_model(self, model_file_path):
         file_name = model_file_path + ".wv.vectors.npy"
         self.model.save(file_name)
 
-    def load_model(self, model_file_path):
-        self.model = FastText.load(model_file_path + ".wv.vectors.npy")
+    def load_model(self, model_file_path, mmap=None):
+        """
+        :param mmap: "r" maps the large arrays read-only instead of reading them, so processes loading the same
+        model share its pages
+        """
+        self.model = FastText.load(model_file_path + ".wv.vectors.npy", mmap=mmap)
+
+    def export_inference_model(self, model_file_path, float16=False):
+        """
+        Writes the inference-only artifact of the loaded model next to model_file_path
+        """
+        CompactFastTextVectors.from_fasttext(self.model.wv, float16=float16).save(model_file_path)
+
+    def load_inference_model(self, model_file_path, mmap=None):
+        """
+        Loads the inference-only artifact written by export_inference_model(). The model can then be used for
+        lookups, but not for training.
+        """
+        self.model = CompactFastText(CompactFastTextVectors.load(model_file_path, mmap_mode=mmap))
 
     def get_vector_representation(self, encoded_math_tuple):
         return self.model.wv[encoded_math_tuple]
+
+    def load_tuple_table(self, model_file_path, mmap=None):
+        """
+        Loads the precomputed tuple-vector table saved next to the model, if there is one.
+        :return: True if a table was loaded
+        """
+        if not os.path.exists(model_file_path + TupleVectorTable.VECTORS_SUFFIX):
+            return False
+        self.tuple_table = TupleVectorTable.load(model_file_path, mmap_mode=mmap)
+        return True
+
+    def get_vectors(self, encoded_tuples):
+        """
+        Resolves the vectors of many encoded tuples at once. Tuples in the precomputed table (if loaded) and
+        in-vocabulary tuples are gathered with fancy-indexing lookups; only the remaining tuples are composed from
+        their character n-grams.
+        :param encoded_tuples: list of encoded tuples (keys are expected to be unique)
+        :return: (matrix of vectors, boolean mask of tuples composed from n-grams, boolean mask of tuples that
+        could be resolved)
+        """
+        wv = self.model.wv
+        count = len(encoded_tuples)
+        vectors = numpy.zeros((count, wv.vector_size), dtype=numpy.float32)
+        pending = numpy.ones(count, dtype=bool)
+
+        if self.tuple_table is not None:
+            table_rows = self.tuple_table.rows(encoded_tuples)
+            in_table = table_rows >= 0
+            vectors[in_table] = self.tuple_table.vectors[table_rows[in_table]]
+            pending &= ~in_table
+
+        rows = numpy.full(count, -1, dtype=numpy.int64)
+        for position in numpy.flatnonzero(pending):
+            rows[position] = wv.key_to_index.get(encoded_tuples[position], -1)
+        in_vocab = rows >= 0
+        vectors[in_vocab] = wv.vectors[rows[in_vocab]]
+        oov = pending & ~in_vocab
+        resolved = ~oov
+
+        if oov.any() and wv.bucket > 0:
+            for position in numpy.flatnonzero(oov):
+                vector = self._ngram_vector(wv, encoded_tuples[position])
+                if vector is not None:
+                    vectors[position] = vector
+                    resolved[position] = True
+
+        return vectors, oov, resolved
+
+    @staticmethod
+    def _ngram_vector(wv, encoded_tuple):
+        if isinstance(wv, CompactFastTextVectors):
+            return wv.ngram_vector(encoded_tuple)
+        ngram_hashes = ft_ngram_hashes(encoded_tuple, wv.min_n, wv.max_n, wv.bucket)
+        # Same as gensim: a tuple without n-grams gets the origin vector
+        if not ngram_hashes:
+            return numpy.zeros(wv.vector_size, dtype=numpy.float32)
+        return wv.vectors_ngrams[ngram_hashes].mean(axis=0)
@@ -1,3 +1,4 @@
+import threading
 from enum import Enum
 from typing import Literal
 
@@ -190,6 +191,8 @@ class EncoderManager:
     """
 
     _instance = None
+    # Serializa encode_tuples, que altera os mapas e salva os arquivos
+    _lock = threading.Lock()
 
     # Implementação do Singleton
     def __new__(cls, encoder_map_path=None):
@@ -233,6 +236,12 @@ class EncoderManager:
             },
         }
 
+        # Em modo somente leitura os símbolos novos ficam apenas em memória e os
+        # arquivos não são reescritos até save_encoder_map (ex.: gravar uma vez no fim
+        # de um corpus). Não serve para vários processos: cada um daria ids próprios
+        # aos mesmos símbolos novos, então só um processo deve encodificar.
+        self.read_only = False
+
         self.load_encoder_maps()
         self._initialized = True
 
@@ -348,14 +357,20 @@ class EncoderManager:
         Returns:
             Lista de tuplas encodificadas
         """
-        encoder_data = self.encoders_data[encoder_type]
-        node_map = encoder_data["node_map"]
-        edge_map = encoder_data["edge_map"]
-        next_node_id = encoder_data["next_node_id"]
-        next_edge_id = encoder_data["next_edge_id"]
-
-        encoded_tuples, update_map_node, update_map_edge, new_node_id, new_edge_id = (
-            TupleEncoder.encode_tuples(
+        with self._lock:
+            encoder_data = self.encoders_data[encoder_type]
+            node_map = encoder_data["node_map"]
+            edge_map = encoder_data["edge_map"]
+            next_node_id = encoder_data["next_node_id"]
+            next_edge_id = encoder_data["next_edge_id"]
+
+            (
+                encoded_tuples,
+                update_map_node,
+                update_map_edge,
+                new_node_id,
+                new_edge_id,
+            ) = TupleEncoder.encode_tuples(
                 node_map,
                 edge_map,
                 next_node_id,
@@ -366,19 +381,18 @@ class EncoderManager:
                 tokenize_all,
                 tokenize_numbers,
             )
-        )
 
-        # Atualizar os IDs e mapas no dicionário de configuração
-        encoder_data["next_node_id"] = new_node_id
-        encoder_data["next_edge_id"] = new_edge_id
-        node_map.update(update_map_node)
-        edge_map.update(update_map_edge)
+            # Atualizar os IDs e mapas no dicionário de configuração
+            encoder_data["next_node_id"] = new_node_id
+            encoder_data["next_edge_id"] = new_edge_id
+            node_map.update(update_map_node)
+            edge_map.update(update_map_edge)
 
-        # Atualizar as referências de classe
-        self._update_class_references(encoder_type)
+            # Atualizar as referências de classe
+            self._update_class_references(encoder_type)
 
-        # Se houve atualização, salvar o encoder
-        if update_map_node or update_map_edge:
-            self.save_encoder_map(encoder_type)
+            # Se houve atualização, salvar o encoder
+            if (update_map_node or update_map_edge) and not self.read_only:
+                self.save_encoder_map(encoder_type)
 
         return encoded_tuples
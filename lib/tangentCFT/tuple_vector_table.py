@@ -0,0 +1,69 @@
+import json
+
+import numpy
+
+
+class TupleVectorTable:
+    """
+    Dense float32 table with the vectors of every encoded tuple seen in a corpus and a tuple -> row index.
+    It is built offline from a trained model, so at serving time tuple vectors are a table lookup and the
+    fastText n-gram composition is only needed for tuples that were never seen.
+    """
+
+    VECTORS_SUFFIX = ".tuple_vectors.npy"
+    INDEX_SUFFIX = ".tuple_index.json"
+
+    def __init__(self, vectors, tuple_index):
+        """
+        :param vectors: float32 matrix, one row per tuple
+        :param tuple_index: dictionary of encoded tuple and its row in the matrix
+        """
+        self.vectors = vectors
+        self.tuple_index = tuple_index
+
+    def __len__(self):
+        return len(self.tuple_index)
+
+    @classmethod
+    def build(cls, model, encoded_tuples):
+        """
+        Materializes the vectors of the given tuples with a trained model. Tuples the model cannot resolve (no
+        vector and no known n-gram) are left out, so a table lookup misses them as get_vectors does.
+        :param model: TangentCftModel with a loaded fastText model
+        :param encoded_tuples: iterable of encoded tuples (duplicates are ignored)
+        :return: TupleVectorTable
+        """
+        unique_tuples = list(dict.fromkeys(encoded_tuples))
+        vectors, _, resolved = model.get_vectors(unique_tuples)
+        tuple_index = {
+            encoded_tuple: row
+            for row, encoded_tuple in enumerate(
+                encoded_tuple for encoded_tuple, keep in zip(unique_tuples, resolved) if keep
+            )
+        }
+        return cls(numpy.ascontiguousarray(vectors[resolved], dtype=numpy.float32), tuple_index)
+
+    def rows(self, encoded_tuples):
+        """
+        Row of each tuple in the table, -1 for tuples that are not in the table.
+        """
+        return numpy.fromiter(
+            (self.tuple_index.get(encoded_tuple, -1) for encoded_tuple in encoded_tuples),
+            dtype=numpy.int64,
+            count=len(encoded_tuples),
+        )
+
+    def save(self, model_file_path):
+        numpy.save(model_file_path + self.VECTORS_SUFFIX, self.vectors)
+        # The tuples are stored in row order
+        with open(model_file_path + self.INDEX_SUFFIX, "w", encoding="utf-8") as file:
+            json.dump(list(self.tuple_index), file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, model_file_path, mmap_mode=None):
+        vectors = numpy.load(model_file_path + cls.VECTORS_SUFFIX, mmap_mode=mmap_mode)
+        with open(model_file_path + cls.INDEX_SUFFIX, encoding="utf-8") as file:
+            tuple_index = {
+                encoded_tuple: row for row, encoded_tuple in enumerate(json.load(file))
+            }
+        return cls(vectors, tuple_index)
@@ -287,13 +287,22 @@ class MathExtractor:
 
     @classmethod
     def parse_from_xml(
-        cls, content, content_id, operator=False, missing_tags=None, problem_files=None
+        cls,
+        content,
+        content_id,
+        operator=False,
+        missing_tags=None,
+        problem_files=None,
+        math_tokens=None,
     ):
         """
         Parse expressions from XML file
 
         :param content: XML content to be parsed
         :type  content: string
+        :param math_tokens: expressions already extracted from content by math_tokens(), so the SLT and the OPT of
+        the same content can be parsed with a single extraction
+        :type  math_tokens: list(string)
         :param content_id: fileid for indexing or querynum for querying
         :type  content_id: int
         :param missing_tags: dictionary to collect tag errors
@@ -311,7 +320,7 @@ class MathExtractor:
         result = {}
 
         try:
-            trees = cls.math_tokens(content)
+            trees = math_tokens if math_tokens is not None else cls.math_tokens(content)
             groupUnique = {}
 
             for idx, tree in enumerate(trees):
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Teste de carga das rotas de busca: mede vazão (req/s) e latência com
+várias requisições simultâneas contra um ou mais servidores.
+
+Para comparar antes/depois, suba as duas versões do servidor em portas
+diferentes e passe ambas em --target, por exemplo:
+
+    python load_test_search.py --target sync=http://localhost:8000 \\
+        --target async=http://localhost:8001 --concurrency 1 8 32
+"""
+
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+ENDPOINT_QUERY_FIELD = {
+    "search-pure-text": "text_with_formulas_replaced",
+    "search-text-with-treated-formulas": "text_lightly_modified",
+    "search-text-vector": "text_semantically_modified",
+    "search-with-text-without-formula-combined-with-slt-formula-vector": "text_natural_language",
+}
+
+
+def load_queries(json_file: str, query_field: str) -> List[str]:
+    """Carrega as queries de teste do campo informado"""
+    with open(json_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    questions = data["questions"] if isinstance(data, dict) else data
+    return [q[query_field] for q in questions if q.get(query_field)]
+
+
+def run_load(
+    base_url: str, endpoint: str, queries: List[str], concurrency: int, total: int
+) -> Dict[str, float]:
+    """Dispara `total` requisições com `concurrency` clientes simultâneos"""
+    url = f"{base_url}/{endpoint}"
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def send(i):
+        start_time = time.perf_counter()
+        try:
+            response = session.post(
+                url, json={"query": queries[i % len(queries)]}, timeout=120
+            )
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return ok, time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(total)))
+    elapsed = time.perf_counter() - start_time
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    errors = sum(1 for ok, _ in results if not ok)
+    return {
+        "requests": total,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50_ms": (statistics.median(latencies) * 1000 if latencies else 0.0),
+        "latency_p95_ms": (
+            latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else 0.0
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga das rotas de busca")
+    parser.add_argument(
+        "--target",
+        action="append",
+        help="Servidor no formato nome=url (pode ser repetido)",
+    )
+    parser.add_argument(
+        "--endpoint",
+        default="search-text-vector",
+        choices=list(ENDPOINT_QUERY_FIELD.keys()),
+    )
+    parser.add_argument(
+        "--data",
+        default="app/assert/questoes_formulas_selecionadas.json",
+        help="Arquivo JSON com as queries de teste",
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requisições por rodada"
+    )
+    parser.add_argument("--output", default=None, help="Salva os resultados em JSON")
+    args = parser.parse_args()
+
+    targets = args.target or ["default=http://localhost:8000"]
+    queries = load_queries(args.data, ENDPOINT_QUERY_FIELD[args.endpoint])
+    print(f"Carregadas {len(queries)} queries para /{args.endpoint}")
+
+    results = []
+    for target in targets:
+        name, base_url = target.split("=", 1)
+        # Aquecimento para não medir a carga inicial dos modelos
+        run_load(base_url, args.endpoint, queries, 1, min(5, len(queries)))
+        for concurrency in args.concurrency:
+            stats = run_load(
+                base_url, args.endpoint, queries, concurrency, args.requests
+            )
+            stats.update({"target": name, "concurrency": concurrency})
+            results.append(stats)
+            print(
+                f"{name:>10} | conc {concurrency:>3} | "
+                f"{stats['throughput_rps']:8.2f} req/s | "
+                f"p50 {stats['latency_p50_ms']:8.1f} ms | "
+                f"p95 {stats['latency_p95_ms']:8.1f} ms | "
+                f"erros {stats['errors']}"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
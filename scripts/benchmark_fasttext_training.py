@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Compares the two ways of training a formula model on the NTCIR-12 collection:
+
+- in_memory: the original path, the encoded collection as a list of lists and
+  a single worker thread
+- corpus_file: the encoded collection written to a line-oriented corpus file
+  and gensim's corpus_file mode with Configuration.workers threads (all cores
+  by default)
+
+Both modes train on the same encoded corpus with the same configuration. Each
+model is then evaluated in-process (bpref on the 20 concrete NTCIR-12 queries,
+top 1000), to check that retrieval quality stays within the run-to-run noise
+of FastText training. With --runs N each mode is trained N times with
+different seeds and the noise is the spread of those runs.
+
+    python scripts/benchmark_fasttext_training.py \\
+        --dataset /NTCIR12_MathIR_WikiCorpus_v2.1.0/MathTagArticles \\
+        --queries ./TestQueries --representation SLT --runs 2
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import statistics
+import time
+
+from Configuration.configuration import Configuration
+from DataReader.wiki_data_reader import WikiDataReader
+from lib.tangentCFT.corpus import REPRESENTATIONS, encode_formulas, write_corpus_file
+from lib.tangentCFT.evaluation import evaluate, read_qrels, retrieve, run_from_retrieval, write_run
+from lib.tangentCFT.model import TangentCftModel
+from lib.tangentCFT.touple_encoder.encoder import EncoderManager
+from services.tanget_cft_service import TangentCFTService
+
+CONFIG_IDS = {"SLT": 1, "OPT": 2, "SLT_TYPE": 3}
+JUDGE_FILE_PATH = "Retrieval_Results/judge.dat"
+CORPUS_DIR = "data/ntcir12/corpus"
+# Diferença de bpref tolerada quando não há execuções repetidas para medir o ruído
+DEFAULT_TOLERANCE = 0.01
+
+
+def load_encoded(dataset, queries_directory, representation):
+    data_reader = WikiDataReader(
+        dataset,
+        read_slt=REPRESENTATIONS[representation]["read_slt"],
+        queries_directory_path=queries_directory,
+    )
+    encoder_manager = EncoderManager()
+    # Símbolos novos ficam só em memória: o benchmark não altera os mapas de encoder
+    encoder_manager.read_only = True
+    collection = encode_formulas(encoder_manager, data_reader.get_collection(), representation)
+    queries = encode_formulas(encoder_manager, data_reader.get_query(), representation)
+    return collection, queries
+
+
+def evaluate_model(model, collection, queries, qrels, result_file_path, run_id):
+    service = TangentCFTService()
+    service.model = model
+    run = run_from_retrieval(retrieve(service, collection, queries))
+    if result_file_path:
+        write_run(run, result_file_path, run_id)
+    return evaluate(qrels, run)
+
+
+def summarize(values):
+    mean = statistics.mean(values)
+    std = statistics.stdev(values) if len(values) > 1 else 0.0
+    return mean, std
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Timing and bpref of in-memory vs corpus_file FastText training"
+    )
+    parser.add_argument("--dataset", required=True, help="NTCIR-12 MathTagArticles directory")
+    parser.add_argument("--queries", required=True, help="NTCIR-12 query directory")
+    parser.add_argument("--representation", choices=list(REPRESENTATIONS), default="SLT")
+    parser.add_argument("--config", default=None, help="Configuration file (default: the one of the representation)")
+    parser.add_argument("--workers", type=int, default=None, help="Workers of corpus_file mode (default: config)")
+    parser.add_argument("--runs", type=int, default=1, help="Trainings per mode, with seeds 1..runs")
+    parser.add_argument("--judge", default=JUDGE_FILE_PATH)
+    parser.add_argument("--corpus-file", default=None)
+    parser.add_argument("--result-dir", default=None, help="Also write the runs here, for trec_eval")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    representation = args.representation
+    config_path = args.config or f"Configuration/config/config_{CONFIG_IDS[representation]}"
+    corpus_file = args.corpus_file or os.path.join(CORPUS_DIR, f"{representation.lower()}.txt")
+    qrels = read_qrels(args.judge)
+    if args.result_dir:
+        os.makedirs(args.result_dir, exist_ok=True)
+
+    start_time = time.perf_counter()
+    collection, queries = load_encoded(args.dataset, args.queries, representation)
+    print(
+        f"{representation}: {len(collection)} formulas and {len(queries)} queries encoded "
+        f"in {time.perf_counter() - start_time:.1f}s"
+    )
+
+    start_time = time.perf_counter()
+    writer = write_corpus_file(corpus_file, collection.values())
+    write_seconds = time.perf_counter() - start_time
+    writer.report()
+
+    config = Configuration(config_path)
+    corpus_workers = args.workers or config.get_workers(corpus_file=True)
+    modes = {"in_memory": 1, "corpus_file": corpus_workers}
+    results = {mode: {"seconds": [], "bpref_full": [], "bpref_partial": []} for mode in modes}
+
+    for run in range(1, args.runs + 1):
+        for mode, workers in modes.items():
+            config.workers = workers
+            model = TangentCftModel()
+            if mode == "in_memory":
+                train_time = model.train(config, list(collection.values()), seed=run)
+            else:
+                train_time = model.train(config, corpus_file=corpus_file, seed=run)
+            result_file_path = (
+                os.path.join(args.result_dir, f"{representation.lower()}_{mode}_{run}")
+                if args.result_dir
+                else None
+            )
+            scores = evaluate_model(model, collection, queries, qrels, result_file_path, f"{mode}_{run}")
+            results[mode]["seconds"].append(train_time.total_seconds())
+            results[mode]["bpref_full"].append(scores["bpref_full"])
+            results[mode]["bpref_partial"].append(scores["bpref_partial"])
+            print(
+                f"Run {run} {mode} ({workers} workers): {train_time.total_seconds():.1f}s, "
+                f"bpref full {scores['bpref_full']:.4f} partial {scores['bpref_partial']:.4f}"
+            )
+
+    baseline_seconds = statistics.mean(results["in_memory"]["seconds"])
+    print(f"\n{representation}, {args.runs} run(s) per mode, corpus written in {write_seconds:.1f}s")
+    print(f"{'mode':<12} {'workers':>7} {'train (s)':>10} {'speedup':>8} {'bpref full':>16} {'bpref partial':>16}")
+    for mode, workers in modes.items():
+        seconds = statistics.mean(results[mode]["seconds"])
+        full, full_std = summarize(results[mode]["bpref_full"])
+        partial, partial_std = summarize(results[mode]["bpref_partial"])
+        print(
+            f"{mode:<12} {workers:>7} {seconds:>10.1f} {baseline_seconds / seconds:>7.2f}x "
+            f"{full:>9.4f}±{full_std:.4f} {partial:>9.4f}±{partial_std:.4f}"
+        )
+
+    for measure in ("bpref_full", "bpref_partial"):
+        baseline, baseline_std = summarize(results["in_memory"][measure])
+        candidate, candidate_std = summarize(results["corpus_file"][measure])
+        noise = max(2 * max(baseline_std, candidate_std), args.tolerance)
+        difference = candidate - baseline
+        verdict = "within noise" if abs(difference) <= noise else "OUTSIDE noise"
+        print(f"{measure}: corpus_file - in_memory = {difference:+.4f} (noise ±{noise:.4f}), {verdict}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Compares the per-formula embedding latency of the formula models:
+
+- per_tuple: the original path, one model.wv[tuple] lookup (with fastText
+  n-gram hashing for unseen tuples) per tuple, then the mean
+- ngram: TangentCFTService.get_query_vector without the tuple-vector table
+- table: TangentCFTService.get_query_vector served from the tuple-vector table
+
+Parsing and encoding are done before timing, only the embedding is measured.
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import statistics
+import time
+
+import numpy
+
+from app.modules.embedding.use_cases.encode_formula_tuples import (
+    make_encode_formula_tuples_use_case,
+)
+from app.modules.embedding.use_cases.get_slt_opt_and_type_combined_formula_vector_use_case import (
+    EncodeFormulaTuplesUseCaseParams,
+)
+from app.modules.embedding.use_cases.parse_formula_to_tuples import (
+    make_parse_formula_to_tuples_use_case,
+)
+from scripts.build_tuple_vector_tables import OPT_DIR, SLT_DIR, iter_formulas
+from services.model_manager import MODEL_PATHS, model_manager
+
+
+def load_encoded_formulas(graph_type, limit):
+    parse_formula_to_tuples_use_case = make_parse_formula_to_tuples_use_case()
+    encode_formula_tuples_use_case = make_encode_formula_tuples_use_case()
+    operator = graph_type == "OPT"
+
+    encoded_formulas = []
+    for formula in iter_formulas(OPT_DIR if operator else SLT_DIR, limit):
+        tuples = parse_formula_to_tuples_use_case.execute(formula, operator=operator)
+        if tuples:
+            encoded_formulas.append(
+                encode_formula_tuples_use_case.execute(
+                    tuples, **EncodeFormulaTuplesUseCaseParams[graph_type].value
+                )
+            )
+    return encoded_formulas
+
+
+def per_tuple_vector(model, encoded_tuples):
+    vectors = []
+    for encoded_tuple in encoded_tuples:
+        try:
+            vectors.append(model.get_vector_representation(encoded_tuple))
+        except Exception:
+            continue
+    return numpy.mean(vectors, axis=0)
+
+
+def measure(embed, encoded_formulas, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for encoded_tuples in encoded_formulas:
+            start_time = time.perf_counter()
+            embed(encoded_tuples)
+            latencies.append((time.perf_counter() - start_time) * 1_000_000)
+    latencies.sort()
+    return {
+        "mean_us": statistics.mean(latencies),
+        "p50_us": latencies[len(latencies) // 2],
+        "p95_us": latencies[int(len(latencies) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark of per-formula embedding latency"
+    )
+    parser.add_argument(
+        "--types", nargs="+", choices=list(MODEL_PATHS), default=list(MODEL_PATHS)
+    )
+    parser.add_argument("--formulas", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for graph_type in args.types:
+        service = model_manager.get_model(graph_type)
+        table = service.model.tuple_table
+        if table is None:
+            print(
+                f"⚠️  No tuple-vector table for {graph_type}, "
+                "run scripts/build_tuple_vector_tables.py first"
+            )
+
+        encoded_formulas = load_encoded_formulas(graph_type, args.formulas)
+        tuples = sum(len(encoded_tuples) for encoded_tuples in encoded_formulas)
+        print(
+            f"\n{graph_type}: {len(encoded_formulas)} formulas, "
+            f"{tuples / max(len(encoded_formulas), 1):.1f} tuples per formula"
+        )
+
+        results = {
+            "per_tuple": measure(
+                lambda t: per_tuple_vector(service.model, t),
+                encoded_formulas,
+                args.repeat,
+            )
+        }
+        service.model.tuple_table = None
+        results["ngram"] = measure(
+            service.get_query_vector, encoded_formulas, args.repeat
+        )
+        if table is not None:
+            service.model.tuple_table = table
+            results["table"] = measure(
+                service.get_query_vector, encoded_formulas, args.repeat
+            )
+
+        baseline = results["per_tuple"]["mean_us"]
+        print(f"{'path':<10} {'mean (µs)':>10} {'p50 (µs)':>10} {'p95 (µs)':>10} {'speedup':>8}")
+        for name, stats in results.items():
+            print(
+                f"{name:<10} {stats['mean_us']:>10.1f} {stats['p50_us']:>10.1f} "
+                f"{stats['p95_us']:>10.1f} {baseline / stats['mean_us']:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the serialization of a 500-document formula batch (four
+300-dimension float32 vectors per document) as the NDJSON body of a _bulk
+request:
+
+- tolist_json: the previous path, ndarray.tolist() + the client's default
+  JSON serializer
+- numpy_fallback: NumpyNdjsonSerializer without orjson
+- numpy_orjson: NumpyNdjsonSerializer with orjson (if installed)
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import time
+
+import numpy as np
+from elasticsearch.serializer import NdjsonSerializer
+
+import services.es_serializer as es_serializer
+from services.es_serializer import NumpyNdjsonSerializer
+
+VECTOR_FIELDS = ["formula_vector", "slt_vector", "slt_type_vector", "opt_vector"]
+
+
+def make_batch(size, dims):
+    rng = np.random.default_rng(0)
+    batch = []
+    for i in range(size):
+        document = {
+            "formula_id": str(i),
+            "post_id": str(i // 3),
+            "slt_text": "<math><mi>x</mi><mo>+</mo><mn>1</mn></math>",
+        }
+        for field in VECTOR_FIELDS:
+            document[field] = rng.standard_normal(dims).astype(np.float32)
+        batch.append(document)
+    return batch
+
+
+def bulk_lines(batch, tolist):
+    for document in batch:
+        yield {"index": {"_index": "formulas", "_id": document["formula_id"]}}
+        if tolist:
+            document = {
+                key: value.tolist() if isinstance(value, np.ndarray) else value
+                for key, value in document.items()
+            }
+        yield document
+
+
+def measure(name, serialize, batch, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        body = serialize(batch)
+        timings.append(time.perf_counter() - start_time)
+    best = min(timings)
+    print(
+        f"{name:<16} {best * 1000:>9.1f} {len(batch) / best:>12.0f} "
+        f"{len(body) / best / 1024 / 1024:>10.1f} {len(body) / 1024 / 1024:>10.2f}"
+    )
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk serialization benchmark")
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--dims", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    batch = make_batch(args.docs, args.dims)
+    default_serializer = NdjsonSerializer()
+    numpy_serializer = NumpyNdjsonSerializer()
+
+    print(f"{args.docs} documents, {len(VECTOR_FIELDS)} x {args.dims} float32 vectors each")
+    print(f"{'serializer':<16} {'ms/batch':>9} {'docs/sec':>12} {'MB/sec':>10} {'body (MB)':>10}")
+
+    baseline = measure(
+        "tolist_json",
+        lambda b: default_serializer.dumps(list(bulk_lines(b, tolist=True))),
+        batch,
+        args.repeat,
+    )
+
+    orjson = es_serializer.orjson
+    es_serializer.orjson = None
+    fallback = measure(
+        "numpy_fallback",
+        lambda b: numpy_serializer.dumps(list(bulk_lines(b, tolist=False))),
+        batch,
+        args.repeat,
+    )
+    es_serializer.orjson = orjson
+
+    print(f"numpy_fallback speedup: {baseline / fallback:.2f}x")
+    if orjson is not None:
+        fast = measure(
+            "numpy_orjson",
+            lambda b: numpy_serializer.dumps(list(bulk_lines(b, tolist=False))),
+            batch,
+            args.repeat,
+        )
+        print(f"numpy_orjson speedup: {baseline / fast:.2f}x")
+    else:
+        print("orjson is not installed, numpy_orjson skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Builds the precomputed tuple-vector tables used at serving time.
+
+For each model (SLT, SLT_TYPE and OPT) all encoded tuples seen in the formula
+corpus, plus the model vocabulary, are materialized into a dense float32
+matrix saved next to the model (see lib/tangentCFT/tuple_vector_table.py).
+TangentCFTService loads the table automatically when it exists.
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import csv
+import glob
+import time
+
+from app.modules.embedding.use_cases.encode_formula_tuples import (
+    make_encode_formula_tuples_use_case,
+)
+from app.modules.embedding.use_cases.get_slt_opt_and_type_combined_formula_vector_use_case import (
+    EncodeFormulaTuplesUseCaseParams,
+)
+from app.modules.embedding.use_cases.parse_formula_to_tuples import (
+    make_parse_formula_to_tuples_use_case,
+)
+from lib.tangentCFT.tuple_vector_table import TupleVectorTable
+from services.model_manager import MODEL_PATHS, model_manager
+import services.tuple_store as tuple_store_module
+
+csv.field_size_limit(sys.maxsize)
+
+SLT_DIR = "data/arqmath/slt_representation_v3"
+OPT_DIR = "data/arqmath/opt_representation_v3"
+
+PARSE_BATCH_SIZE = 10000
+
+
+def iter_formulas(directory, limit=None):
+    """Yields the MathML of every formula in the TSV files of the directory."""
+    count = 0
+    for file_path in sorted(glob.glob(os.path.join(directory, "*.tsv"))):
+        with open(file_path, "r", encoding="utf-8") as file:
+            for row in csv.DictReader(file, delimiter="\t"):
+                formula = row.get("formula")
+                if not formula:
+                    continue
+                yield formula
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+
+def collect_encoded_tuples(directory, graph_types, operator, limit=None):
+    """
+    Parses every formula of the directory once and collects the distinct
+    encoded tuples of each requested graph type.
+    """
+    parse_formula_to_tuples_use_case = make_parse_formula_to_tuples_use_case()
+    encode_formula_tuples_use_case = make_encode_formula_tuples_use_case()
+
+    seen = {graph_type: set() for graph_type in graph_types}
+    parsed = 0
+
+    def collect(formulas):
+        nonlocal parsed
+        for _, tuples in parse_formula_to_tuples_use_case.execute_many_with_key(
+            formulas, operator=operator
+        ):
+            if not tuples:
+                continue
+            for graph_type in graph_types:
+                encoded_tuples = encode_formula_tuples_use_case.execute(
+                    tuples, **EncodeFormulaTuplesUseCaseParams[graph_type].value
+                )
+                seen[graph_type].update(encoded_tuples)
+            parsed += 1
+        sizes = ", ".join(f"{t}: {len(s)}" for t, s in seen.items())
+        print(f"Parsed {parsed} formulas ({sizes} distinct tuples)")
+
+    # Parsed in batches, so the tuple store is read and written in bulk
+    batch = []
+    for formula in iter_formulas(directory, limit):
+        batch.append(formula)
+        if len(batch) >= PARSE_BATCH_SIZE:
+            collect(batch)
+            batch = []
+    if batch:
+        collect(batch)
+    print(f"Parsed {parsed} formulas from {directory}")
+    return seen
+
+
+def build_table(graph_type, corpus_tuples):
+    model = model_manager.get_model(graph_type).model
+    vocabulary = model.model.wv.index_to_key
+
+    started = time.time()
+    candidates = list(dict.fromkeys([*vocabulary, *corpus_tuples]))
+    table = TupleVectorTable.build(model, candidates)
+    table.save(MODEL_PATHS[graph_type])
+
+    unseen = len(table) - len(vocabulary)
+    size_mb = table.vectors.nbytes / 1024 / 1024
+    print(
+        f"✅ {graph_type}: {len(table)} tuples ({unseen} outside the vocabulary, "
+        f"{len(candidates) - len(table)} without any known n-gram left out), "
+        f"{size_mb:.1f} MB, built in {time.time() - started:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the tuple-vector tables of the formula models"
+    )
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        choices=list(MODEL_PATHS),
+        default=list(MODEL_PATHS),
+        help="Models to build the table for",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Maximum number of formulas read per representation (for testing)",
+    )
+    parser.add_argument(
+        "--tuple-store",
+        default=tuple_store_module.TUPLE_STORE_PATH
+        or tuple_store_module.DEFAULT_TUPLE_STORE_PATH,
+        help="sqlite file of the parsed formula tuples (empty to disable)",
+    )
+    args = parser.parse_args()
+    tuple_store_module.TUPLE_STORE_PATH = args.tuple_store or None
+
+    corpus_tuples = {}
+    slt_types = [t for t in args.types if t in ("SLT", "SLT_TYPE")]
+    if slt_types:
+        corpus_tuples.update(
+            collect_encoded_tuples(SLT_DIR, slt_types, operator=False, limit=args.limit)
+        )
+    if "OPT" in args.types:
+        corpus_tuples.update(
+            collect_encoded_tuples(OPT_DIR, ["OPT"], operator=True, limit=args.limit)
+        )
+
+    tuple_store = tuple_store_module.get_tuple_store()
+    if tuple_store is not None:
+        tuple_store.report()
+
+    for graph_type in args.types:
+        build_table(graph_type, corpus_tuples[graph_type])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Compares the training telemetry (JSONL written by TrainingTelemetryCallback,
+e.g. by scripts/train_formula_models.py) of a baseline run and a candidate
+run, and flags a throughput regression: the candidate's mean words/sec below
+(1 - --max-drop) of the baseline's. Exits with status 1 on a regression, so
+it can gate a configuration change.
+
+    python scripts/compare_training_telemetry.py baseline/slt.jsonl data/ntcir12/telemetry/slt.jsonl
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+
+from lib.tangentCFT.model import read_telemetry
+
+# Queda de throughput tolerada antes de acusar regressão
+MAX_DROP = 0.2
+
+
+def summarize(records):
+    speeds = [record["words_per_sec"] for record in records if record.get("words_per_sec")]
+    return {
+        "epochs": len(records),
+        "seconds": records[-1]["elapsed_seconds"] if records else 0.0,
+        "words_per_sec": sum(speeds) / len(speeds) if speeds else 0.0,
+        "max_rss_mb": max((record["rss_mb"] for record in records), default=0.0),
+        "workers": records[-1].get("workers") if records else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the throughput of two training runs")
+    parser.add_argument("baseline", help="Telemetry JSONL of the baseline run")
+    parser.add_argument("candidate", help="Telemetry JSONL of the candidate run")
+    parser.add_argument("--max-drop", type=float, default=MAX_DROP, help="Tolerated words/sec drop (fraction)")
+    args = parser.parse_args()
+
+    runs = {"baseline": summarize(read_telemetry(args.baseline)), "candidate": summarize(read_telemetry(args.candidate))}
+    print(f"{'run':<10} {'epochs':>6} {'workers':>7} {'train (s)':>10} {'words/sec':>10} {'max RSS (MB)':>13}")
+    for name, summary in runs.items():
+        print(
+            f"{name:<10} {summary['epochs']:>6} {summary['workers'] or '-':>7} {summary['seconds']:>10.1f} "
+            f"{summary['words_per_sec']:>10.0f} {summary['max_rss_mb']:>13.0f}"
+        )
+
+    baseline_speed = runs["baseline"]["words_per_sec"]
+    if not baseline_speed:
+        print("The baseline has no words/sec records")
+        return
+    ratio = runs["candidate"]["words_per_sec"] / baseline_speed
+    if ratio < 1 - args.max_drop:
+        print(f"❌ Throughput regression: candidate at {ratio:.0%} of the baseline words/sec")
+        sys.exit(1)
+    print(f"✅ Candidate at {ratio:.0%} of the baseline words/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Exports the inference-only artifact of the formula models (vocabulary
+vectors plus only the n-gram buckets hit by the vocabulary) and reports
+memory footprint and load time of the full FastText model and of the
+artifact.
+
+Each format is loaded in a fresh process, so the reported RSS is not
+affected by what was loaded before.
+
+    python scripts/export_inference_models.py --float16
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import glob
+import json
+import subprocess
+import time
+
+import numpy
+
+from lib.tangentCFT.model import TangentCftModel
+from services.model_manager import MODEL_PATHS
+
+
+def current_rss_mb():
+    """RSS atual do processo em MB (Linux)"""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def files_size_mb(pattern):
+    return sum(os.path.getsize(path) for path in glob.glob(pattern)) / 1024 / 1024
+
+
+def measure_load(model_file_path, model_format):
+    """Loads one model in this process and prints the measurement as JSON"""
+    rss_before = current_rss_mb()
+    start_time = time.perf_counter()
+    model = TangentCftModel()
+    if model_format == "inference":
+        model.load_inference_model(model_file_path)
+    else:
+        model.load_model(model_file_path)
+    load_time = time.perf_counter() - start_time
+    print(
+        json.dumps(
+            {"load_time_s": load_time, "rss_mb": current_rss_mb() - rss_before}
+        )
+    )
+
+
+def run_measurement(model_file_path, model_format):
+    output = subprocess.run(
+        [sys.executable, __file__, "--measure", model_format, model_file_path],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def check_vectors(full_model, compact_model, samples=1000):
+    """Largest difference between the vectors served by both formats"""
+    vocabulary = full_model.model.wv.index_to_key[:samples]
+    full_vectors, _, _ = full_model.get_vectors(vocabulary)
+    compact_vectors, _, _ = compact_model.get_vectors(vocabulary)
+    return float(numpy.abs(full_vectors - compact_vectors).max())
+
+
+def export(graph_type, float16):
+    model_file_path = MODEL_PATHS[graph_type]
+    print(f"\n{graph_type}: exporting {model_file_path}...")
+
+    full_model = TangentCftModel()
+    full_model.load_model(model_file_path)
+    full_model.export_inference_model(model_file_path, float16=float16)
+
+    compact_model = TangentCftModel()
+    compact_model.load_inference_model(model_file_path)
+    wv = compact_model.model.wv
+    print(
+        f"Kept {len(wv.ngram_vectors)} of {wv.bucket} n-gram buckets "
+        f"({100 * len(wv.ngram_vectors) / wv.bucket:.1f}%), "
+        f"max vocabulary vector difference: {check_vectors(full_model, compact_model):.2e}"
+    )
+    del full_model, compact_model
+
+    full = run_measurement(model_file_path, "full")
+    inference = run_measurement(model_file_path, "inference")
+    disk = {
+        "full": files_size_mb(model_file_path + ".wv.vectors.npy*"),
+        "inference": files_size_mb(model_file_path + ".inference.*"),
+    }
+    print(f"{'format':<10} {'disk (MB)':>10} {'RSS (MB)':>10} {'load (s)':>10}")
+    for name, stats in (("full", full), ("inference", inference)):
+        print(
+            f"{name:<10} {disk[name]:>10.1f} {stats['rss_mb']:>10.1f} "
+            f"{stats['load_time_s']:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the inference-only artifact of the formula models"
+    )
+    parser.add_argument(
+        "--types", nargs="+", choices=list(MODEL_PATHS), default=list(MODEL_PATHS)
+    )
+    parser.add_argument(
+        "--float16", action="store_true", help="Store the vectors as float16"
+    )
+    parser.add_argument(
+        "--measure", nargs=2, metavar=("FORMAT", "MODEL_PATH"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.measure:
+        model_format, model_file_path = args.measure
+        measure_load(model_file_path, model_format)
+        return
+
+    for graph_type in args.types:
+        if not os.path.exists(MODEL_PATHS[graph_type] + ".wv.vectors.npy"):
+            print(f"⚠️  Model {MODEL_PATHS[graph_type]} not found, skipping...")
+            continue
+        export(graph_type, args.float16)
+
+    print(
+        "\n✅ Artifacts exported. To serve them, index the formulas again with "
+        "CFT_MODEL_FORMAT=inference and run the API with the same setting: the "
+        "artifact gives other vectors than the full model for out-of-vocabulary tuples."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Mede a memória por worker e o tempo de cold start da API com 1, 4 e 8
+workers do gunicorn, comparando os modos de carregamento dos modelos:
+
+- default: cada worker carrega os modelos no startup
+- mmap: cada worker carrega os modelos com CFT_MODEL_MMAP=true
+- mmap_preload: o processo mestre carrega os modelos (mmap) antes do fork
+
+O RSS conta as páginas compartilhadas em todos os processos, então a soma
+do PSS (que divide as páginas compartilhadas entre os processos) é a
+medida da memória física realmente usada. Linux apenas.
+
+    python scripts/measure_worker_memory.py --workers 1 4 8
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import signal
+import subprocess
+import threading
+import time
+
+MODES = {
+    "default": {"CFT_MODEL_MMAP": "false", "PRELOAD_MODELS": "false"},
+    "mmap": {"CFT_MODEL_MMAP": "true", "PRELOAD_MODELS": "false"},
+    "mmap_preload": {"CFT_MODEL_MMAP": "true", "PRELOAD_MODELS": "true"},
+}
+
+READY_LINE = "Application startup complete"
+
+
+def memory_mb(pid):
+    """(RSS, PSS) do processo em MB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0]) / 1024
+    return values.get("Rss", 0.0), values.get("Pss", 0.0)
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # O nome do processo pode ter espaços, o ppid vem depois do ")"
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def run(mode, workers, port, timeout):
+    env = {**os.environ, **MODES[mode]}
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "app.main:app",
+        "-k",
+        "uvicorn.workers.UvicornWorker",
+        "-w",
+        str(workers),
+        "-b",
+        f"127.0.0.1:{port}",
+        "--timeout",
+        str(timeout),
+    ]
+    if MODES[mode]["PRELOAD_MODELS"] == "true":
+        command.append("--preload")
+
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    ready = threading.Event()
+    ready_workers = []
+
+    def read_log():
+        for line in process.stderr:
+            if READY_LINE in line:
+                ready_workers.append(time.perf_counter() - start_time)
+                if len(ready_workers) >= workers:
+                    ready.set()
+
+    threading.Thread(target=read_log, daemon=True).start()
+
+    try:
+        if not ready.wait(timeout):
+            print(f"⚠️  {mode} with {workers} workers did not start in {timeout}s")
+            return None
+        cold_start = ready_workers[-1]
+        # Espera a memória dos workers estabilizar
+        time.sleep(2)
+        master = memory_mb(process.pid)
+        worker_memory = [memory_mb(pid) for pid in child_pids(process.pid)]
+        return {
+            "cold_start_s": cold_start,
+            "rss_per_worker_mb": sum(m[0] for m in worker_memory) / len(worker_memory),
+            "pss_per_worker_mb": sum(m[1] for m in worker_memory) / len(worker_memory),
+            "total_pss_mb": master[1] + sum(m[1] for m in worker_memory),
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memória por worker e cold start da API"
+    )
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument(
+        "--modes", nargs="+", choices=list(MODES), default=list(MODES)
+    )
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--timeout", type=int, default=600)
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        for workers in args.workers:
+            print(f"🔄 {mode}, {workers} workers...")
+            result = run(mode, workers, args.port, args.timeout)
+            if result is not None:
+                results.append((mode, workers, result))
+
+    print(
+        f"\n{'mode':<14} {'workers':>7} {'cold start (s)':>15} "
+        f"{'RSS/worker (MB)':>16} {'PSS/worker (MB)':>16} {'total PSS (MB)':>15}"
+    )
+    for mode, workers, result in results:
+        print(
+            f"{mode:<14} {workers:>7} {result['cold_start_s']:>15.1f} "
+            f"{result['rss_per_worker_mb']:>16.0f} {result['pss_per_worker_mb']:>16.0f} "
+            f"{result['total_pss_mb']:>15.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
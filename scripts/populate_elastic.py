@@ -4,8 +4,6 @@ import xml.etree.ElementTree as ET
 from tqdm import tqdm
 import html
 from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor
-import threading
 
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -27,29 +25,35 @@ POSTS_FORMULAS_IN_SLT_FOLDER_PATH = (
 )
 
 from services.elasticsearch_service import ElasticsearchService
+from services.index_manifest import IndexManifest
 
 POSTS_XML_PATH = "data/arqmath/Posts.V1.3.xml"
+# Checkpoint antigo (último post_id enviado), migrado para o manifesto
 CHECKPOINT_FILE = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "checkpoint.txt"
 )
+MANIFEST_GRAPH_TYPE = "posts"
 BATCH_SIZE = 100
 MAX_WORKERS = 4
 MAX_POSTS = 15000  # Limit to first 30k posts
 
-lock = threading.Lock()
 
-
-def load_last_checkpoint():
-    if os.path.exists(CHECKPOINT_FILE):
+def migrate_checkpoint(manifest):
+    """
+    Migra o checkpoint antigo para o manifesto: os posts com id até o
+    último post_id do checkpoint continuam sendo pulados
+    """
+    if not os.path.exists(CHECKPOINT_FILE):
+        return
+    if manifest.get(POSTS_XML_PATH, MANIFEST_GRAPH_TYPE) is None:
         with open(CHECKPOINT_FILE, "r") as f:
-            return int(f.read().strip())
-    return -1
-
-
-def save_checkpoint(post_id):
-    with lock:
-        with open(CHECKPOINT_FILE, "w") as f:
-            f.write(str(post_id))
+            last_post_id = int(f.read().strip())
+        manifest.begin(POSTS_XML_PATH, MANIFEST_GRAPH_TYPE)
+        manifest.update(
+            POSTS_XML_PATH, MANIFEST_GRAPH_TYPE, legacy_last_post_id=last_post_id
+        )
+        print(f"Checkpoint antigo migrado para o manifesto (post_id {last_post_id})")
+    os.replace(CHECKPOINT_FILE, CHECKPOINT_FILE + ".migrated")
 
 
 def process_post(elem):
@@ -114,8 +118,17 @@ def count_total_posts():
 
 
 def index_posts_from_xml(elastic_service):
-    last_post_id = load_last_checkpoint()
-    print(f"Último post indexado: {last_post_id}")
+    # O manifesto guarda quantas linhas do XML já foram confirmadas pelo
+    # Elasticsearch e o hash do arquivo
+    manifest = IndexManifest(elastic_service.posts_index_name)
+    migrate_checkpoint(manifest)
+    start_row = manifest.begin(POSTS_XML_PATH, MANIFEST_GRAPH_TYPE)
+    if start_row is None:
+        print(f"{POSTS_XML_PATH} já indexado e sem alterações")
+        return
+    entry = manifest.get(POSTS_XML_PATH, MANIFEST_GRAPH_TYPE)
+    last_post_id = entry.get("legacy_last_post_id", -1)
+    print(f"Retomando a partir da linha {start_row} do XML")
 
     # Contar total de posts
     total_posts = count_total_posts()
@@ -123,74 +136,92 @@ def index_posts_from_xml(elastic_service):
 
     context = ET.iterparse(POSTS_XML_PATH, events=("end",))
     batch = []
-    futures = []
-    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    # Streams the posts with at most MAX_WORKERS bulk requests in flight; the
+    # refresh is done once, by bulk_load(), at the end. Each batch marks the
+    # XML rows it covers, committed to the manifest once ES confirms it.
     current_post = 0
     processed_posts = 0
+    reached_limit = False
+
+    # On an error the queued batches are still sent and committed before it propagates
+    with elastic_service.bulk_writer(
+        max_in_flight=MAX_WORKERS, on_commit=manifest.commit
+    ) as writer:
+        for event, elem in context:
+            if elem.tag == "row":
+                post_id = int(elem.attrib.get("Id"))
+                post_type_id = elem.attrib.get("PostTypeId")
+                current_post += 1
+
+                # Linhas já confirmadas em uma execução anterior
+                if current_post <= start_row:
+                    elem.clear()
+                    continue
+
+                # Só processar posts do tipo 1 (questions)
+                if post_type_id != "1":
+                    elem.clear()
+                    continue
+
+                if post_id <= last_post_id:
+                    elem.clear()
+                    continue
+
+                doc = process_post(elem)
+                if doc:
+                    batch.append(doc)
+                    processed_posts += 1
+
+                if len(batch) >= BATCH_SIZE:
+                    index_batch(writer, elastic_service, batch)
+                    writer.mark(
+                        manifest.offset(POSTS_XML_PATH, MANIFEST_GRAPH_TYPE, current_post)
+                    )
+                    # Printar progresso apenas no final de cada batch
+                    print(
+                        f"Posts tipo 1 processados: {processed_posts}/{MAX_POSTS} (Post atual: {current_post}/{total_posts})"
+                    )
+                    batch = []
 
-    for event, elem in context:
-        if elem.tag == "row":
-            post_id = int(elem.attrib.get("Id"))
-            post_type_id = elem.attrib.get("PostTypeId")
-            current_post += 1
-
-            # Só processar posts do tipo 1 (questions)
-            if post_type_id != "1":
                 elem.clear()
-                continue
 
-            if post_id <= last_post_id:
-                elem.clear()
-                continue
-
-            doc = process_post(elem)
-            if doc:
-                batch.append(doc)
-                processed_posts += 1
-
-            if len(batch) >= BATCH_SIZE:
-                futures.append(
-                    executor.submit(index_batch, elastic_service, batch.copy())
-                )
-                save_checkpoint(post_id)
-                # Printar progresso apenas no final de cada batch
-                print(
-                    f"Posts tipo 1 processados: {processed_posts}/{MAX_POSTS} (Post atual: {current_post}/{total_posts})"
-                )
-                batch = []
-
-            elem.clear()
-
-            # Stop after processing MAX_POSTS of type 1
-            if processed_posts >= MAX_POSTS:
-                print(f"Reached limit of {MAX_POSTS} posts of type 1. Stopping.")
-                break
-
-    if batch:
-        futures.append(executor.submit(index_batch, elastic_service, batch.copy()))
-        save_checkpoint(post_id)
-        print(
-            f"Posts tipo 1 processados: {processed_posts}/{MAX_POSTS} (Post atual: {current_post}/{total_posts})"
+                # Stop after processing MAX_POSTS of type 1
+                if processed_posts >= MAX_POSTS:
+                    print(f"Reached limit of {MAX_POSTS} posts of type 1. Stopping.")
+                    reached_limit = True
+                    break
+
+        if batch:
+            index_batch(writer, elastic_service, batch)
+            print(
+                f"Posts tipo 1 processados: {processed_posts}/{MAX_POSTS} (Post atual: {current_post}/{total_posts})"
+            )
+        writer.mark(
+            manifest.offset(
+                POSTS_XML_PATH, MANIFEST_GRAPH_TYPE, current_post, done=not reached_limit
+            )
         )
 
-    for f in futures:
-        f.result()  # garante que todas as tarefas terminaram
+    writer.report("Indexação de posts")
+    manifest.report()
 
     print(
         f"Indexação finalizada: {processed_posts} posts do tipo 1 processados de {current_post} posts analisados"
     )
 
 
-def index_batch(elastic_service, batch):
+def index_batch(writer, elastic_service, batch):
     try:
-        elastic_service.bulk_index_posts(batch)
+        writer.write(elastic_service.index_post_actions(batch))
     except Exception as e:
         print(f"Erro ao indexar batch: {e}")
 
 
 def main():
     elastic_service = ElasticsearchService()
-    index_posts_from_xml(elastic_service)
+    elastic_service.bootstrap_indices()
+    with elastic_service.bulk_load(elastic_service.posts_index_name):
+        index_posts_from_xml(elastic_service)
 
 
 if __name__ == "__main__":
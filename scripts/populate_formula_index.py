@@ -5,50 +5,31 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
-import csv
+import argparse
 import glob
-import numpy as np
+import multiprocessing
+import time
+from collections import OrderedDict, defaultdict
+from DataReader.arqmath_formula_reader import OptFormulaLookup, iter_formula_chunks
 from services.elasticsearch_service import ElasticsearchService
-from enum import Enum
-from app.modules.embedding.use_cases.encode_formula_tuples import (
-    make_encode_formula_tuples_use_case,
-)
+from services.index_manifest import IndexManifest
+from services.post_id_index import POST_ID_INDEX_PATH, PostIdIndex
+import services.model_manager as model_manager_module
+import services.tuple_store as tuple_store_module
 from app.modules.embedding.use_cases.parse_formula_to_tuples import (
     make_parse_formula_to_tuples_use_case,
 )
-from lib.tangentCFT.touple_encoder.encoder import TupleTokenizationMode
-from app.modules.embedding.use_cases.get_formula_vector_by_formula_encoded_tuples import (
-    make_get_formula_vector_by_formula_encoded_tuples_use_case,
+from app.modules.embedding.use_cases.get_slt_opt_and_type_combined_formula_vector_use_case import (
+    make_get_slt_opt_and_type_combined_formula_vector_use_case,
 )
 
-from typing import Dict, List, TypedDict, Set
-
-# Increase CSV field size limit to handle large formulas
-csv.field_size_limit(sys.maxsize)
-
 # Batch sizes
 BATCH_SIZE = 500
-SEARCH_BATCH_SIZE = 1000
-
-
-class EncodeFormulaTuplesUseCaseParams(Enum):
-    SLT = {
-        "encoder_type": "SLT",
-        "embedding_type": TupleTokenizationMode.Both_Separated,
-        "tokenize_numbers": True,
-    }
-
-    SLT_TYPE = {
-        "encoder_type": "SLT_TYPE",
-        "embedding_type": TupleTokenizationMode.Type,
-        "tokenize_numbers": False,
-    }
+# Vectors of the most recent unique formulas, reused across chunks and files
+DEDUP_CACHE_SIZE = 20000
 
-    OPT = {
-        "encoder_type": "OPT",
-        "embedding_type": TupleTokenizationMode.Both_Separated,
-        "tokenize_numbers": False,
-    }
+# SLT, SLT_TYPE and OPT are indexed together, in a single pass per file pair
+MANIFEST_GRAPH_TYPE = "SLT+SLT_TYPE+OPT"
 
 
 def get_formula_files(directory):
@@ -56,495 +37,476 @@ def get_formula_files(directory):
     return glob.glob(os.path.join(directory, "*.tsv"))
 
 
-def get_existing_post_ids(elastic_service, post_ids_to_check: List[str]) -> Set[str]:
+def pair_formula_files(slt_dir, opt_dir):
     """
-    Check which post_ids exist in the posts index.
-
-    Args:
-        elastic_service: Elasticsearch service instance
-        post_ids_to_check: List of post IDs to verify
+    Pair the SLT and OPT files of the same formulas by file name.
 
     Returns:
-        Set of post IDs that exist in the index
+        List of (slt_file, opt_file) tuples; opt_file is None when the SLT
+        file has no OPT counterpart
     """
-    existing_post_ids = set()
-
-    # Process in batches for bulk search
-    for i in range(0, len(post_ids_to_check), SEARCH_BATCH_SIZE):
-        batch_post_ids = post_ids_to_check[i : i + SEARCH_BATCH_SIZE]
-
-        # Construct bulk search query
-        body = {
-            "query": {"terms": {"post_id": batch_post_ids}},
-            "size": len(batch_post_ids),  # Get all matching documents
-            "_source": ["post_id"],  # Only get post_id field
-        }
-
-        try:
-            # Execute bulk search
-            result = elastic_service.es.search(
-                index=elastic_service.posts_index_name, body=body
-            )
-
-            # Process results - get found post_ids
-            if result["hits"]["total"]["value"] > 0:
-                for hit in result["hits"]["hits"]:
-                    # Ensure post_id is converted to string for consistent comparison
-                    post_id_from_es = str(hit["_source"]["post_id"])
-                    existing_post_ids.add(post_id_from_es)
-
-        except Exception as e:
-            print(f"Error checking existing post IDs: {str(e)}")
-            continue
+    opt_files = {os.path.basename(path): path for path in get_formula_files(opt_dir)}
+    pairs = []
+    for slt_file in sorted(get_formula_files(slt_dir)):
+        opt_file = opt_files.pop(os.path.basename(slt_file), None)
+        if opt_file is None:
+            print(f"No OPT file for {slt_file}, OPT vectors will be missing")
+        pairs.append((slt_file, opt_file))
+    for name in opt_files:
+        print(f"No SLT file for OPT file {name}, skipping...")
+    return pairs
 
-    return existing_post_ids
 
+def batched(items, size=BATCH_SIZE):
+    return [items[i : i + size] for i in range(0, len(items), size)]
 
-def process_formulas_to_index(file_path, elastic_service, graph_type: str):
-    """Process formulas from a TSV file and index them individually."""
-    try:
-        print(
-            f"Processing formulas from file: {file_path} with graph_type: {graph_type}..."
-        )
 
-        # Inicializar os UseCases necessários
-        parse_formula_to_tuples_use_case = make_parse_formula_to_tuples_use_case()
-        encode_formula_tuples_use_case = make_encode_formula_tuples_use_case()
-        get_formulas_vectors_use_case = (
-            make_get_formula_vector_by_formula_encoded_tuples_use_case(graph_type)
-        )
+def parse_formula_batch(batch):
+    """
+    Parse a batch of (slt_text, opt_text) formulas into tuples. The SLT tree
+    is parsed once for both SLT and SLT_TYPE.
 
-        with open(file_path, "r", encoding="utf-8") as file:
-            reader = csv.DictReader(file, delimiter="\t")
+    Returns:
+        (pid, seconds, [(slt_key, slt_tuples, opt_key, opt_tuples), ...]),
+        where the keys are the canonical tree strings (None when the
+        formula could not be parsed)
+    """
+    start_time = time.perf_counter()
+    parse_formula_to_tuples_use_case = make_parse_formula_to_tuples_use_case()
+    # One tuple store read and write per representation for the whole batch
+    slt_parsed = parse_formula_to_tuples_use_case.execute_many_with_key(
+        [slt_text for slt_text, _ in batch], operator=False
+    )
+    opt_texts = [opt_text for _, opt_text in batch if opt_text]
+    opt_parsed = iter(
+        parse_formula_to_tuples_use_case.execute_many_with_key(opt_texts, operator=True)
+        if opt_texts
+        else []
+    )
+    parsed = []
+    for (_, opt_text), (slt_key, slt_tuples) in zip(batch, slt_parsed):
+        opt_key, opt_tuples = next(opt_parsed) if opt_text else (None, None)
+        parsed.append((slt_key, slt_tuples, opt_key, opt_tuples))
+    return os.getpid(), time.perf_counter() - start_time, parsed
 
-            # Step 1: Collect all rows and unique post_ids from this file
-            formulas = []
-            post_ids_in_file = set()
 
-            print("Reading and parsing CSV file...")
-            for row_num, row in enumerate(reader, 1):
-                try:
-                    formulas.append(row)
-                    post_id = row.get("post_id")
-                    if post_id:
-                        post_ids_in_file.add(str(post_id))
+def encode_formula_batch(batch):
+    """
+    Encode a batch of unique (slt_tuples, opt_tuples) formulas for the three
+    models. Always runs in the main process, so new symbols get their ids
+    from the single EncoderManager whose maps are saved, in file order, and
+    the API encodes the same formula to the same tuples at query time.
+    """
+    return make_get_slt_opt_and_type_combined_formula_vector_use_case().encode_tuples(
+        [slt_tuples for slt_tuples, _ in batch],
+        [opt_tuples for _, opt_tuples in batch],
+    )
 
-                except Exception as e:
-                    print(f"Error reading row {row_num}: {str(e)}")
-                    continue
 
-            total_formulas = len(formulas)
-            print(f"Total formulas in file: {total_formulas}")
-            print(f"Unique post IDs in file: {len(post_ids_in_file)}")
+def embed_formula_batch(encoded_batches):
+    """
+    Generate the three vectors and the combined vector of a batch of
+    formulas encoded by encode_formula_batch, in memory.
 
-            # Step 2: Check which post_ids exist in the posts index
-            existing_post_ids = get_existing_post_ids(
-                elastic_service, list(post_ids_in_file)
-            )
-            print(f"Post IDs that exist in posts index: {len(existing_post_ids)}")
-
-            if not existing_post_ids:
-                print("No existing posts found for this file, skipping...")
-                return
-
-            # Step 3: Process only formulas from existing posts
-            processed = 0
-            successful = 0
-            skipped = 0
-            formula_documents = []
-            count = 0
-
-            for row in formulas:
-                try:
-                    count += 1
-                    formula_id = row.get("id")
-                    formula_text = row.get("formula")
-                    post_id = row.get("post_id")
-                    formula_type = row.get("type")
-
-                    if not formula_id or not formula_text or not post_id:
-                        skipped += 1
-                        continue
-
-                    # Ensure post_id is string for comparison
-                    post_id = str(post_id)
-
-                    # Check if formula type is "question"
-                    if formula_type != "question":
-                        skipped += 1
-                        continue
-
-                    # Check if post exists in the posts index
-                    if post_id not in existing_post_ids:
-                        skipped += 1
-                        continue
-
-                    # Preparar documento base
-                    formula_document = {
-                        "formula_id": formula_id,
-                        "post_id": post_id,
-                    }
-
-                    # Gerar tuplas baseado no tipo de grafo
-                    if graph_type == "SLT" or graph_type == "SLT_TYPE":
-                        tuples = parse_formula_to_tuples_use_case.execute(
-                            formula_text, operator=False
-                        )
-                    elif graph_type == "OPT":
-                        tuples = parse_formula_to_tuples_use_case.execute(
-                            formula_text, operator=True
-                        )
-
-                    if not tuples:
-                        print(
-                            f"No tuples generated for formula {formula_id}, with graph type {graph_type}, skipping..."
-                        )
-                        skipped += 1
-                        continue
-
-                    # Codificar tuplas baseado no tipo de grafo
-                    if graph_type == "SLT":
-                        encoded_tuples = encode_formula_tuples_use_case.execute(
-                            tuples, **EncodeFormulaTuplesUseCaseParams.SLT.value
-                        )
-                    elif graph_type == "SLT_TYPE":
-                        encoded_tuples = encode_formula_tuples_use_case.execute(
-                            tuples, **EncodeFormulaTuplesUseCaseParams.SLT_TYPE.value
-                        )
-                    elif graph_type == "OPT":
-                        encoded_tuples = encode_formula_tuples_use_case.execute(
-                            tuples, **EncodeFormulaTuplesUseCaseParams.OPT.value
-                        )
-
-                    # Gerar vetor
-                    formula_vector = get_formulas_vectors_use_case.execute(
-                        encoded_tuples
-                    )
+    Returns:
+        (pid, seconds, vectors of each formula)
+    """
+    start_time = time.perf_counter()
+    combined_vector_use_case = (
+        make_get_slt_opt_and_type_combined_formula_vector_use_case()
+    )
+    vectors_batch = combined_vector_use_case.embed_encoded_tuples(encoded_batches)
+    return os.getpid(), time.perf_counter() - start_time, vectors_batch
 
-                    # Adicionar vetor específico ao documento baseado no tipo
-                    if graph_type == "SLT":
-                        formula_document["slt_vector"] = formula_vector
-                        formula_document["slt_text"] = formula_text
-                    elif graph_type == "SLT_TYPE":
-                        formula_document["slt_type_vector"] = formula_vector
-                    elif graph_type == "OPT":
-                        formula_document["opt_vector"] = formula_vector
-                        formula_document["opt_text"] = formula_text
-
-                    formula_documents.append(formula_document)
-                    successful += 1
-
-                    # Processar em lotes
-                    if len(formula_documents) >= BATCH_SIZE:
-                        if graph_type == "SLT":
-                            # Para SLT, fazemos index (primeira vez)
-                            success = elastic_service.bulk_index_formulas(
-                                formula_documents
-                            )
-                        else:
-                            # Para SLT_TYPE e OPT, fazemos update
-                            success = bulk_update_formulas(
-                                elastic_service, formula_documents, graph_type
-                            )
-
-                        if success:
-                            print(
-                                f"Successfully processed batch of {len(formula_documents)} formulas for {graph_type}"
-                            )
-                        else:
-                            print(
-                                f"Error processing batch of {len(formula_documents)} formulas for {graph_type}"
-                            )
-
-                        formula_documents = []
-
-                    processed += 1
-                    if processed % 100 == 0:
-                        print(
-                            f"Processed {processed}/{total_formulas} formulas, {successful} successful, {skipped} skipped"
-                        )
-
-                except Exception as e:
-                    print(
-                        f"Error processing formula {row.get('id', 'unknown')}: {str(e)}"
-                    )
-                    skipped += 1
-                    continue
-
-            # Processar último lote
-            if formula_documents:
-                if graph_type == "SLT":
-                    success = elastic_service.bulk_index_formulas(formula_documents)
-                else:
-                    success = bulk_update_formulas(
-                        elastic_service, formula_documents, graph_type
-                    )
 
-                if success:
-                    print(
-                        f"Successfully processed final batch of {len(formula_documents)} formulas for {graph_type}"
-                    )
-                else:
-                    print(
-                        f"Error processing final batch of {len(formula_documents)} formulas for {graph_type}"
-                    )
+def group_by_canonical_tree(rows, parse_map, worker_seconds):
+    """
+    Parse the formulas of a chunk and group them by canonical tree.
 
-            print(
-                f"File processing completed for {graph_type}: {processed}/{total_formulas} processed, {successful} successful, {skipped} skipped"
-            )
+    Identical MathML is parsed only once; different MathML with the same
+    SLT and OPT canonical trees (ARQMath repeats the same formula across
+    posts, with different ids) ends up in the same group.
 
-    except Exception as e:
-        print(f"Error processing formulas from file {file_path}: {str(e)}")
-        import traceback
+    Returns:
+        (unique formulas as (key, slt_tuples, opt_tuples), row indices of
+        each unique formula, number of rows skipped because the SLT could
+        not be parsed)
+    """
+    raw_index = {}
+    for slt_text, opt_text in ((row[2], row[3]) for row in rows):
+        raw_index.setdefault((slt_text, opt_text), len(raw_index))
+    raw_formulas = list(raw_index)
+
+    parsed = []
+    for pid, seconds, parsed_batch in parse_map(
+        parse_formula_batch, batched(raw_formulas)
+    ):
+        worker_seconds[pid] += seconds
+        parsed.extend(parsed_batch)
+
+    unique_index = {}
+    unique_formulas = []
+    occurrences = []
+    skipped = 0
+    for row_index, (_, _, slt_text, opt_text) in enumerate(rows):
+        slt_key, slt_tuples, opt_key, opt_tuples = parsed[
+            raw_index[(slt_text, opt_text)]
+        ]
+        if slt_key is None:
+            print(f"No SLT tree for formula {rows[row_index][0]}, skipping...")
+            skipped += 1
+            continue
+        key = (slt_key, opt_key)
+        if key not in unique_index:
+            unique_index[key] = len(unique_formulas)
+            unique_formulas.append((key, slt_tuples, opt_tuples))
+            occurrences.append([])
+        occurrences[unique_index[key]].append(row_index)
 
-        print("Stacktrace:")
-        print(traceback.format_exc())
+    return unique_formulas, occurrences, skipped
 
 
-def bulk_update_formulas(elastic_service, formula_documents, graph_type):
+def build_formula_documents(rows, occurrences, vectors):
     """
-    Bulk update formulas with specific vector type.
+    Fan the vectors of each unique formula out to every formula_id that
+    shares it.
 
-    Args:
-        elastic_service: Elasticsearch service instance
-        formula_documents: List of formula documents with vectors
-        graph_type: Type of vector being updated (SLT_TYPE, OPT)
+    Returns:
+        (documents, number of skipped formulas, number of documents without
+        the combined vector)
     """
-    if not formula_documents:
-        return True
-
-    try:
-        bulk_data = []
-
-        for formula_doc in formula_documents:
-            formula_id = formula_doc["formula_id"]
-
-            # Preparar documento de update
-            update_doc = {}
-            if graph_type == "SLT_TYPE" and "slt_type_vector" in formula_doc:
-                update_doc["slt_type_vector"] = formula_doc["slt_type_vector"]
-            elif graph_type == "OPT" and "opt_vector" in formula_doc:
-                update_doc["opt_vector"] = formula_doc["opt_vector"]
-                # Adicionar opt_text se existir
-                if "opt_text" in formula_doc:
-                    update_doc["opt_text"] = formula_doc["opt_text"]
-
-            if not update_doc:
+    documents = []
+    skipped = 0
+    incomplete = 0
+    for row_indices, formula_vectors in zip(occurrences, vectors):
+        for row_index in row_indices:
+            formula_id, post_id, slt_text, opt_text = rows[row_index]
+            if formula_vectors["slt_vector"] is None:
+                print(f"No SLT vector for formula {formula_id}, skipping...")
+                skipped += 1
                 continue
 
-            # Processar numpy arrays se necessário
-            for vector_field in ["slt_type_vector", "opt_vector"]:
-                if vector_field in update_doc and isinstance(
-                    update_doc[vector_field], np.ndarray
-                ):
-                    update_doc[vector_field] = update_doc[vector_field].tolist()
-
-            # Construir operação de update
-            action = {
-                "update": {
-                    "_index": elastic_service.formulas_index_name,
-                    "_id": formula_id,
-                }
+            formula_document = {
+                "formula_id": formula_id,
+                "post_id": post_id,
+                "slt_text": slt_text,
             }
-            doc = {"doc": update_doc}
+            if opt_text:
+                formula_document["opt_text"] = opt_text
+            for field, vector in formula_vectors.items():
+                if vector is not None:
+                    formula_document[field] = vector
+            if formula_vectors["formula_vector"] is None:
+                incomplete += 1
+            documents.append(formula_document)
 
-            bulk_data.append(action)
-            bulk_data.append(doc)
+    return documents, skipped, incomplete
 
-        # Executar bulk update
-        response = elastic_service.es.bulk(operations=bulk_data, refresh=True)
-        return not response.get("errors", False)
 
-    except Exception as e:
-        print(f"Error bulk updating formulas: {str(e)}")
-        return False
+class FormulaVectorLRU:
+    """Vectors of the last `max_size` unique formulas, by canonical tree"""
 
+    def __init__(self, max_size=DEDUP_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
 
-def combine_formula_vectors(elastic_service, batch_size=1000):
-    """
-    Combine all formula vectors (SLT + SLT_TYPE + OPT) into formula_vector.
-    """
-    print("Starting to combine formula vectors...")
-
-    scroll_time = "5m"
-
-    # Query para encontrar documentos que têm todos os 3 tipos de vetores
-    search_query = {
-        "query": {
-            "bool": {
-                "must": [
-                    {"exists": {"field": "slt_vector"}},
-                    {"exists": {"field": "slt_type_vector"}},
-                    {"exists": {"field": "opt_vector"}},
-                ]
-            }
-        },
-        "size": batch_size,
-    }
-
-    result = elastic_service.es.search(
-        index=elastic_service.formulas_index_name, body=search_query, scroll=scroll_time
-    )
+    def get(self, key):
+        vectors = self.entries.get(key)
+        if vectors is not None:
+            self.entries.move_to_end(key)
+        return vectors
 
-    print(f"Found {result['hits']['total']['value']} formulas to combine vectors")
+    def put(self, key, vectors):
+        self.entries[key] = vectors
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
 
-    scroll_id = result["_scroll_id"]
-    hits = result["hits"]["hits"]
 
-    processed = 0
-    bulk_updates = []
-
-    while hits:
-        for hit in hits:
-            try:
-                formula_id = hit["_id"]
-                source = hit["_source"]
-
-                slt_vector = np.array(source.get("slt_vector", []))
-                slt_type_vector = np.array(source.get("slt_type_vector", []))
-                opt_vector = np.array(source.get("opt_vector", []))
+def embed_formula_chunk(
+    rows, parse_map, embed_map, vector_cache, worker_formulas, worker_seconds
+):
+    """
+    Parse a chunk, embed the unique formulas not in the vector cache and
+    build the documents of every row.
 
-                if (
-                    slt_vector.size == 0
-                    or slt_type_vector.size == 0
-                    or opt_vector.size == 0
-                ):
-                    print(f"Missing vectors for formula {formula_id}, skipping...")
-                    continue
+    Returns:
+        (documents, skipped, incomplete, formulas, embedded, embed_seconds)
+    """
+    unique_formulas, occurrences, parse_skipped = group_by_canonical_tree(
+        rows, parse_map, worker_seconds
+    )
 
-                # Combinar vetores (soma)
-                combined_vector = slt_vector + slt_type_vector + opt_vector
+    vectors = [vector_cache.get(key) for key, _, _ in unique_formulas]
+    missing = [index for index, formula_vectors in enumerate(vectors) if formula_vectors is None]
+    embed_seconds = 0.0
+    position = 0
+    # Encoded here, embedded in the workers
+    encoded = [
+        encode_formula_batch(batch)
+        for batch in batched([unique_formulas[index][1:] for index in missing])
+    ]
+    for pid, seconds, vectors_batch in embed_map(embed_formula_batch, encoded):
+        worker_formulas[pid] += len(vectors_batch)
+        worker_seconds[pid] += seconds
+        embed_seconds += seconds
+        for formula_vectors in vectors_batch:
+            index = missing[position]
+            vectors[index] = formula_vectors
+            vector_cache.put(unique_formulas[index][0], formula_vectors)
+            position += 1
+
+    documents, skipped, incomplete = build_formula_documents(rows, occurrences, vectors)
+    return (
+        documents,
+        parse_skipped + skipped,
+        incomplete,
+        len(rows) - parse_skipped,
+        len(missing),
+        embed_seconds,
+    )
 
-                bulk_updates.append(
-                    {
-                        "formula_id": formula_id,
-                        "formula_vector": combined_vector.tolist(),
-                    }
-                )
 
-                processed += 1
+def process_formula_file(
+    slt_file, opt_file, elastic_service, post_id_index, manifest, writer, stats,
+    parse_map, embed_map, vector_cache,
+    worker_formulas, worker_seconds,
+):
+    """
+    Index the formulas of a pair of SLT/OPT files. The files are streamed
+    in chunks, so memory does not grow with the file size and embedding
+    starts with the first chunk. Each unique canonical tree is embedded
+    once (while it stays in the vector cache) and each document is written
+    exactly once.
+
+    The manifest entry of the pair records the SLT rows whose documents
+    were confirmed by Elasticsearch: a finished pair with unchanged content
+    is skipped and an interrupted one resumes after its committed rows.
+    """
+    try:
+        start_row = manifest.begin(slt_file, MANIFEST_GRAPH_TYPE, [slt_file, opt_file])
+        if start_row is None:
+            print(f"{slt_file} already indexed and unchanged, skipping...")
+            return
+        print(
+            f"Processing formulas from {slt_file} and {opt_file}"
+            + (f", resuming at row {start_row}..." if start_row else "...")
+        )
 
-                # Processar em lotes
-                if len(bulk_updates) >= batch_size:
-                    success = bulk_update_combined_vectors(
-                        elastic_service, bulk_updates
+        file_stats = defaultdict(float)
+        next_row = start_row
+        with OptFormulaLookup(opt_file) as opt_lookup:
+            for rows, rows_read, next_row in iter_formula_chunks(
+                slt_file, opt_lookup, post_id_index, start_row
+            ):
+                stats["rows_read"] += rows_read
+                if rows:
+                    (
+                        documents,
+                        skipped,
+                        incomplete,
+                        formulas,
+                        embedded,
+                        embed_seconds,
+                    ) = embed_formula_chunk(
+                        rows, parse_map, embed_map, vector_cache,
+                        worker_formulas, worker_seconds,
                     )
-                    if success:
-                        print(
-                            f"Successfully combined vectors for batch of {len(bulk_updates)} formulas"
-                        )
-                    else:
-                        print(
-                            f"Error combining vectors for batch of {len(bulk_updates)} formulas"
-                        )
-                    bulk_updates = []
-
-                if processed % 1000 == 0:
-                    print(f"Combined vectors for {processed} formulas")
-
-            except Exception as e:
-                print(f"Error combining vectors for formula {hit['_id']}: {str(e)}")
-                continue
-
-        # Próximo lote
-        result = elastic_service.es.scroll(scroll_id=scroll_id, scroll=scroll_time)
-        scroll_id = result["_scroll_id"]
-        hits = result["hits"]["hits"]
-
-    # Processar último lote
-    if bulk_updates:
-        success = bulk_update_combined_vectors(elastic_service, bulk_updates)
-        if success:
-            print(
-                f"Successfully combined vectors for final batch of {len(bulk_updates)} formulas"
-            )
+                    writer.write(elastic_service.index_formula_actions(documents))
+                    stats["queued"] += len(documents)
+                    stats["skipped"] += skipped
+                    stats["incomplete"] += incomplete
+                    file_stats["formulas"] += formulas
+                    file_stats["embedded"] += embedded
+                    file_stats["embed_seconds"] += embed_seconds
+                # Every row of the chunk is covered once its documents are confirmed
+                writer.mark(manifest.offset(slt_file, MANIFEST_GRAPH_TYPE, next_row))
+                print(f"Read {next_row} rows of {slt_file}, {stats['queued']} queued so far")
+            if opt_lookup.dropped:
+                print(f"⚠️  {opt_lookup.dropped} OPT rows dropped from the lookahead buffer")
+        writer.mark(manifest.offset(slt_file, MANIFEST_GRAPH_TYPE, next_row, done=True))
+
+        # Time the duplicates would have taken to embed, at the measured rate
+        formulas = int(file_stats["formulas"])
+        embedded = int(file_stats["embedded"])
+        embed_seconds = file_stats["embed_seconds"]
+        saved_seconds = (
+            embed_seconds / embedded * (formulas - embedded) if embedded else 0.0
+        )
+        stats["formulas"] += formulas
+        stats["unique"] += embedded
+        stats["saved_seconds"] += saved_seconds
+        print(
+            f"Dedup: {formulas} formulas, {embedded} embedded "
+            f"({100 * (1 - embedded / formulas) if formulas else 0:.1f}% "
+            f"duplicates), embedded in {embed_seconds:.1f}s, ~{saved_seconds:.1f}s saved"
+        )
 
-    elastic_service.es.clear_scroll(scroll_id=scroll_id)
-    print(f"✅ Completed combining vectors for {processed} formulas")
+    except Exception as e:
+        print(f"Error processing formulas from file {slt_file}: {str(e)}")
+        import traceback
 
+        print("Stacktrace:")
+        print(traceback.format_exc())
 
-def bulk_update_combined_vectors(elastic_service, updates):
-    """Update formulas with combined vectors."""
-    if not updates:
-        return True
 
-    try:
-        bulk_data = []
+def init_embedding_worker(tuple_store_path=None):
+    """
+    Initialize a worker process: the models are memory-mapped, so all workers
+    share the same pages. All workers share the same tuple store. The workers
+    only parse and embed; the tuples are encoded in the main process.
+    """
+    tuple_store_module.TUPLE_STORE_PATH = tuple_store_path
+    model_manager_module.CFT_MODEL_MMAP = True
 
-        for update in updates:
-            formula_id = update["formula_id"]
-            formula_vector = update["formula_vector"]
 
-            action = {
-                "update": {
-                    "_index": elastic_service.formulas_index_name,
-                    "_id": formula_id,
-                }
-            }
-            doc = {"doc": {"formula_vector": formula_vector}}
+def process_formula_files(
+    file_pairs, elastic_service, post_id_index, manifest, writer, stats, workers
+):
+    """
+    Index all the file pairs. With more than one worker, parsing and
+    embedding are sharded across `workers` processes; the results come back
+    to this process, the single writer, which encodes the tuples between the
+    two stages and sends the bulk requests.
+    """
+    worker_formulas = defaultdict(int)
+    worker_seconds = defaultdict(float)
+    vector_cache = FormulaVectorLRU()
+
+    def index_files(parse_map, embed_map):
+        for file_counter, (slt_file, opt_file) in enumerate(file_pairs, 1):
+            process_formula_file(
+                slt_file, opt_file, elastic_service, post_id_index, manifest,
+                writer, stats,
+                parse_map, embed_map, vector_cache, worker_formulas, worker_seconds,
+            )
+            print(
+                f"Processed {file_counter} of {len(file_pairs)} file pairs, "
+                f"{stats['queued']} queued so far"
+            )
 
-            bulk_data.append(action)
-            bulk_data.append(doc)
+    if workers > 1:
+        # spawn: the workers don't inherit the Elasticsearch connections or torch state
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+            workers,
+            initializer=init_embedding_worker,
+            initargs=(tuple_store_module.TUPLE_STORE_PATH,),
+        ) as pool:
+            index_files(pool.imap, pool.imap)
+    else:
+        index_files(map, map)
+
+    print("Unique formulas/sec per worker (parsing + embedding):")
+    for pid in sorted(worker_formulas):
+        elapsed = worker_seconds[pid]
+        print(
+            f"  worker {pid}: {worker_formulas[pid]} formulas, "
+            f"{worker_formulas[pid] / elapsed if elapsed else 0.0:.1f} formulas/sec"
+        )
 
-        response = elastic_service.es.bulk(operations=bulk_data, refresh=True)
-        return not response.get("errors", False)
 
-    except Exception as e:
-        print(f"Error bulk updating combined vectors: {str(e)}")
-        return False
+def main():
+    parser = argparse.ArgumentParser(description="Populate the formulas index")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of embedding processes (1 embeds in this process)",
+    )
+    parser.add_argument(
+        "--tuple-store",
+        default=tuple_store_module.TUPLE_STORE_PATH
+        or tuple_store_module.DEFAULT_TUPLE_STORE_PATH,
+        help="sqlite file of the parsed formula tuples (empty to disable)",
+    )
+    parser.add_argument(
+        "--post-id-index",
+        default=POST_ID_INDEX_PATH,
+        help="Local index of the post ids of the posts index",
+    )
+    parser.add_argument(
+        "--rebuild-post-id-index",
+        action="store_true",
+        help="Export all post ids again instead of refreshing the local index",
+    )
+    parser.add_argument(
+        "--reset-manifest",
+        action="store_true",
+        help="Forget the progress of previous runs and index every file again",
+    )
+    args = parser.parse_args()
 
+    # Formulas parsed by a previous run are read from the store, not parsed again
+    tuple_store_module.TUPLE_STORE_PATH = args.tuple_store or None
 
-def main():
     # Initialize Elasticsearch service
     elastic_service = ElasticsearchService()
+    elastic_service.bootstrap_indices()
+    # The index records the model format (CFT_MODEL_FORMAT) of its vectors;
+    # resuming with another format would mix vectors the queries can't match
+    model_manager_module.check_formulas_index_format(elastic_service, indexing=True)
+
+    # Existing posts are looked up locally instead of one search per 1000 ids.
+    # The refresh only adds posts with a post_id above the largest known one,
+    # so rebuild after indexing posts out of order.
+    if args.rebuild_post_id_index:
+        post_id_index = PostIdIndex.build(elastic_service)
+        post_id_index.save(args.post_id_index)
+    else:
+        post_id_index = PostIdIndex.load_or_build(args.post_id_index, elastic_service)
 
     # Define directories with formula files
     slt_dir = "data/arqmath/slt_representation_v3"
     opt_dir = "data/arqmath/opt_representation_v3"
 
-    # Get all files from both directories (they should contain the same formulas)
-    print(f"Getting formula files from {slt_dir}...")
-    slt_files = get_formula_files(slt_dir)
-
-    print(f"Getting formula files from {opt_dir}...")
-    opt_files = get_formula_files(opt_dir)
-
-    # Step 1: Process SLT first (creates documents)
-    print("Processing SLT formulas...")
-    file_counter = 0
-    for file_path in slt_files:
-        process_formulas_to_index(file_path, elastic_service, graph_type="SLT")
-        file_counter += 1
-        print(f"Processed SLT: {file_counter} of {len(slt_files)} files")
-
-    # Step 2: Process SLT_TYPE (updates existing documents)
-    print("Processing SLT_TYPE formulas...")
-    file_counter = 0
-    for file_path in slt_files:
-        process_formulas_to_index(file_path, elastic_service, graph_type="SLT_TYPE")
-        file_counter += 1
-        print(f"Processed SLT_TYPE: {file_counter} of {len(slt_files)} files")
-
-    # Step 3: Process OPT (updates existing documents)
-    print("Processing OPT formulas...")
-    file_counter = 0
-    for file_path in opt_files:
-        process_formulas_to_index(file_path, elastic_service, graph_type="OPT")
-        file_counter += 1
-        print(f"Processed OPT: {file_counter} of {len(opt_files)} files")
-
-    # Step 4: Combine all vectors
-    print("\nCombining all formula vectors...")
-    combine_formula_vectors(elastic_service)
+    # SLT and OPT files contain the same formulas, in different representations
+    file_pairs = pair_formula_files(slt_dir, opt_dir)
+
+    stats = {
+        "rows_read": 0,
+        "queued": 0,
+        "skipped": 0,
+        "incomplete": 0,
+        "formulas": 0,
+        "unique": 0,
+        "saved_seconds": 0.0,
+    }
+    start_time = time.time()
+    # Bulk-load mode: no refreshes or replicas while loading, then a single
+    # refresh and a force merge. The single writer streams the documents.
+    # Progress per file pair, committed as Elasticsearch confirms the documents
+    manifest = IndexManifest(elastic_service.formulas_index_name)
+    if args.reset_manifest:
+        manifest.entries = {}
+    with elastic_service.bulk_load(
+        elastic_service.formulas_index_name
+    ), elastic_service.bulk_writer(on_commit=manifest.commit) as writer:
+        process_formula_files(
+            file_pairs, elastic_service, post_id_index, manifest, writer, stats,
+            args.workers,
+        )
 
-    print("✅ All formula processing completed!")
+    elapsed = time.time() - start_time
+    indexed = writer.get_stats()["succeeded"]
+    print(
+        f"✅ All formula processing completed in {elapsed:.1f}s "
+        f"({indexed / elapsed if elapsed else 0.0:.1f} formulas/sec with {args.workers} worker(s)): "
+        f"{indexed} formulas indexed ({stats['incomplete']} without the combined vector), "
+        f"{stats['skipped']} skipped, {stats['rows_read']} rows read"
+    )
+    if stats["formulas"]:
+        print(
+            f"Dedup: {stats['unique']} embedded for {stats['formulas']} formulas "
+            f"({100 * (1 - stats['unique'] / stats['formulas']):.1f}% duplicates), "
+            f"~{stats['saved_seconds']:.1f}s of embedding saved"
+        )
+    writer.report("Formula indexing")
+    manifest.report()
+    tuple_store = tuple_store_module.get_tuple_store()
+    if tuple_store is not None and args.workers == 1:
+        tuple_store.report()
 
 
 if __name__ == "__main__":
     main()
-
-
-# TODO:
-# popular o slt_text e o opt_text
-# investigar pq opt_vector não está sendo populado
-# popular o formula_vector com os 3 vetores combinados
@@ -7,9 +7,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tqdm import tqdm
 from services.elasticsearch_service import ElasticsearchService
-from app.modules.embedding.use_cases.get_text_vector import (
-    make_get_text_vector_use_case,
-)
+from services.model_manager import model_manager
 
 
 CHECKPOINT_FILE = os.path.join(
@@ -23,7 +21,8 @@ MAX_WORKERS = 4
 lock = threading.Lock()
 
 elastic_service = ElasticsearchService()
-text_vector_use_case = make_get_text_vector_use_case()
+elastic_service.bootstrap_indices()
+text_embedding_service = model_manager.get_text_model()
 
 
 def load_last_checkpoint():
@@ -103,22 +102,14 @@ def process_batch(posts):
 
         # Process HTML texts (batch encode for efficiency)
         if any(html_texts):
-            html_vectors = text_vector_use_case.model.encode(
-                html_texts,
-                convert_to_numpy=True,
-                normalize_embeddings=True,
-                batch_size=32,
-                show_progress_bar=False,
+            html_vectors = text_embedding_service.encode(
+                html_texts, batch_size=32
             )
 
         # Process formula texts (batch encode for efficiency)
         if any(formula_texts):
-            formula_vectors = text_vector_use_case.model.encode(
-                formula_texts,
-                convert_to_numpy=True,
-                normalize_embeddings=True,
-                batch_size=32,
-                show_progress_bar=False,
+            formula_vectors = text_embedding_service.encode(
+                formula_texts, batch_size=32
             )
 
         # Create update objects
@@ -127,11 +118,11 @@ def process_batch(posts):
 
             # Add HTML vector if text exists
             if html_texts[i]:
-                update_data["text_without_html_vector"] = html_vectors[i].tolist()
+                update_data["text_without_html_vector"] = html_vectors[i]
 
             # Add formula vector if text exists
             if formula_texts[i]:
-                update_data["text_without_formula_vector"] = formula_vectors[i].tolist()
+                update_data["text_without_formula_vector"] = formula_vectors[i]
 
             # Only add if we have at least one vector to update
             if len(update_data) > 1:  # More than just post_id
@@ -143,9 +134,9 @@ def process_batch(posts):
         return []
 
 
-def update_batch(elastic_service, batch):
+def update_batch(writer, batch):
     try:
-        elastic_service.bulk_update_posts(batch)
+        writer.write(elastic_service.update_post_actions(batch))
     except Exception as e:
         print(f"Erro ao atualizar batch: {e}")
 
@@ -200,9 +191,10 @@ def update_vectors():
     total_processed = 0
     pbar = tqdm(total=total_posts, desc="Atualizando vetores")
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-
+    # O refresh é feito uma única vez, no fim, pelo bulk_load(): a busca por
+    # post_id > checkpoint não depende dos vetores já escritos
+    writer = elastic_service.bulk_writer(max_in_flight=MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, writer:
         while True:
             print(f"Fetching posts from {last_post_id} to {last_post_id + BATCH_SIZE}")
             posts = fetch_posts_from_elastic(last_post_id, BATCH_SIZE)
@@ -224,14 +216,10 @@ def update_vectors():
                 all_updates.extend(updates)
 
             if all_updates:
-                # Submit updates in chunks to avoid overwhelming Elasticsearch
-                for i in range(0, len(all_updates), 100):
-                    chunk = all_updates[i : i + 100]
-                    futures.append(
-                        executor.submit(update_batch, elastic_service, chunk)
-                    )
-
+                # post_id is popped while building the update actions
                 last_post_id = max([update["post_id"] for update in all_updates])
+                update_batch(writer, all_updates)
+
                 save_checkpoint(last_post_id)
 
                 # Update progress
@@ -240,16 +228,14 @@ def update_vectors():
                 pbar.update(chunk_size)
                 pbar.set_postfix({"Último ID": last_post_id})
 
-        # Wait for all futures to complete
-        for future in futures:
-            future.result()
-
     pbar.close()
+    writer.report("Atualização de vetores de texto")
     print(f"Atualização finalizada: {total_processed} posts processados")
 
 
 def main():
-    update_vectors()
+    with elastic_service.bulk_load(elastic_service.posts_index_name):
+        update_vectors()
 
 
 if __name__ == "__main__":
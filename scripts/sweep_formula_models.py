@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Hyper-parameter sweep of a formula model (SLT, SLT_TYPE or OPT) on the
+NTCIR-12 collection, instead of the manual sequence of config_x files, train,
+retrieve and trec_eval:
+
+1. the collection and the queries are parsed and encoded once, and the corpus
+   file and the encoded formulas are shared by all the trials (reused by
+   later sweeps of the same representation)
+2. the trials (a grid over a base configuration, or a list of configuration
+   files) run in a process pool bounded by the cores (--trial-workers
+   threads each) and by the available memory (the estimated peak of a trial)
+3. each trial is evaluated in-process (bpref on the NTCIR-12 queries, see
+   lib/tangentCFT/evaluation.py) and its result is cached in
+   --sweep-dir/trials, so an interrupted sweep resumes where it stopped
+
+The output is a leaderboard of bpref against train time and model size,
+also written to --sweep-dir/leaderboard.tsv.
+
+    python scripts/sweep_formula_models.py \\
+        --dataset /NTCIR12_MathIR_WikiCorpus_v2.1.0/MathTagArticles --queries ./TestQueries \\
+        --representation SLT --grid '{"max": [4, 5, 6], "vector_size": [150, 300]}'
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Configuration.config_file_generator import grid_configurations
+from Configuration.configuration import Configuration
+from lib.tangentCFT.corpus import REPRESENTATIONS, write_corpus_file
+from lib.tangentCFT.evaluation import read_qrels
+from scripts.benchmark_fasttext_training import CONFIG_IDS, JUDGE_FILE_PATH, evaluate_model, load_encoded
+
+SWEEP_DIR = "data/ntcir12/sweeps"
+# Threads de FastText por trial
+TRIAL_WORKERS = 2
+# Buckets de n-gramas do FastText do gensim (o treino não altera o padrão)
+FASTTEXT_BUCKETS = 2000000
+# Parâmetros que não alteram o modelo treinado
+IGNORED_PARAMETERS = ("id", "workers", "result_vector_file_path")
+
+# Dados compartilhados de cada processo de trial, carregados por init_trial_worker
+_collection = None
+_queries = None
+_qrels = None
+
+
+def trial_key(representation, config, seed):
+    """Id of a trial: hash of the representation, seed and model parameters"""
+    parameters = {
+        name: str(value) for name, value in sorted(config.__dict__.items()) if name not in IGNORED_PARAMETERS
+    }
+    content = json.dumps({"representation": representation, "seed": seed, "parameters": parameters}, sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:12], parameters
+
+
+def prepare_shared(args, shared_dir):
+    """
+    Parses and encodes the collection and the queries once for all trials.
+    :return: (corpus file path, encoded file path, metadata)
+    """
+    corpus_file = os.path.join(shared_dir, "corpus.txt")
+    encoded_file = os.path.join(shared_dir, "encoded.pkl")
+    meta_file = os.path.join(shared_dir, "meta.json")
+    source = {"dataset": args.dataset, "queries": args.queries, "representation": args.representation}
+    if os.path.exists(meta_file) and os.path.exists(corpus_file) and os.path.exists(encoded_file):
+        with open(meta_file, encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta["source"] == source:
+            print(f"Reusing the encoded corpus in {shared_dir}")
+            return corpus_file, encoded_file, meta
+
+    os.makedirs(shared_dir, exist_ok=True)
+    collection, queries = load_encoded(args.dataset, args.queries, args.representation)
+    write_corpus_file(corpus_file, collection.values()).report()
+    with open(encoded_file + ".tmp", "wb") as file:
+        pickle.dump((collection, queries), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(encoded_file + ".tmp", encoded_file)
+    meta = {
+        "source": source,
+        "formulas": len(collection),
+        "queries": len(queries),
+        "vocabulary": len({encoded_tuple for tuples in collection.values() for encoded_tuple in tuples}),
+    }
+    with open(meta_file, "w", encoding="utf-8") as file:
+        json.dump(meta, file)
+    print(f"{meta['formulas']} formulas and {meta['queries']} queries encoded to {shared_dir}")
+    return corpus_file, encoded_file, meta
+
+
+def estimate_trial_mb(config, meta, encoded_file):
+    """
+    Rough peak memory of a trial: the n-gram buckets, the vocabulary vectors (input, output and normalized), the
+    collection vectors of the evaluation and the shared formulas loaded by the process.
+    """
+    vector_bytes = int(config.vector_size) * 4
+    model = (FASTTEXT_BUCKETS + 3 * meta["vocabulary"]) * vector_bytes
+    evaluation = 2 * meta["formulas"] * vector_bytes
+    shared = 4 * os.path.getsize(encoded_file)
+    return 1.2 * (model + evaluation + shared) / 1024**2
+
+
+def available_memory_mb():
+    """MemAvailable (Linux: /proc/meminfo), or the physical memory where that is not available"""
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**2
+
+
+def init_trial_worker(encoded_file, judge_file_path):
+    global _collection, _queries, _qrels
+    with open(encoded_file, "rb") as file:
+        _collection, _queries = pickle.load(file)
+    _qrels = read_qrels(judge_file_path)
+
+
+def run_trial(key, parameters, config_dict, corpus_file, trial_dir, model_dir, workers, seed, keep_model):
+    """Trains, evaluates and measures one trial (runs in a pool process); the result is cached in trial_dir"""
+    from lib.tangentCFT.model import TangentCftModel, TrainingTelemetryCallback
+
+    config = Configuration()
+    config.__dict__.update(config_dict)
+    config.workers = workers
+    telemetry_path = os.path.join(trial_dir, f"{key}.telemetry.jsonl")
+    if os.path.exists(telemetry_path):
+        os.remove(telemetry_path)
+    telemetry = TrainingTelemetryCallback(telemetry_path, run_id=key)
+    model = TangentCftModel()
+    train_time = model.train(config, corpus_file=corpus_file, seed=seed, telemetry=telemetry)
+    scores = evaluate_model(model, _collection, _queries, _qrels, None, key)
+
+    model_path = os.path.join(model_dir, key, "model")
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    model.save_model(model_path)
+    model_size = sum(os.path.getsize(path) for path in glob.glob(model_path + "*"))
+    if not keep_model:
+        shutil.rmtree(os.path.dirname(model_path))
+
+    summary = telemetry.summary()
+    result = {
+        "trial": key,
+        "parameters": parameters,
+        "bpref_full": scores["bpref_full"],
+        "bpref_partial": scores["bpref_partial"],
+        "train_seconds": train_time.total_seconds(),
+        "words_per_sec": summary.get("words_per_sec"),
+        "max_rss_mb": summary.get("max_rss_mb"),
+        "model_size_mb": model_size / 1024**2,
+        "vocabulary": len(model.model.wv.key_to_index),
+        "workers": workers,
+        "model_path": model_path if keep_model else None,
+    }
+    result_path = os.path.join(trial_dir, f"{key}.json")
+    with open(result_path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(result, file, indent=2)
+    os.replace(result_path + ".tmp", result_path)
+    return result
+
+
+def load_trial(trial_dir, key):
+    result_path = os.path.join(trial_dir, f"{key}.json")
+    if not os.path.exists(result_path):
+        return None
+    with open(result_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def print_leaderboard(results, leaderboard_path):
+    """Trials by bpref (partial, then full), with the parameters that vary across them"""
+    results = sorted(results, key=lambda result: (result["bpref_partial"], result["bpref_full"]), reverse=True)
+    names = sorted({name for result in results for name in result["parameters"]})
+    varying = [
+        name for name in names if len({result["parameters"].get(name) for result in results}) > 1
+    ] or names
+    columns = ["trial", *varying, "bpref_full", "bpref_partial", "train_seconds", "words_per_sec", "model_size_mb"]
+    rows = [
+        [
+            result["trial"],
+            *(result["parameters"].get(name, "") for name in varying),
+            f"{result['bpref_full']:.4f}",
+            f"{result['bpref_partial']:.4f}",
+            f"{result['train_seconds']:.1f}",
+            f"{result['words_per_sec'] or 0:.0f}",
+            f"{result['model_size_mb']:.1f}",
+        ]
+        for result in results
+    ]
+    widths = [max(len(str(value)) for value in column) for column in zip(columns, *rows)]
+    print()
+    for row in [columns, *rows]:
+        print("  ".join(f"{str(value):>{width}}" for value, width in zip(row, widths)))
+    with open(leaderboard_path, "w", encoding="utf-8") as file:
+        for row in [columns, *rows]:
+            file.write("\t".join(str(value) for value in row) + "\n")
+    print(f"\nLeaderboard written to {leaderboard_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyper-parameter sweep of a formula model")
+    parser.add_argument("--dataset", required=True, help="NTCIR-12 MathTagArticles directory")
+    parser.add_argument("--queries", required=True, help="NTCIR-12 query directory")
+    parser.add_argument("--representation", choices=list(REPRESENTATIONS), default="SLT")
+    parser.add_argument("--base-config", default=None, help="Configuration the grid is applied to (default: the one of the representation)")
+    parser.add_argument(
+        "--grid",
+        default=None,
+        help='JSON object (or file) of parameter and list of values, e.g. {"max": [4, 5, 6]}',
+    )
+    parser.add_argument("--configs", nargs="+", default=None, help="Configuration files, instead of a grid")
+    parser.add_argument("--judge", default=JUDGE_FILE_PATH)
+    parser.add_argument("--sweep-dir", default=None, help=f"Default: {SWEEP_DIR}/<representation>")
+    parser.add_argument("--trial-workers", type=int, default=TRIAL_WORKERS, help="FastText threads per trial")
+    parser.add_argument("--max-parallel", type=int, default=None, help="Upper bound of concurrent trials")
+    parser.add_argument(
+        "--trial-memory-mb", type=float, default=None, help="Peak memory of a trial (default: estimated)"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep-models", action="store_true", help="Keep the trained models in the sweep directory")
+    args = parser.parse_args()
+
+    representation = args.representation
+    sweep_dir = args.sweep_dir or os.path.join(SWEEP_DIR, representation.lower())
+    trial_dir = os.path.join(sweep_dir, "trials")
+    model_dir = os.path.join(sweep_dir, "models")
+    os.makedirs(trial_dir, exist_ok=True)
+
+    if args.configs:
+        configurations = [Configuration(path) for path in args.configs]
+    else:
+        base_config = Configuration(args.base_config or f"Configuration/config/config_{CONFIG_IDS[representation]}")
+        grid = {}
+        if args.grid:
+            if os.path.exists(args.grid):
+                with open(args.grid, encoding="utf-8") as file:
+                    grid = json.load(file)
+            else:
+                grid = json.loads(args.grid)
+        configurations = grid_configurations(grid, base_config)
+
+    trials = {}
+    for config in configurations:
+        key, parameters = trial_key(representation, config, args.seed)
+        trials.setdefault(key, (config, parameters))
+    finished = {key: load_trial(trial_dir, key) for key in trials}
+    pending = [key for key in trials if finished[key] is None]
+    print(f"{len(trials)} trials, {len(trials) - len(pending)} already finished")
+
+    if pending:
+        corpus_file, encoded_file, meta = prepare_shared(args, os.path.join(sweep_dir, "shared"))
+        trial_mb = args.trial_memory_mb or max(
+            estimate_trial_mb(trials[key][0], meta, encoded_file) for key in pending
+        )
+        processes = min(
+            len(pending),
+            max(1, (os.cpu_count() or 1) // args.trial_workers),
+            max(1, int(available_memory_mb() // trial_mb)),
+            args.max_parallel or len(pending),
+        )
+        print(
+            f"Running {len(pending)} trials, {processes} at a time with {args.trial_workers} threads each "
+            f"(~{trial_mb:.0f} MB per trial)"
+        )
+        context = multiprocessing.get_context("spawn")
+        failed = 0
+        with ProcessPoolExecutor(
+            processes,
+            mp_context=context,
+            initializer=init_trial_worker,
+            initargs=(encoded_file, args.judge),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    run_trial,
+                    key,
+                    trials[key][1],
+                    dict(trials[key][0].__dict__),
+                    corpus_file,
+                    trial_dir,
+                    model_dir,
+                    args.trial_workers,
+                    args.seed,
+                    args.keep_models,
+                ): key
+                for key in pending
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failed += 1
+                    print(f"❌ Trial {key} failed: {error}")
+                    continue
+                finished[key] = result
+                print(
+                    f"✅ Trial {key}: bpref full {result['bpref_full']:.4f} partial {result['bpref_partial']:.4f}, "
+                    f"{result['train_seconds']:.1f}s, {result['model_size_mb']:.1f} MB "
+                    f"({sum(1 for value in finished.values() if value)}/{len(trials)})"
+                )
+        if failed:
+            print(f"{failed} trials failed; run the sweep again to retry them")
+
+    results = [result for result in finished.values() if result]
+    if results:
+        print_leaderboard(results, os.path.join(sweep_dir, "leaderboard.tsv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Trains the SLT, SLT_TYPE and OPT formula models on the NTCIR-12 collection in
+a single run, instead of the three separate runs of the README workflow
+(each one reading and parsing the whole collection again):
+
+1. parse: each document is read and parsed once into both its SLT and its
+   OPT trees, and the tuples are encoded and written to the three corpus
+   files in the same pass (nothing is kept in memory)
+2. train: the three models are trained concurrently, each in its own
+   process, from their corpus files (gensim corpus_file mode)
+
+Wall-clock time and peak memory (max RSS) are reported per stage, and per
+model for the training stage. The per-epoch telemetry of each model (words/sec,
+elapsed time, ETA, RSS) is written to --telemetry-dir/{model}.jsonl.
+
+    python scripts/train_formula_models.py \\
+        --dataset /NTCIR12_MathIR_WikiCorpus_v2.1.0/MathTagArticles --parse-workers 4
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import services.tuple_store as tuple_store_module
+from Configuration.configuration import Configuration
+from DataReader.wiki_data_reader import WikiDataReader
+from lib.tangentCFT.corpus import REPRESENTATIONS, CorpusFileWriter
+from lib.tangentCFT.touple_encoder.encoder import EncoderManager
+
+CONFIG_PATHS = {
+    "SLT": "Configuration/config/config_1",
+    "OPT": "Configuration/config/config_2",
+    "SLT_TYPE": "Configuration/config/config_3",
+}
+CORPUS_DIR = "data/ntcir12/corpus"
+MODEL_DIR = "data/ntcir12/models"
+TELEMETRY_DIR = "data/ntcir12/telemetry"
+
+# Leitor de cada processo de parsing, criado por init_parse_worker
+_data_reader = None
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Max RSS (Linux: ru_maxrss em KB) do processo ou dos filhos já encerrados"""
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def init_parse_worker(dataset, tuple_store_path=None):
+    """All parsing processes share the same tuple store"""
+    global _data_reader
+    tuple_store_module.TUPLE_STORE_PATH = tuple_store_path
+    _data_reader = WikiDataReader(dataset)
+
+
+def parse_directory(directory_path):
+    return _data_reader.get_directory_slt_opt(directory_path)
+
+
+def write_corpora(dataset, corpus_files, parse_workers):
+    """
+    Parses the collection once and writes the corpus file of each
+    representation. Formulas are encoded in this process, in collection
+    order, so the encoder maps get the same ids with any number of workers.
+    """
+    encoder_manager = EncoderManager()
+    # Os mapas são gravados uma vez no fim, não a cada símbolo novo
+    encoder_manager.read_only = True
+    directories = WikiDataReader(dataset).get_collection_directories()
+    writers = {
+        representation: CorpusFileWriter(path)
+        for representation, path in corpus_files.items()
+    }
+    stats = {"documents_failed": 0, "formulas": 0}
+
+    def write_all(directory_results):
+        for counter, (formulas, failed) in enumerate(directory_results, 1):
+            stats["documents_failed"] += failed
+            for formula_id, slt_tuples, opt_tuples in formulas:
+                stats["formulas"] += 1
+                for representation, writer in writers.items():
+                    params = REPRESENTATIONS[representation]
+                    tuples = slt_tuples if params["read_slt"] else opt_tuples
+                    if tuples:
+                        writer.write(
+                            encoder_manager.encode_tuples(
+                                tuples,
+                                encoder_type=params["encoder_type"],
+                                embedding_type=params["embedding_type"],
+                                tokenize_numbers=params["tokenize_numbers"],
+                            )
+                        )
+            if counter % 10 == 0 or counter == len(directories):
+                print(
+                    f"Parsed {counter} of {len(directories)} directories, "
+                    f"{stats['formulas']} formulas"
+                )
+
+    try:
+        if parse_workers > 1:
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(
+                parse_workers,
+                initializer=init_parse_worker,
+                initargs=(dataset, tuple_store_module.TUPLE_STORE_PATH),
+            ) as pool:
+                write_all(pool.imap(parse_directory, directories))
+        else:
+            init_parse_worker(dataset, tuple_store_module.TUPLE_STORE_PATH)
+            write_all(map(parse_directory, directories))
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+
+    for writer in writers.values():
+        writer.close()
+        writer.report()
+    encoder_manager.read_only = False
+    for representation in writers:
+        encoder_manager.save_encoder_map(REPRESENTATIONS[representation]["encoder_type"])
+    print(
+        f"{stats['formulas']} formulas, {stats['documents_failed']} documents "
+        f"could not be read or parsed"
+    )
+    if parse_workers == 1 and tuple_store_module.get_tuple_store() is not None:
+        tuple_store_module.get_tuple_store().report()
+
+
+def train_representation(representation, config_path, corpus_file, model_path, workers, telemetry_path=None):
+    """Trains and saves one model (runs in its own process)"""
+    from lib.tangentCFT.model import TangentCftModel, TrainingTelemetryCallback
+
+    start_time = time.perf_counter()
+    config = Configuration(config_path)
+    if workers:
+        config.workers = workers
+    if telemetry_path and os.path.exists(telemetry_path):
+        os.remove(telemetry_path)
+    telemetry = TrainingTelemetryCallback(telemetry_path, run_id=representation)
+    model = TangentCftModel()
+    train_time = model.train(config, corpus_file=corpus_file, telemetry=telemetry)
+    model.save_model(model_path)
+    return {
+        "representation": representation,
+        "workers": config.get_workers(corpus_file=True),
+        "train_seconds": train_time.total_seconds(),
+        "seconds": time.perf_counter() - start_time,
+        "peak_rss_mb": peak_rss_mb(),
+        "vocabulary": len(model.model.wv.key_to_index),
+        "words_per_sec": telemetry.summary().get("words_per_sec"),
+    }
+
+
+def train_models(representations, config_paths, corpus_files, model_paths, workers, telemetry_paths):
+    """Trains the models concurrently, one process each"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(representations), mp_context=context) as executor:
+        futures = [
+            executor.submit(
+                train_representation,
+                representation,
+                config_paths[representation],
+                corpus_files[representation],
+                model_paths[representation],
+                workers,
+                telemetry_paths[representation],
+            )
+            for representation in representations
+        ]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train the SLT, SLT_TYPE and OPT models from one parse of the collection"
+    )
+    parser.add_argument("--dataset", required=True, help="NTCIR-12 MathTagArticles directory")
+    parser.add_argument(
+        "--representations", nargs="+", choices=list(REPRESENTATIONS), default=list(REPRESENTATIONS)
+    )
+    parser.add_argument("--slt-config", default=CONFIG_PATHS["SLT"])
+    parser.add_argument("--opt-config", default=CONFIG_PATHS["OPT"])
+    parser.add_argument("--slt-type-config", default=CONFIG_PATHS["SLT_TYPE"])
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--telemetry-dir", default=TELEMETRY_DIR, help="Per-epoch training telemetry (JSONL)")
+    parser.add_argument(
+        "--parse-workers", type=int, default=1, help="Parsing processes (1 parses in this process)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Threads per model (default: the workers of the configuration, "
+        "or the cores split between the models)",
+    )
+    parser.add_argument(
+        "--reuse-corpus",
+        action="store_true",
+        help="Skip the parse stage if all the corpus files already exist",
+    )
+    parser.add_argument(
+        "--tuple-store",
+        default=tuple_store_module.TUPLE_STORE_PATH
+        or tuple_store_module.DEFAULT_TUPLE_STORE_PATH,
+        help="sqlite file of the parsed formula tuples (empty to disable)",
+    )
+    args = parser.parse_args()
+
+    tuple_store_module.TUPLE_STORE_PATH = args.tuple_store or None
+    representations = args.representations
+    config_paths = {
+        "SLT": args.slt_config,
+        "OPT": args.opt_config,
+        "SLT_TYPE": args.slt_type_config,
+    }
+    corpus_files = {
+        representation: os.path.join(args.corpus_dir, f"{representation.lower()}.txt")
+        for representation in representations
+    }
+    model_paths = {
+        representation: os.path.join(args.model_dir, f"{representation.lower()}_model")
+        for representation in representations
+    }
+    telemetry_paths = {
+        representation: os.path.join(args.telemetry_dir, f"{representation.lower()}.jsonl")
+        for representation in representations
+    }
+    os.makedirs(args.model_dir, exist_ok=True)
+
+    # Sem workers na configuração, os cores são divididos entre os modelos
+    workers = args.workers
+    if workers is None and any(
+        Configuration(config_paths[representation]).workers in (None, "None")
+        for representation in representations
+    ):
+        workers = max(1, (os.cpu_count() or 1) // len(representations))
+
+    stages = []
+    total_start = time.perf_counter()
+    if args.reuse_corpus and all(os.path.exists(path) for path in corpus_files.values()):
+        print("Reusing the corpus files in " + args.corpus_dir)
+    else:
+        start_time = time.perf_counter()
+        write_corpora(args.dataset, corpus_files, args.parse_workers)
+        stages.append(
+            (
+                "parse + write corpora",
+                time.perf_counter() - start_time,
+                max(peak_rss_mb(), peak_rss_mb(resource.RUSAGE_CHILDREN)),
+            )
+        )
+
+    start_time = time.perf_counter()
+    # O pico do treino é a soma dos picos dos processos (limite superior, eles rodam juntos)
+    results = train_models(
+        representations, config_paths, corpus_files, model_paths, workers, telemetry_paths
+    )
+    stages.append(
+        (
+            "train (concurrent)",
+            time.perf_counter() - start_time,
+            sum(result["peak_rss_mb"] for result in results),
+        )
+    )
+
+    print(f"\n{'stage':<24} {'wall (s)':>10} {'peak RSS (MB)':>14}")
+    for name, seconds, rss in stages:
+        print(f"{name:<24} {seconds:>10.1f} {rss:>14.0f}")
+    print(f"{'total':<24} {time.perf_counter() - total_start:>10.1f}")
+
+    print(
+        f"\n{'model':<10} {'workers':>7} {'train (s)':>10} {'words/sec':>10} "
+        f"{'peak RSS (MB)':>14} {'vocabulary':>11}"
+    )
+    for result in results:
+        print(
+            f"{result['representation']:<10} {result['workers']:>7} {result['train_seconds']:>10.1f} "
+            f"{result['words_per_sec'] or 0:>10.0f} {result['peak_rss_mb']:>14.0f} {result['vocabulary']:>11}"
+        )
+    for representation in representations:
+        print(f"✅ {representation} model saved to {model_paths[representation]}")
+    print(f"Training telemetry written to {args.telemetry_dir}")
+
+
+if __name__ == "__main__":
+    main()
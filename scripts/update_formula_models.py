@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Incremental update of the formula models (SLT, SLT_TYPE and OPT) with newly
+ingested formulas, instead of accepting OOV-heavy tuple vectors or
+retraining every model from scratch:
+
+1. the new formulas (ARQMath SLT and OPT TSV files) are parsed, encoded and
+   written to one corpus file per model
+2. each model gets its vocabulary extended with the new tuples and a few
+   epochs over the new formulas only (TangentCftModel.update). The models
+   are saved in place, and their inference artifact and tuple-vector table,
+   if any, are rebuilt
+3. only the input vectors of the new tuples and their n-gram buckets change,
+   so only the formulas of the formulas index with a new tuple, a tuple
+   whose vector drifted more than --drift-threshold (cosine distance), or an
+   OOV tuple composed from a trained n-gram are re-embedded
+4. the drift of the untouched formulas is measured on a sample: their
+   stored vectors against the vectors of the updated models
+
+The update time of each model is reported; with --full-corpus-dir (the
+corpus files of scripts/train_formula_models.py) each model is also
+retrained from scratch on the full corpus plus the new formulas, for the
+comparison.
+
+    python scripts/update_formula_models.py --slt-dir data/arqmath/new_slt --opt-dir data/arqmath/new_opt
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import random
+import shutil
+import time
+
+import numpy
+from gensim.models.fasttext import ft_ngram_hashes
+
+import services.model_manager as model_manager_module
+import services.tuple_store as tuple_store_module
+from Configuration.configuration import Configuration
+from app.modules.embedding.use_cases.get_slt_opt_and_type_combined_formula_vector_use_case import (
+    make_get_slt_opt_and_type_combined_formula_vector_use_case,
+)
+from app.modules.embedding.use_cases.parse_formula_to_tuples import (
+    make_parse_formula_to_tuples_use_case,
+)
+from lib.tangentCFT.corpus import REPRESENTATIONS, CorpusFileWriter
+from lib.tangentCFT.model import INCREMENTAL_EPOCHS, CompactFastTextVectors, TangentCftModel
+from lib.tangentCFT.touple_encoder.encoder import EncoderManager
+from lib.tangentCFT.tuple_vector_table import TupleVectorTable
+from scripts.build_tuple_vector_tables import iter_formulas
+from scripts.train_formula_models import CONFIG_PATHS
+from services.elasticsearch_service import ElasticsearchService
+from services.model_manager import MODEL_PATHS, model_manager
+
+CORPUS_DIR = "data/arqmath/update_corpus"
+PARSE_BATCH_SIZE = 10000
+SCAN_BATCH_SIZE = 1000
+# Distância de cosseno de um vetor de tupla acima da qual as fórmulas com a tupla são re-embedadas
+DRIFT_THRESHOLD = 0.01
+DRIFT_SAMPLE_SIZE = 2000
+
+VECTOR_FIELDS = {
+    "SLT": "slt_vector",
+    "SLT_TYPE": "slt_type_vector",
+    "OPT": "opt_vector",
+    "combined": "formula_vector",
+}
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode(encoder_manager, tuples, representation):
+    params = REPRESENTATIONS[representation]
+    return encoder_manager.encode_tuples(
+        tuples,
+        encoder_type=params["encoder_type"],
+        embedding_type=params["embedding_type"],
+        tokenize_numbers=params["tokenize_numbers"],
+    )
+
+
+def write_new_corpora(slt_dir, opt_dir, corpus_files):
+    """
+    Parses the new formulas and writes the corpus file of each model.
+    :return: the distinct new encoded tuples of each model
+    """
+    parse_formula_to_tuples_use_case = make_parse_formula_to_tuples_use_case()
+    encoder_manager = EncoderManager()
+    # Os mapas são gravados uma vez no fim, não a cada símbolo novo
+    encoder_manager.read_only = True
+    new_tuples = {representation: set() for representation in corpus_files}
+
+    for directory, read_slt in ((slt_dir, True), (opt_dir, False)):
+        representations = [
+            representation
+            for representation in corpus_files
+            if REPRESENTATIONS[representation]["read_slt"] == read_slt
+        ]
+        writers = {
+            representation: CorpusFileWriter(corpus_files[representation])
+            for representation in representations
+        }
+        try:
+            for batch in batched(iter_formulas(directory), PARSE_BATCH_SIZE):
+                for _, tuples in parse_formula_to_tuples_use_case.execute_many_with_key(
+                    batch, operator=not read_slt
+                ):
+                    if not tuples:
+                        continue
+                    for representation, writer in writers.items():
+                        encoded_tuples = encode(encoder_manager, tuples, representation)
+                        writer.write(encoded_tuples)
+                        new_tuples[representation].update(encoded_tuples)
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+        for writer in writers.values():
+            writer.close()
+            writer.report()
+
+    encoder_manager.read_only = False
+    for representation in corpus_files:
+        encoder_manager.save_encoder_map(REPRESENTATIONS[representation]["encoder_type"])
+    return new_tuples
+
+
+class TupleDrift:
+    """
+    Which tuple vectors of a model an incremental update changes. Incremental
+    training only changes the input vectors of the trained tuples and their
+    n-gram buckets, so the vectors of the vocabulary keys sharing a bucket
+    with a new tuple are kept before the update and compared after it.
+    """
+
+    def __init__(self, model, new_tuples, threshold=DRIFT_THRESHOLD):
+        self.model = model
+        self.threshold = threshold
+        wv = model.model.wv
+        self.bucket_mask = model.touched_buckets(new_tuples)
+        self.old_vocabulary_size = len(wv.index_to_key)
+        touched = set(model.keys_using_buckets(self.bucket_mask))
+        touched.update(t for t in new_tuples if t in wv.key_to_index)
+        self.touched = list(touched)
+        self._rows = [wv.key_to_index[key] for key in self.touched]
+        self.old_vectors = wv.vectors[self._rows].copy()
+        self.distances = numpy.zeros(0, dtype=numpy.float32)
+        self.drifted = set()
+        self.new_keys = set()
+        self._oov_affected = {}
+
+    def measure(self):
+        """Compares the kept vectors with the updated model"""
+        wv = self.model.model.wv
+        new_vectors = wv.vectors[self._rows]
+        norms = numpy.linalg.norm(self.old_vectors, axis=1) * numpy.linalg.norm(new_vectors, axis=1)
+        norms[norms == 0] = 1.0
+        self.distances = 1.0 - (self.old_vectors * new_vectors).sum(axis=1) / norms
+        self.drifted = {
+            key for key, distance in zip(self.touched, self.distances) if distance > self.threshold
+        }
+        # build_vocab(update=True) appends the new keys to the vocabulary
+        self.new_keys = set(wv.index_to_key[self.old_vocabulary_size :])
+
+    def is_affected(self, encoded_tuple):
+        if encoded_tuple in self.drifted or encoded_tuple in self.new_keys:
+            return True
+        wv = self.model.model.wv
+        if encoded_tuple in wv.key_to_index:
+            return False
+        # OOV: composed from its n-grams, changed if one of them was trained
+        affected = self._oov_affected.get(encoded_tuple)
+        if affected is None:
+            buckets = ft_ngram_hashes(encoded_tuple, wv.min_n, wv.max_n, wv.bucket)
+            affected = bool(buckets) and bool(self.bucket_mask[buckets].any())
+            self._oov_affected[encoded_tuple] = affected
+        return affected
+
+    def report(self, representation):
+        distances = self.distances
+        print(
+            f"{representation}: {len(self.new_keys)} new tuples in the vocabulary, "
+            f"{len(self.touched)} touched, {len(self.drifted)} drifted > {self.threshold}"
+            + (
+                f" (mean {distances.mean():.4f}, p95 {numpy.percentile(distances, 95):.4f}, "
+                f"max {distances.max():.4f})"
+                if len(distances)
+                else ""
+            )
+        )
+
+
+def save_updated_model(model, model_path, new_tuples):
+    """Saves the model and rebuilds the serving artifacts that existed for it"""
+    model.save_model(model_path)
+    if CompactFastTextVectors.exists(model_path):
+        float16 = (
+            numpy.load(model_path + CompactFastTextVectors.VECTORS_SUFFIX, mmap_mode="r").dtype
+            == numpy.float16
+        )
+        model.export_inference_model(model_path, float16=float16)
+        print(f"Inference artifact of {model_path} exported again")
+    if os.path.exists(model_path + TupleVectorTable.VECTORS_SUFFIX):
+        old_table = TupleVectorTable.load(model_path, mmap_mode="r")
+        table = TupleVectorTable.build(
+            model, [*old_table.tuple_index, *model.model.wv.index_to_key, *new_tuples]
+        )
+        table.save(model_path)
+        print(f"Tuple-vector table of {model_path} rebuilt ({len(table)} tuples)")
+
+
+def reembed_affected(elastic_service, drifts, sample_size):
+    """
+    Re-embeds the formulas of the index with an affected tuple and keeps a
+    sample of the untouched ones.
+    :return: (stats, sample of untouched formulas as (formula_id, slt_tuples, opt_tuples))
+    """
+    parse_formula_to_tuples_use_case = make_parse_formula_to_tuples_use_case()
+    combined_vector_use_case = make_get_slt_opt_and_type_combined_formula_vector_use_case()
+    encoder_manager = EncoderManager()
+    stats = {"scanned": 0, "affected": 0, "updated": 0, "unparsed": 0}
+    sample = []
+    random_generator = random.Random(0)
+    untouched = 0
+
+    with elastic_service.bulk_writer() as writer:
+        for batch in batched(elastic_service.iter_formulas(), SCAN_BATCH_SIZE):
+            slt_parsed = parse_formula_to_tuples_use_case.execute_many_with_key(
+                [formula.get("slt_text") or "" for formula in batch], operator=False
+            )
+            opt_parsed = parse_formula_to_tuples_use_case.execute_many_with_key(
+                [formula.get("opt_text") or "" for formula in batch], operator=True
+            )
+            affected = []
+            for formula, (_, slt_tuples), (_, opt_tuples) in zip(batch, slt_parsed, opt_parsed):
+                stats["scanned"] += 1
+                if not slt_tuples:
+                    stats["unparsed"] += 1
+                    continue
+                tuples_of = {True: slt_tuples, False: opt_tuples or []}
+                if any(
+                    drift.is_affected(encoded_tuple)
+                    for representation, drift in drifts.items()
+                    for encoded_tuple in encode(
+                        encoder_manager,
+                        tuples_of[REPRESENTATIONS[representation]["read_slt"]],
+                        representation,
+                    )
+                ):
+                    affected.append((formula["formula_id"], slt_tuples, opt_tuples))
+                    continue
+                # Amostragem reservatório das fórmulas não afetadas
+                untouched += 1
+                if len(sample) < sample_size:
+                    sample.append((formula["formula_id"], slt_tuples, opt_tuples))
+                else:
+                    position = random_generator.randrange(untouched)
+                    if position < sample_size:
+                        sample[position] = (formula["formula_id"], slt_tuples, opt_tuples)
+
+            stats["affected"] += len(affected)
+            if not affected:
+                continue
+            vectors_batch = combined_vector_use_case.embed_tuples(
+                [slt_tuples for _, slt_tuples, _ in affected],
+                [opt_tuples for _, _, opt_tuples in affected],
+            )
+            updates = []
+            for (formula_id, _, _), formula_vectors in zip(affected, vectors_batch):
+                update = {"formula_id": formula_id}
+                update.update(
+                    (field, vector) for field, vector in formula_vectors.items() if vector is not None
+                )
+                if len(update) > 1:
+                    updates.append(update)
+            stats["updated"] += len(updates)
+            writer.write(elastic_service.update_formula_actions(updates))
+            if stats["scanned"] % (SCAN_BATCH_SIZE * 50) == 0:
+                print(f"Scanned {stats['scanned']} formulas, {stats['affected']} affected")
+    writer.report("Formula re-embedding")
+    return stats, sample
+
+
+def untouched_drift(elastic_service, sample):
+    """Cosine distance between the stored vectors of the sampled formulas and the vectors of the updated models"""
+    combined_vector_use_case = make_get_slt_opt_and_type_combined_formula_vector_use_case()
+    distances = {field: [] for field in VECTOR_FIELDS.values()}
+    for batch in batched(sample, 500):
+        vectors_batch = combined_vector_use_case.embed_tuples(
+            [slt_tuples for _, slt_tuples, _ in batch],
+            [opt_tuples for _, _, opt_tuples in batch],
+        )
+        stored = elastic_service.get_formulas(
+            [formula_id for formula_id, _, _ in batch], VECTOR_FIELDS.values()
+        )
+        for (formula_id, _, _), formula_vectors in zip(batch, vectors_batch):
+            for field in VECTOR_FIELDS.values():
+                old = stored.get(formula_id, {}).get(field)
+                new = formula_vectors.get(field)
+                if old is None or new is None:
+                    continue
+                old = numpy.asarray(old, dtype=numpy.float32)
+                norm = numpy.linalg.norm(old) * numpy.linalg.norm(new)
+                if norm:
+                    distances[field].append(1.0 - float(old @ new) / norm)
+    return distances
+
+
+def full_retrain_seconds(representation, config_path, full_corpus_file, new_corpus_file, workers):
+    """Train time of a model trained from scratch on the full corpus plus the new formulas"""
+    combined_corpus_file = new_corpus_file + ".full.txt"
+    with open(combined_corpus_file, "wb") as output:
+        for path in (full_corpus_file, new_corpus_file):
+            with open(path, "rb") as corpus:
+                shutil.copyfileobj(corpus, output)
+    try:
+        config = Configuration(config_path)
+        if workers:
+            config.workers = workers
+        return TangentCftModel().train(config, corpus_file=combined_corpus_file).total_seconds()
+    finally:
+        os.remove(combined_corpus_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incremental update of the formula models and re-embedding of the affected formulas"
+    )
+    parser.add_argument("--slt-dir", required=True, help="SLT TSV files of the new formulas")
+    parser.add_argument("--opt-dir", required=True, help="OPT TSV files of the new formulas")
+    parser.add_argument(
+        "--representations", nargs="+", choices=list(REPRESENTATIONS), default=list(REPRESENTATIONS)
+    )
+    parser.add_argument("--epochs", type=int, default=INCREMENTAL_EPOCHS)
+    parser.add_argument("--workers", type=int, default=None, help="Threads (default: all cores)")
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    parser.add_argument("--drift-threshold", type=float, default=DRIFT_THRESHOLD)
+    parser.add_argument("--drift-sample", type=int, default=DRIFT_SAMPLE_SIZE)
+    parser.add_argument("--skip-reembed", action="store_true", help="Only update the models")
+    parser.add_argument(
+        "--full-corpus-dir",
+        default=None,
+        help="Corpus files of the full collection, to time a full retrain for comparison",
+    )
+    parser.add_argument(
+        "--tuple-store",
+        default=tuple_store_module.TUPLE_STORE_PATH
+        or tuple_store_module.DEFAULT_TUPLE_STORE_PATH,
+        help="sqlite file of the parsed formula tuples (empty to disable)",
+    )
+    args = parser.parse_args()
+
+    tuple_store_module.TUPLE_STORE_PATH = args.tuple_store or None
+    # O update precisa do FastText completo, carregado sem mmap
+    model_manager_module.CFT_MODEL_FORMAT = "full"
+    model_manager_module.CFT_MODEL_MMAP = False
+    if not args.skip_reembed:
+        # Os vetores re-calculados são do modelo completo: o índice precisa ter sido gerado com ele
+        elastic_service = ElasticsearchService()
+        model_manager_module.check_formulas_index_format(elastic_service)
+    workers = args.workers or os.cpu_count()
+    representations = args.representations
+    corpus_files = {
+        representation: os.path.join(args.corpus_dir, f"{representation.lower()}.txt")
+        for representation in representations
+    }
+
+    start_time = time.perf_counter()
+    new_tuples = write_new_corpora(args.slt_dir, args.opt_dir, corpus_files)
+    print(f"New formulas parsed and encoded in {time.perf_counter() - start_time:.1f}s")
+
+    update_seconds = {}
+    drifts = {}
+    for representation in representations:
+        model = model_manager.get_model(representation).model
+        drift = TupleDrift(model, new_tuples[representation], args.drift_threshold)
+        update_seconds[representation] = model.update(
+            corpus_file=corpus_files[representation], epochs=args.epochs, workers=workers
+        ).total_seconds()
+        drift.measure()
+        drift.report(representation)
+        drifts[representation] = drift
+        save_updated_model(model, MODEL_PATHS[representation], new_tuples[representation])
+        print(f"✅ {representation} model updated in {update_seconds[representation]:.1f}s")
+
+    if not args.skip_reembed:
+        start_time = time.perf_counter()
+        stats, sample = reembed_affected(elastic_service, drifts, args.drift_sample)
+        print(
+            f"Re-embedding done in {time.perf_counter() - start_time:.1f}s: "
+            f"{stats['affected']} of {stats['scanned']} formulas affected, {stats['updated']} updated, "
+            f"{stats['unparsed']} without SLT tuples"
+        )
+        print(f"\nDrift of {len(sample)} untouched formulas (stored vs updated models, cosine distance):")
+        for field, distances in untouched_drift(elastic_service, sample).items():
+            if distances:
+                print(
+                    f"  {field:<16} mean {numpy.mean(distances):.5f}, "
+                    f"p95 {numpy.percentile(distances, 95):.5f}, max {numpy.max(distances):.5f}"
+                )
+
+    print(f"\n{'model':<10} {'update (s)':>11} {'full retrain (s)':>17} {'speedup':>8}")
+    for representation in representations:
+        full_seconds = None
+        if args.full_corpus_dir:
+            full_seconds = full_retrain_seconds(
+                representation,
+                CONFIG_PATHS[representation],
+                os.path.join(args.full_corpus_dir, f"{representation.lower()}.txt"),
+                corpus_files[representation],
+                workers,
+            )
+        print(
+            f"{representation:<10} {update_seconds[representation]:>11.1f} "
+            + (
+                f"{full_seconds:>17.1f} {full_seconds / update_seconds[representation]:>7.1f}x"
+                if full_seconds is not None
+                else f"{'-':>17} {'-':>8}"
+            )
+        )
+    # O cache persistente de vetores de consulta é descartado no reinício (a impressão digital dos modelos mudou)
+    print("⚠️ Restart the API so the updated models and encoder maps are used")
+
+
+if __name__ == "__main__":
+    main()
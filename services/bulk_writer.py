@@ -0,0 +1,300 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from elasticsearch import ApiError
+from elasticsearch import ConnectionError as TransportConnectionError
+from elasticsearch import ConnectionTimeout, Elasticsearch
+from elasticsearch.helpers import expand_action
+
+from services.es_serializer import drop_non_finite_vectors
+
+# Configuração padrão do writer, ajustável por variáveis de ambiente
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_CHUNK_BYTES = int(os.environ.get("BULK_MAX_CHUNK_BYTES", str(10 * 1024 * 1024)))
+BULK_MAX_IN_FLIGHT = int(os.environ.get("BULK_MAX_IN_FLIGHT", "2"))
+BULK_MAX_RETRIES = int(os.environ.get("BULK_MAX_RETRIES", "5"))
+BULK_REQUEST_TIMEOUT = float(os.environ.get("BULK_REQUEST_TIMEOUT", "120"))
+
+# Mostra no máximo este número de erros de documentos rejeitados
+MAX_LOGGED_ERRORS = 5
+
+# Status HTTP de sobrecarga passageira do cluster, reenviados com backoff
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+
+class BulkWriter:
+    """
+    Writer de bulk em streaming para o Elasticsearch.
+
+    Recebe as ações (no formato do elasticsearch.helpers) uma a uma, agrupa
+    em requisições limitadas por número de documentos e por tamanho em bytes
+    e envia com no máximo `max_in_flight` requisições em andamento: quando
+    esse limite é atingido, quem está escrevendo espera (backpressure).
+
+    Requisições rejeitadas com 429, 502, 503 ou 504, documentos rejeitados
+    com 429, timeouts e erros de conexão são reenviados com backoff
+    exponencial. Nenhuma requisição pede refresh;
+    os índices em `refresh_indices` recebem um único refresh em close().
+
+        with elastic_service.bulk_writer(refresh_indices=[index]) as writer:
+            writer.write(actions)
+
+    Para jobs retomáveis, mark(offset) associa uma posição da entrada às
+    ações adicionadas até ali; `on_commit(offset)` é chamado quando todas
+    essas ações foram confirmadas pelo Elasticsearch, na ordem da entrada.
+    Uma requisição que falhou de vez, ou com algum documento rejeitado de vez
+    (erro que não é 429), trava os commits seguintes: o offset confirmado
+    para antes dela e uma retomada envia esses documentos de novo.
+    """
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        chunk_size: int = BULK_CHUNK_SIZE,
+        max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+        max_in_flight: int = BULK_MAX_IN_FLIGHT,
+        max_retries: int = BULK_MAX_RETRIES,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        request_timeout: float = BULK_REQUEST_TIMEOUT,
+        refresh_indices: Optional[List[str]] = None,
+        on_commit: Optional[Callable[[Any], None]] = None,
+    ):
+        self.es = es
+        # As novas tentativas são feitas aqui, com backoff, e não pelo transport
+        self._client = es.options(
+            request_timeout=request_timeout, max_retries=0, retry_on_timeout=False
+        )
+        self._serializer = es.transport.serializers.get_serializer("application/json")
+
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.refresh_indices = refresh_indices or []
+
+        self._buffer: List[List[bytes]] = []
+        self._buffer_bytes = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.on_commit = on_commit
+        self.committed_offset = None
+        self._offset = None
+        self._sequence = 0
+        # Requisições na ordem de envio: sequência -> [offset, estado], onde o
+        # estado é None (em andamento), True (confirmada) ou False (falhou)
+        self._chunks: "OrderedDict[int, list]" = OrderedDict()
+
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.stats = {
+            "docs": 0,
+            "succeeded": 0,
+            "rejected": 0,
+            "failed": 0,
+            "retries": 0,
+            "requests": 0,
+            "bytes": 0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Em caso de erro, envia o que já estava no buffer, mas não faz refresh
+        self.close(refresh=exc_type is None)
+        return False
+
+    def add(self, action: Dict[str, Any]):
+        """Adiciona uma ação ao buffer, enviando o buffer quando ele enche"""
+        operation, data = expand_action(action)
+        # O id da operação identifica o documento se um vetor inválido for descartado
+        data = drop_non_finite_vectors(data, next(iter(operation.values())).get("_id"))
+        lines = [self._serializer.dumps(operation)]
+        if data is not None:
+            lines.append(self._serializer.dumps(data))
+        size = sum(len(line) + 1 for line in lines)
+
+        if self._buffer and (
+            len(self._buffer) >= self.chunk_size
+            or self._buffer_bytes + size > self.max_chunk_bytes
+        ):
+            self.flush()
+
+        self._buffer.append(lines)
+        self._buffer_bytes += size
+
+    def write(self, actions: Iterable[Dict[str, Any]]) -> "BulkWriter":
+        """Consome um iterável (ou gerador) de ações"""
+        for action in actions:
+            self.add(action)
+        return self
+
+    def mark(self, offset: Any):
+        """
+        Marca que as ações adicionadas até agora cobrem a entrada até
+        `offset`; on_commit(offset) é chamado quando elas forem confirmadas
+        """
+        if self._buffer:
+            self._offset = offset
+        else:
+            self._track(offset, done=True)
+
+    def flush(self):
+        """Envia o buffer atual, esperando se já houver requisições demais em andamento"""
+        if not self._buffer:
+            return
+        chunk, chunk_bytes = self._buffer, self._buffer_bytes
+        self._buffer, self._buffer_bytes = [], 0
+        sequence = self._track(self._offset)
+        self._offset = None
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._send, chunk, chunk_bytes)
+        except Exception:
+            self._slots.release()
+            raise
+
+        def done(future):
+            self._slots.release()
+            error = future.exception()
+            if error is not None:
+                # Erro inesperado (ex.: serialização, resposta malformada): a requisição falhou
+                print(f"Error sending bulk request of {len(chunk)} docs: {error!r}")
+                self._count(failed=len(chunk))
+            self._complete(sequence, error is None and future.result())
+
+        future.add_done_callback(done)
+
+    def close(self, refresh: bool = True):
+        """Envia o restante, espera as requisições em andamento e faz o refresh final"""
+        if self._closed:
+            return
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._closed = True
+        self.end_time = time.perf_counter()
+
+        if refresh and self.refresh_indices:
+            try:
+                self.es.indices.refresh(index=",".join(self.refresh_indices))
+            except Exception as e:
+                print(f"Error refreshing {self.refresh_indices}: {str(e)}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        stats["elapsed_s"] = elapsed
+        stats["docs_per_sec"] = stats["succeeded"] / elapsed if elapsed else 0.0
+        return stats
+
+    def report(self, name: str = "Bulk"):
+        stats = self.get_stats()
+        print(
+            f"📊 {name}: {stats['succeeded']}/{stats['docs']} docs written in "
+            f"{stats['elapsed_s']:.1f}s ({stats['docs_per_sec']:.1f} docs/sec), "
+            f"{stats['rejected']} rejected, {stats['failed']} failed, "
+            f"{stats['retries']} retries, {stats['requests']} requests, "
+            f"{stats['bytes'] / 1024 / 1024:.1f} MB"
+        )
+
+    def _count(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def _track(self, offset, done=None) -> int:
+        with self._lock:
+            sequence = self._sequence
+            self._sequence += 1
+            self._chunks[sequence] = [offset, done]
+        if done is not None:
+            self._complete(sequence, done)
+        return sequence
+
+    def _complete(self, sequence: int, ok: bool):
+        """Avança o offset confirmado até a primeira requisição pendente ou que falhou"""
+        with self._lock:
+            self._chunks[sequence][1] = ok
+            while self._chunks:
+                sequence, (offset, state) = next(iter(self._chunks.items()))
+                if state is not True:
+                    return
+                del self._chunks[sequence]
+                if offset is None:
+                    continue
+                self.committed_offset = offset
+                if self.on_commit is not None:
+                    try:
+                        self.on_commit(offset)
+                    except Exception as e:
+                        print(f"Error committing offset {offset}: {str(e)}")
+
+    def _backoff(self, attempt: int):
+        time.sleep(min(self.initial_backoff * 2**attempt, self.max_backoff))
+
+    def _send(self, chunk: List[List[bytes]], chunk_bytes: int) -> bool:
+        """Envia uma requisição; retorna False se documentos dela não foram gravados"""
+        self._count(docs=len(chunk))
+        attempt = 0
+        rejected = 0
+        while chunk:
+            self._count(requests=1, bytes=chunk_bytes)
+            try:
+                response = self._client.bulk(
+                    operations=[line for lines in chunk for line in lines],
+                    refresh=False,
+                )
+            except (ApiError, ConnectionTimeout, TransportConnectionError) as e:
+                retryable = not isinstance(e, ApiError) or e.meta.status in RETRYABLE_STATUSES
+                if retryable and attempt < self.max_retries:
+                    self._count(retries=len(chunk))
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                print(f"Error sending bulk request of {len(chunk)} docs: {str(e)}")
+                self._count(failed=len(chunk))
+                return False
+
+            to_retry = []
+            errors = []
+            for lines, item in zip(chunk, response["items"]):
+                result = next(iter(item.values()))
+                status = result.get("status", 500)
+                if status < 300:
+                    self._count(succeeded=1)
+                elif status == 429:
+                    to_retry.append(lines)
+                else:
+                    errors.append(result)
+            if errors:
+                rejected += len(errors)
+                self._count(rejected=len(errors))
+                for error in errors[:MAX_LOGGED_ERRORS]:
+                    print(f"Rejected doc {error.get('_id')}: {error.get('error')}")
+
+            if to_retry and attempt < self.max_retries:
+                self._count(retries=len(to_retry))
+                self._backoff(attempt)
+                attempt += 1
+                chunk = to_retry
+                chunk_bytes = sum(len(line) + 1 for lines in chunk for line in lines)
+                continue
+            if to_retry:
+                print(f"{len(to_retry)} docs still rejected with 429 after retries")
+                self._count(rejected=len(to_retry))
+                return False
+            if rejected:
+                print(f"{rejected} docs rejected, offsets from this request on are not committed")
+                return False
+            return True
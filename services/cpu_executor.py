@@ -0,0 +1,53 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# Número máximo de tarefas CPU-bound (parse, encode, embed) executando ao mesmo
+# tempo fora do event loop
+CPU_EXECUTOR_WORKERS = int(
+    os.environ.get("CPU_EXECUTOR_WORKERS", str(min(8, os.cpu_count() or 1)))
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Retorna o executor limitado compartilhado pelo processo"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=CPU_EXECUTOR_WORKERS, thread_name_prefix="cpu-bound"
+                )
+    return _executor
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """
+    Executa uma função síncrona no executor limitado, sem bloquear o event loop
+
+    Args:
+        func: Função a ser executada
+        *args, **kwargs: Argumentos repassados para a função
+
+    Returns:
+        O retorno da função
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_cpu_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def shutdown_cpu_executor():
+    """Finaliza o executor (chamado no shutdown da aplicação)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
@@ -1,34 +1,164 @@
-from elasticsearch import Elasticsearch
-import numpy as np
+import os
+import signal
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch
 import json
 
+from services.bulk_writer import BulkWriter
+from services.es_serializer import numpy_serializers
+
+# Connection settings, overridable through the environment
+ES_HOST = os.environ.get("ELASTICSEARCH_HOST", "localhost")
+ES_PORT = int(os.environ.get("ELASTICSEARCH_PORT", "9200"))
+ES_CONNECTIONS_PER_NODE = int(os.environ.get("ELASTICSEARCH_CONNECTIONS", "25"))
+ES_KEEP_ALIVE = os.environ.get("ELASTICSEARCH_KEEP_ALIVE", "1") != "0"
+ES_REQUEST_TIMEOUT = float(os.environ.get("ELASTICSEARCH_TIMEOUT", "60"))
+ES_SEARCH_TIMEOUT = float(os.environ.get("ELASTICSEARCH_SEARCH_TIMEOUT", "10"))
+ES_MAX_RETRIES = int(os.environ.get("ELASTICSEARCH_MAX_RETRIES", "3"))
+# Where bulk_load() keeps the original index settings until they are restored
+ES_BULK_LOAD_STATE_DIR = os.environ.get(
+    "ELASTICSEARCH_BULK_LOAD_STATE_DIR", ".es_bulk_load"
+)
+
+# Nested fields of the posts index holding one vector per formula
+NESTED_VECTOR_FIELDS = ("formula_vectors", "slt_vectors", "slt_type_vectors", "opt_vectors")
+# _meta key of the formulas index recording the model format (CFT_MODEL_FORMAT) of its vectors
+MODEL_FORMAT_META = "cft_model_format"
+
+_clients: Dict[Tuple, Elasticsearch] = {}
+_clients_lock = threading.Lock()
+
+
+def get_elasticsearch_client(
+    host=ES_HOST,
+    port=ES_PORT,
+    connections_per_node=ES_CONNECTIONS_PER_NODE,
+    keep_alive=ES_KEEP_ALIVE,
+    request_timeout=ES_REQUEST_TIMEOUT,
+    max_retries=ES_MAX_RETRIES,
+) -> Elasticsearch:
+    """
+    Return the process-wide client for the given node and pool settings.
+
+    Clients are created once and cached, so every caller shares the same
+    HTTP connection pool instead of opening a new one per instantiation.
+
+    Args:
+        host: Elasticsearch host
+        port: Elasticsearch port
+        connections_per_node: Size of the HTTP connection pool per node
+        keep_alive: Keep idle connections open between requests
+        request_timeout: Default timeout (seconds) for each request
+        max_retries: Retries on connection errors and timeouts
+    """
+    key = (host, port, connections_per_node, keep_alive, request_timeout, max_retries)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = Elasticsearch(
+                [f"http://{host}:{port}"],
+                connections_per_node=connections_per_node,
+                headers={"Connection": "keep-alive" if keep_alive else "close"},
+                request_timeout=request_timeout,
+                retry_on_timeout=True,
+                max_retries=max_retries,
+                # numpy arrays are written directly, no .tolist() needed
+                serializers=numpy_serializers(),
+            )
+        return _clients[key]
+
+
+_async_clients: Dict[Tuple, AsyncElasticsearch] = {}
+
+
+def get_async_elasticsearch_client(
+    host=ES_HOST,
+    port=ES_PORT,
+    connections_per_node=ES_CONNECTIONS_PER_NODE,
+    request_timeout=ES_REQUEST_TIMEOUT,
+    max_retries=ES_MAX_RETRIES,
+) -> AsyncElasticsearch:
+    """
+    Return the process-wide AsyncElasticsearch client for the given node.
+
+    The underlying aiohttp session is opened lazily on the first request,
+    inside the running event loop, so this is safe to call at import time.
+    """
+    key = (host, port, connections_per_node, request_timeout, max_retries)
+    with _clients_lock:
+        if key not in _async_clients:
+            _async_clients[key] = AsyncElasticsearch(
+                [f"http://{host}:{port}"],
+                connections_per_node=connections_per_node,
+                request_timeout=request_timeout,
+                retry_on_timeout=True,
+                max_retries=max_retries,
+                serializers=numpy_serializers(),
+            )
+        return _async_clients[key]
+
+
+async def close_async_elasticsearch_clients():
+    """Close the pooled async clients (call on application shutdown)."""
+    with _clients_lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.close()
+
+
+_service: Optional["ElasticsearchService"] = None
+_service_lock = threading.Lock()
+
+
+def get_elasticsearch_service() -> "ElasticsearchService":
+    """Return the shared ElasticsearchService used by the search use cases."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ElasticsearchService()
+    return _service
+
 
 class ElasticsearchService:
     def __init__(
         self,
-        host="localhost",
-        port=9200,
+        host=ES_HOST,
+        port=ES_PORT,
         posts_index_name="posts",
         formulas_index_name="formulas",
+        search_timeout=ES_SEARCH_TIMEOUT,
     ):
         """
         Initialize Elasticsearch service.
 
+        No admin calls are made here; call bootstrap_indices() once (at
+        startup or from the populate scripts) to create missing indices.
+
         Args:
             host: Elasticsearch host
             port: Elasticsearch port
-            index_name: Name of the index to use
+            posts_index_name: Name of the posts index
+            formulas_index_name: Name of the formulas index
+            search_timeout: Per-call timeout (seconds) used by search_client()
         """
-        self.es = Elasticsearch(
-            [f"http://{host}:{port}"],
-            timeout=60,  # Increase timeout to 60 seconds
-            retry_on_timeout=True,
-            max_retries=3,
-        )
+        self.host = host
+        self.port = port
+        self.es = get_elasticsearch_client(host, port)
         self.posts_index_name = posts_index_name
         self.formulas_index_name = formulas_index_name
+        self.search_timeout = search_timeout
 
-        # Create index if it doesn't exist
+    def bootstrap_indices(self):
+        """Create the posts and formulas indices if they don't exist yet."""
         if not self.posts_index_exists():
             print("Creating posts index")
             self.create_posts_index()
@@ -37,6 +167,80 @@ class ElasticsearchService:
             print("Creating formulas index")
             self.create_formulas_index()
 
+    def search_client(self, timeout=None):
+        """
+        Client bound to a per-call timeout. It shares the pooled connections
+        of self.es, so creating it is cheap.
+        """
+        return self.es.options(request_timeout=timeout or self.search_timeout)
+
+    def msearch(self, searches, timeout=None):
+        """
+        Run several searches in a single _msearch round trip.
+
+        Args:
+            searches: List of (index_name, search_body) tuples
+            timeout: Per-call timeout; defaults to search_timeout
+
+        Returns:
+            One search response per entry, in the same order as searches
+        """
+        if not searches:
+            return []
+        response = self.search_client(timeout).msearch(
+            searches=self._msearch_body(searches)
+        )
+        return self._demux_msearch(response)
+
+    async def msearch_async(self, searches, timeout=None):
+        """Async counterpart of msearch()."""
+        if not searches:
+            return []
+        response = await self.async_search_client(timeout).msearch(
+            searches=self._msearch_body(searches)
+        )
+        return self._demux_msearch(response)
+
+    @staticmethod
+    def _msearch_body(searches):
+        body = []
+        for index_name, search_body in searches:
+            body.append({"index": index_name})
+            body.append(search_body)
+        return body
+
+    @staticmethod
+    def _demux_msearch(response):
+        """
+        Split an _msearch response into one search response per search. A
+        failed search is logged and answered with empty hits, so it does not
+        fail the other searches of the batch (as a failed single search used
+        to return no results); a response without per-search results means
+        the whole request failed.
+        """
+        if "responses" not in response:
+            raise RuntimeError(f"The msearch request failed: {response}")
+        responses = response["responses"]
+        demuxed = []
+        for position, item in enumerate(responses):
+            if "error" in item:
+                print(f"⚠️ Search {position} of the msearch batch failed: {item['error']}")
+                item = {
+                    "error": item["error"],
+                    "hits": {"total": {"value": 0, "relation": "eq"}, "max_score": None, "hits": []},
+                }
+            demuxed.append(item)
+        return demuxed
+
+    @property
+    def async_es(self) -> AsyncElasticsearch:
+        """Pooled AsyncElasticsearch client for the same node."""
+        return get_async_elasticsearch_client(self.host, self.port)
+
+    def async_search_client(self, timeout=None):
+        """Async counterpart of search_client()."""
+        return self.async_es.options(request_timeout=timeout or self.search_timeout)
+
     def posts_index_exists(self):
         """Check if the posts index exists"""
         return self.es.indices.exists(index=self.posts_index_name)
@@ -45,6 +249,283 @@ class ElasticsearchService:
         """Check if the formulas index exists"""
         return self.es.indices.exists(index=self.formulas_index_name)
 
+    def count_formulas(self):
+        """Number of documents in the formulas index"""
+        return self.es.count(index=self.formulas_index_name)["count"]
+
+    def get_formulas_model_format(self):
+        """
+        Model format (full or inference) the formulas index was embedded with,
+        or None if the index does not exist. Indices created before the format
+        was recorded were embedded with the full models.
+        """
+        if not self.formulas_index_exists():
+            return None
+        mapping = self.es.indices.get_mapping(index=self.formulas_index_name)
+        # Keyed by the concrete index name, which differs if the name is an alias
+        index_mapping = next(iter(mapping.body.values()))
+        meta = index_mapping["mappings"].get("_meta", {})
+        return meta.get(MODEL_FORMAT_META, "full")
+
+    def set_formulas_model_format(self, model_format):
+        """Record in the formulas index mapping the model format of its vectors"""
+        self.es.indices.put_mapping(
+            index=self.formulas_index_name, meta={MODEL_FORMAT_META: model_format}
+        )
+
+    def iter_post_ids(self, min_post_id=None, page_size=10000, keep_alive="2m"):
+        """
+        Yield the post_id of every post, paging through a point-in-time with
+        search_after. Only doc values are read, no _source.
+
+        Args:
+            min_post_id: Only yield the numeric post ids greater than this one,
+                plus every post id that is not a canonical number (the ones
+                PostIdIndex keeps outside its bitmap). post_id is a keyword,
+                so the comparison uses a runtime long field.
+            page_size: Hits per page
+            keep_alive: How long the point-in-time is kept between pages
+        """
+        body = {
+            "_source": False,
+            "docvalue_fields": ["post_id"],
+        }
+        if min_post_id is not None:
+            # Emits only canonical non-negative numbers (no sign, no leading
+            # zero, ASCII digits), as PostIdIndex._as_number; posts without a
+            # post_id emit nothing
+            body["runtime_mappings"] = {
+                "post_id_number": {
+                    "type": "long",
+                    "script": {
+                        "source": "if (doc['post_id'].size() == 0) { return; } "
+                        "String value = doc['post_id'].value; "
+                        "if (value.length() == 0 || value.length() > 18 "
+                        "|| (value.length() > 1 && value.charAt(0) == (char) '0')) { return; } "
+                        "for (int i = 0; i < value.length(); i++) { "
+                        "char c = value.charAt(i); "
+                        "if (c < (char) '0' || c > (char) '9') { return; } } "
+                        "emit(Long.parseLong(value));"
+                    },
+                }
+            }
+            body["query"] = {
+                "bool": {
+                    "should": [
+                        {"range": {"post_id_number": {"gt": int(min_post_id)}}},
+                        {"bool": {"must_not": {"exists": {"field": "post_id_number"}}}},
+                    ],
+                    "minimum_should_match": 1,
+                }
+            }
+        else:
+            body["query"] = {"match_all": {}}
+
+        for hit in self._iter_pit_hits(self.posts_index_name, body, page_size, keep_alive):
+            for post_id in hit.get("fields", {}).get("post_id", []):
+                yield str(post_id)
+
+    def iter_formulas(
+        self, fields=("formula_id", "slt_text", "opt_text"), page_size=1000, keep_alive="5m"
+    ):
+        """
+        Yield the _source (only `fields`) of every formula, paging through a
+        point-in-time with search_after.
+        """
+        body = {"_source": list(fields), "query": {"match_all": {}}}
+        for hit in self._iter_pit_hits(self.formulas_index_name, body, page_size, keep_alive):
+            yield hit["_source"]
+
+    def get_formulas(self, formula_ids, fields):
+        """_source (only `fields`) of the formulas found, by formula id"""
+        if not formula_ids:
+            return {}
+        result = self.es.mget(
+            index=self.formulas_index_name,
+            ids=list(formula_ids),
+            source_includes=list(fields),
+        )
+        return {doc["_id"]: doc["_source"] for doc in result["docs"] if doc.get("found")}
+
+    def _iter_pit_hits(self, index_name, body, page_size, keep_alive):
+        """Hits of a search over the whole index, paging through a point-in-time"""
+        pit_id = self.es.open_point_in_time(index=index_name, keep_alive=keep_alive)["id"]
+        body = dict(
+            body,
+            size=page_size,
+            # _shard_doc: the cheapest stable order to page a point-in-time
+            sort=[{"_shard_doc": "asc"}],
+            track_total_hits=False,
+        )
+        try:
+            search_after = None
+            while True:
+                page = dict(body, pit={"id": pit_id, "keep_alive": keep_alive})
+                if search_after is not None:
+                    page["search_after"] = search_after
+                result = self.es.search(**page)
+                pit_id = result.get("pit_id", pit_id)
+                hits = result["hits"]["hits"]
+                yield from hits
+                if len(hits) < page_size:
+                    return
+                search_after = hits[-1]["sort"]
+        finally:
+            try:
+                self.es.close_point_in_time(id=pit_id)
+            except Exception as e:
+                print(f"Error closing point-in-time: {str(e)}")
+
+    @contextmanager
+    def bulk_load(self, index_name, max_num_segments=1):
+        """
+        Bulk-load mode for an index: refreshes are disabled and replicas set
+        to 0 while the block runs. On exit the index gets a single refresh, is
+        force-merged and has its original settings restored.
+
+        The original settings are saved to a sidecar JSON file first and are
+        restored on exceptions and SIGTERM too. If a previous load was killed
+        before restoring (e.g. SIGKILL), the next bulk_load() on the index
+        reuses the saved settings instead of the bulk-load ones, and
+        restore_bulk_load_settings() can be called to restore them directly.
+
+            with elastic_service.bulk_load(elastic_service.formulas_index_name):
+                ...
+
+        Args:
+            index_name: Index being loaded
+            max_num_segments: Segments per shard after the force merge
+        """
+        state_path = self._bulk_load_state_path(index_name)
+        if os.path.exists(state_path):
+            print(f"⚠️  Found settings of an interrupted bulk load of {index_name}")
+            with open(state_path) as file:
+                original = json.load(file)
+        else:
+            settings = self.es.indices.get_settings(
+                index=index_name,
+                name="index.refresh_interval,index.number_of_replicas",
+            )[index_name]["settings"]["index"]
+            # None resets a setting that was never set to the cluster default
+            original = {
+                "refresh_interval": settings.get("refresh_interval"),
+                "number_of_replicas": settings.get("number_of_replicas"),
+            }
+            os.makedirs(os.path.dirname(state_path), exist_ok=True)
+            with open(state_path, "w") as file:
+                json.dump(original, file)
+
+        # SIGTERM raises SystemExit, so the finally block below still runs
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(
+                signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum)
+            )
+
+        try:
+            self.es.indices.put_settings(
+                index=index_name,
+                settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+            )
+            print(f"Bulk-load mode enabled for {index_name}")
+            yield
+        finally:
+            try:
+                self._finish_bulk_load(index_name, original, max_num_segments)
+            finally:
+                if previous_handler is not None:
+                    signal.signal(signal.SIGTERM, previous_handler)
+
+    def restore_bulk_load_settings(self, index_name):
+        """Restore the settings saved by an interrupted bulk_load(), if any."""
+        state_path = self._bulk_load_state_path(index_name)
+        if not os.path.exists(state_path):
+            return False
+        with open(state_path) as file:
+            original = json.load(file)
+        self.es.indices.put_settings(index=index_name, settings={"index": original})
+        os.remove(state_path)
+        print(f"Restored settings of {index_name}: {original}")
+        return True
+
+    def _finish_bulk_load(self, index_name, original, max_num_segments):
+        # Long-running admin calls: no client-side timeout
+        admin = self.es.options(request_timeout=None)
+        try:
+            admin.indices.refresh(index=index_name)
+            print(f"Force-merging {index_name} to {max_num_segments} segment(s)...")
+            admin.indices.forcemerge(
+                index=index_name, max_num_segments=max_num_segments
+            )
+        except Exception as e:
+            print(f"Error finishing bulk load of {index_name}: {str(e)}")
+        # The settings are restored even if the merge failed
+        admin.indices.put_settings(index=index_name, settings={"index": original})
+        os.remove(self._bulk_load_state_path(index_name))
+        print(f"Bulk-load mode disabled for {index_name}, settings restored: {original}")
+
+    @staticmethod
+    def _bulk_load_state_path(index_name):
+        return os.path.join(ES_BULK_LOAD_STATE_DIR, f"{index_name}.json")
+
+    def bulk_writer(self, **kwargs) -> BulkWriter:
+        """
+        Streaming bulk writer bound to this client. See BulkWriter for the
+        options (chunk size and bytes, in-flight requests, retries, refresh).
+        """
+        return BulkWriter(self.es, **kwargs)
+
+    def _write_bulk(self, actions, name):
+        """Send the actions through a one-shot bulk writer, without refresh."""
+        try:
+            with self.bulk_writer() as writer:
+                writer.write(actions)
+            stats = writer.get_stats()
+            return stats["rejected"] == 0 and stats["failed"] == 0
+        except Exception as e:
+            print(f"Error {name}: {str(e)}")
+            return False
+
+    @staticmethod
+    def _nested_vectors(vectors):
+        """
+        Shape the entries of a nested vector field (formula_vectors,
+        slt_vectors, ...) as {"vector": ..., "formula_index": ..., "formula_text": ...}.
+        The vectors can stay numpy arrays, the client serializer writes them.
+        """
+        nested = []
+        for vector in vectors:
+            if isinstance(vector, dict):
+                nested.append(
+                    {
+                        key: vector[key]
+                        for key in ("vector", "formula_index", "formula_text")
+                        if key in vector
+                    }
+                )
+            else:
+                nested.append({"vector": vector})
+        return nested
+
+    def index_post_actions(self, posts_data):
+        """
+        Bulk actions to index posts, to be sent with a BulkWriter.
+
+        Args:
+            posts_data: Iterable of post dictionaries
+        """
+        for post in posts_data:
+            for field in NESTED_VECTOR_FIELDS:
+                if field in post:
+                    post[field] = self._nested_vectors(post[field])
+
+            yield {
+                "_op_type": "index",
+                "_index": self.posts_index_name,
+                "_id": post["post_id"],
+                "_source": post,
+            }
+
     def bulk_index_posts(self, posts_data):
         """
         Bulk index posts for better performance.
@@ -54,111 +535,29 @@ class ElasticsearchService:
         """
         if not posts_data:
             return True
+        return self._write_bulk(
+            self.index_post_actions(posts_data), "bulk indexing posts"
+        )
 
-        bulk_data = []
-        for post in posts_data:
-            # Action description
-            action = {
-                "index": {"_index": self.posts_index_name, "_id": post["post_id"]}
-            }
+    def update_post_actions(self, updates):
+        """
+        Bulk actions to partially update posts, to be sent with a BulkWriter.
 
-            # Process text_without_formula_vector if present
-            if "text_without_formula_vector" in post and isinstance(
-                post["text_without_formula_vector"], np.ndarray
-            ):
-                post["text_without_formula_vector"] = post[
-                    "text_without_formula_vector"
-                ].tolist()
-
-            # Process text_without_html_vector if present
-            if "text_without_html_vector" in post and isinstance(
-                post["text_without_html_vector"], np.ndarray
-            ):
-                post["text_without_html_vector"] = post[
-                    "text_without_html_vector"
-                ].tolist()
-
-            # Process formula vectors if present
-            if "formula_vectors" in post:
-                processed_vectors = []
-                for vector in post["formula_vectors"]:
-                    if isinstance(vector, np.ndarray):
-                        processed_vector = {"vector": vector.tolist()}
-                    elif (
-                        isinstance(vector, dict)
-                        and "vector" in vector
-                        and isinstance(vector["vector"], np.ndarray)
-                    ):
-                        processed_vector = {"vector": vector["vector"].tolist()}
-                    else:
-                        # Assuming vector is already in the correct format or a raw list/vector
-                        processed_vector = {"vector": vector}
-                    processed_vectors.append(processed_vector)
-                post["formula_vectors"] = processed_vectors
-
-            # Process SLT vectors if present
-            if "slt_vectors" in post:
-                processed_vectors = []
-                for vector in post["slt_vectors"]:
-                    if isinstance(vector, np.ndarray):
-                        processed_vector = {"vector": vector.tolist()}
-                    elif (
-                        isinstance(vector, dict)
-                        and "vector" in vector
-                        and isinstance(vector["vector"], np.ndarray)
-                    ):
-                        processed_vector = {"vector": vector["vector"].tolist()}
-                    else:
-                        # Assuming vector is already in the correct format or a raw list/vector
-                        processed_vector = {"vector": vector}
-                    processed_vectors.append(processed_vector)
-                post["slt_vectors"] = processed_vectors
-
-            # Process SLT type vectors if present
-            if "slt_type_vectors" in post:
-                processed_vectors = []
-                for vector in post["slt_type_vectors"]:
-                    if isinstance(vector, np.ndarray):
-                        processed_vector = {"vector": vector.tolist()}
-                    elif (
-                        isinstance(vector, dict)
-                        and "vector" in vector
-                        and isinstance(vector["vector"], np.ndarray)
-                    ):
-                        processed_vector = {"vector": vector["vector"].tolist()}
-                    else:
-                        # Assuming vector is already in the correct format or a raw list/vector
-                        processed_vector = {"vector": vector}
-                    processed_vectors.append(processed_vector)
-                post["slt_type_vectors"] = processed_vectors
-
-            # Process OPT vectors if present
-            if "opt_vectors" in post:
-                processed_vectors = []
-                for vector in post["opt_vectors"]:
-                    if isinstance(vector, np.ndarray):
-                        processed_vector = {"vector": vector.tolist()}
-                    elif (
-                        isinstance(vector, dict)
-                        and "vector" in vector
-                        and isinstance(vector["vector"], np.ndarray)
-                    ):
-                        processed_vector = {"vector": vector["vector"].tolist()}
-                    else:
-                        # Assuming vector is already in the correct format or a raw list/vector
-                        processed_vector = {"vector": vector}
-                    processed_vectors.append(processed_vector)
-                post["opt_vectors"] = processed_vectors
-
-            bulk_data.append(action)
-            bulk_data.append(post)
+        Args:
+            updates: Iterable of dictionaries with post_id and fields to update
+        """
+        for update in updates:
+            post_id = update.pop("post_id")
+            for field in NESTED_VECTOR_FIELDS:
+                if field in update:
+                    update[field] = self._nested_vectors(update[field])
 
-        try:
-            response = self.es.bulk(operations=bulk_data, refresh=True)
-            return not response.get("errors", False)
-        except Exception as e:
-            print(f"Error bulk indexing posts: {str(e)}")
-            return False
+            yield {
+                "_op_type": "update",
+                "_index": self.posts_index_name,
+                "_id": post_id,
+                "doc": update,
+            }
 
     def bulk_update_posts(self, updates):
         """
@@ -169,156 +568,7 @@ class ElasticsearchService:
         """
         if not updates:
             return True
-
-        try:
-            bulk_data = []
-
-            for update in updates:
-                post_id = update.pop("post_id")
-
-                # Process text_without_formula_vector if present
-                if "text_without_formula_vector" in update and isinstance(
-                    update["text_without_formula_vector"], np.ndarray
-                ):
-                    update["text_without_formula_vector"] = update[
-                        "text_without_formula_vector"
-                    ].tolist()
-
-                # Process text_without_html_vector if present
-                if "text_without_html_vector" in update and isinstance(
-                    update["text_without_html_vector"], np.ndarray
-                ):
-                    update["text_without_html_vector"] = update[
-                        "text_without_html_vector"
-                    ].tolist()
-
-                # Process formula vectors if present
-                if "formula_vectors" in update:
-                    processed_vectors = []
-                    for vector in update["formula_vectors"]:
-                        if isinstance(vector, np.ndarray):
-                            processed_vector = {"vector": vector.tolist()}
-                        elif isinstance(vector, dict):
-                            processed_vector = {}
-                            if "vector" in vector:
-                                processed_vector["vector"] = (
-                                    vector["vector"].tolist()
-                                    if isinstance(vector["vector"], np.ndarray)
-                                    else vector["vector"]
-                                )
-                            if "formula_index" in vector:
-                                processed_vector["formula_index"] = vector[
-                                    "formula_index"
-                                ]
-                            if "formula_text" in vector:
-                                processed_vector["formula_text"] = vector[
-                                    "formula_text"
-                                ]
-                        else:
-                            # Assuming vector is already in the correct format (list)
-                            processed_vector = {"vector": vector}
-                        processed_vectors.append(processed_vector)
-                    update["formula_vectors"] = processed_vectors
-
-                # Process SLT vectors if present
-                if "slt_vectors" in update:
-                    processed_vectors = []
-                    for vector in update["slt_vectors"]:
-                        if isinstance(vector, np.ndarray):
-                            processed_vector = {"vector": vector.tolist()}
-                        elif isinstance(vector, dict):
-                            processed_vector = {}
-                            if "vector" in vector:
-                                processed_vector["vector"] = (
-                                    vector["vector"].tolist()
-                                    if isinstance(vector["vector"], np.ndarray)
-                                    else vector["vector"]
-                                )
-                            if "formula_index" in vector:
-                                processed_vector["formula_index"] = vector[
-                                    "formula_index"
-                                ]
-                            if "formula_text" in vector:
-                                processed_vector["formula_text"] = vector[
-                                    "formula_text"
-                                ]
-                        else:
-                            # Assuming vector is already in the correct format (list)
-                            processed_vector = {"vector": vector}
-                        processed_vectors.append(processed_vector)
-                    update["slt_vectors"] = processed_vectors
-
-                # Process SLT type vectors if present
-                if "slt_type_vectors" in update:
-                    processed_vectors = []
-                    for vector in update["slt_type_vectors"]:
-                        if isinstance(vector, np.ndarray):
-                            processed_vector = {"vector": vector.tolist()}
-                        elif isinstance(vector, dict):
-                            processed_vector = {}
-                            if "vector" in vector:
-                                processed_vector["vector"] = (
-                                    vector["vector"].tolist()
-                                    if isinstance(vector["vector"], np.ndarray)
-                                    else vector["vector"]
-                                )
-                            if "formula_index" in vector:
-                                processed_vector["formula_index"] = vector[
-                                    "formula_index"
-                                ]
-                            if "formula_text" in vector:
-                                processed_vector["formula_text"] = vector[
-                                    "formula_text"
-                                ]
-                        else:
-                            # Assuming vector is already in the correct format (list)
-                            processed_vector = {"vector": vector}
-                        processed_vectors.append(processed_vector)
-                    update["slt_type_vectors"] = processed_vectors
-
-                # Process OPT vectors if present
-                if "opt_vectors" in update:
-                    processed_vectors = []
-                    for vector in update["opt_vectors"]:
-                        if isinstance(vector, np.ndarray):
-                            processed_vector = {"vector": vector.tolist()}
-                        elif isinstance(vector, dict):
-                            processed_vector = {}
-                            if "vector" in vector:
-                                processed_vector["vector"] = (
-                                    vector["vector"].tolist()
-                                    if isinstance(vector["vector"], np.ndarray)
-                                    else vector["vector"]
-                                )
-                            if "formula_index" in vector:
-                                processed_vector["formula_index"] = vector[
-                                    "formula_index"
-                                ]
-                            if "formula_text" in vector:
-                                processed_vector["formula_text"] = vector[
-                                    "formula_text"
-                                ]
-                        else:
-                            # Assuming vector is already in the correct format (list)
-                            processed_vector = {"vector": vector}
-                        processed_vectors.append(processed_vector)
-                    update["opt_vectors"] = processed_vectors
-
-                # Build bulk actions
-                action = {"update": {"_index": self.posts_index_name, "_id": post_id}}
-                doc = {"doc": update}
-
-                bulk_data.append(action)
-                bulk_data.append(doc)
-
-            # 🔥 Execute bulk OUTSIDE the loop
-            response = self.es.bulk(operations=bulk_data, refresh=True)
-
-            return not response.get("errors", False)
-
-        except Exception as e:
-            print(f"Error bulk updating posts: {str(e)}")
-            return False
+        return self._write_bulk(self.update_post_actions(updates), "bulk updating posts")
 
     def create_posts_index(self):
         """Create the Elasticsearch index with appropriate mappings for posts and formulas."""
@@ -536,6 +786,21 @@ class ElasticsearchService:
         except Exception as e:
             print(f"Error creating formulas index: {str(e)}")
 
+    def index_formula_actions(self, formulas_data):
+        """
+        Bulk actions to index formulas, to be sent with a BulkWriter.
+
+        Args:
+            formulas_data: Iterable of formula dictionaries
+        """
+        for position, formula in enumerate(formulas_data):
+            yield {
+                "_op_type": "index",
+                "_index": self.formulas_index_name,
+                "_id": formula.get("formula_id", f"{formula['post_id']}_{position}"),
+                "_source": formula,
+            }
+
     def bulk_index_formulas(self, formulas_data):
         """
         Bulk index formulas for better performance.
@@ -545,49 +810,28 @@ class ElasticsearchService:
         """
         if not formulas_data:
             return True
+        return self._write_bulk(
+            self.index_formula_actions(formulas_data), "bulk indexing formulas"
+        )
 
-        bulk_data = []
-        for formula in formulas_data:
-            # Action description
-            action = {
-                "index": {
-                    "_index": self.formulas_index_name,
-                    "_id": formula.get(
-                        "formula_id", f"{formula['post_id']}_{len(bulk_data)//2}"
-                    ),
-                }
-            }
-
-            # Process vectors if they are numpy arrays
-            processed_formula = formula.copy()
-
-            for vector_field in [
-                "formula_vector",
-                "slt_vector",
-                "slt_type_vector",
-                "opt_vector",
-            ]:
-                if vector_field in processed_formula and isinstance(
-                    processed_formula[vector_field], np.ndarray
-                ):
-                    processed_formula[vector_field] = processed_formula[
-                        vector_field
-                    ].tolist()
-
-            bulk_data.append(action)
-            bulk_data.append(processed_formula)
+    def update_formula_actions(self, updates):
+        """
+        Bulk actions to partially update formulas, to be sent with a BulkWriter.
 
-        try:
-            response = self.es.bulk(operations=bulk_data, refresh=True)
-            return not response.get("errors", False)
-        except Exception as e:
-            print(f"Error bulk indexing formulas: {str(e)}")
-            return False
+        Args:
+            updates: Iterable of dictionaries with formula_id and fields to update
+        """
+        for update in updates:
+            formula_id = update.pop("formula_id")
+            yield {
+                "_op_type": "update",
+                "_index": self.formulas_index_name,
+                "_id": formula_id,
+                "doc": update,
+            }
 
     def bulk_update_text_vector(self, posts: list):
-        from elasticsearch.helpers import bulk
-
-        actions = [
+        actions = (
             {
                 "_op_type": "update",
                 "_index": self.posts_index_name,
@@ -597,11 +841,10 @@ class ElasticsearchService:
                 },
             }
             for post in posts
-        ]
-
-        success, errors = bulk(self.es, actions, raise_on_error=False)
+        )
+        with self.bulk_writer() as writer:
+            writer.write(actions)
 
-        if errors:
-            print(f"{len(errors)} document(s) failed to index.")
-            for error in errors[:5]:  # mostra só os 5 primeiros
-                print(error)
+        rejected = writer.get_stats()["rejected"] + writer.get_stats()["failed"]
+        if rejected:
+            print(f"{rejected} document(s) failed to index.")
@@ -0,0 +1,187 @@
+import json
+from typing import Any
+
+import numpy as np
+from elasticsearch.serializer import JsonSerializer, NdjsonSerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+# Dígitos significativos do fallback: o suficiente para ida e volta de um float32
+FLOAT32_SIGNIFICANT_DIGITS = 9
+
+
+def _fallback_dumps(data: Any, default) -> str:
+    """
+    Serializa em JSON escrevendo os arrays numpy de float diretamente, com
+    precisão limitada, em vez de passar por json + ndarray.tolist()
+    """
+    float_format = f"%.{FLOAT32_SIGNIFICANT_DIGITS}g"
+
+    def encode(obj):
+        if isinstance(obj, np.ndarray):
+            if obj.dtype.kind == "f" and obj.ndim == 1:
+                if not obj.size:
+                    return "[]"
+                # Uma única formatação em C para o vetor inteiro
+                return "[" + ",".join([float_format] * obj.size) % tuple(obj.tolist()) + "]"
+            if obj.ndim > 1:
+                return "[" + ",".join(encode(row) for row in obj) + "]"
+            return json.dumps(obj.tolist())
+        if isinstance(obj, dict):
+            return (
+                "{"
+                + ",".join(
+                    json.dumps(str(key), ensure_ascii=False) + ":" + encode(value)
+                    for key, value in obj.items()
+                )
+                + "}"
+            )
+        if isinstance(obj, (list, tuple)):
+            return "[" + ",".join(encode(item) for item in obj) + "]"
+        if isinstance(obj, np.generic):
+            # NaN e infinito não são JSON válido
+            if obj.dtype.kind == "f" and not np.isfinite(obj):
+                return "null"
+            return json.dumps(obj.item())
+        return json.dumps(
+            obj, default=default, ensure_ascii=False, separators=(",", ":")
+        )
+
+    return encode(data)
+
+
+# Campos que identificam o documento nas mensagens de vetores descartados
+DOCUMENT_ID_FIELDS = ("_id", "formula_id", "post_id")
+
+
+# Marca um valor (vetor ou entrada de lista) que não deve ser escrito
+_DROPPED = object()
+
+
+def _is_non_finite_vector(value: Any) -> bool:
+    return (
+        isinstance(value, np.ndarray)
+        and value.dtype.kind == "f"
+        and not np.isfinite(value).all()
+    )
+
+
+def _drop_non_finite(value: Any, field: str, document_id: Any) -> Any:
+    """
+    `value` sem os vetores inválidos; _DROPPED se o próprio `value` é um
+    vetor inválido ou uma entrada de lista (ex.: {"vector": ...} de um campo
+    nested) que tinha um. Sem vetores inválidos, o próprio `value` é devolvido.
+    """
+    if _is_non_finite_vector(value):
+        print(f"⚠️ Non-finite values in {field} of document {document_id}, field not written")
+        return _DROPPED
+
+    if isinstance(value, dict):
+        if document_id is None:
+            document_id = next(
+                (value[field] for field in DOCUMENT_ID_FIELDS if field in value), None
+            )
+        cleaned = None
+        for key, item in value.items():
+            new_item = _drop_non_finite(item, f"{field}.{key}" if field else key, document_id)
+            if new_item is item:
+                continue
+            if cleaned is None:
+                cleaned = dict(value)
+            if new_item is _DROPPED:
+                del cleaned[key]
+            else:
+                cleaned[key] = new_item
+        return value if cleaned is None else cleaned
+
+    if isinstance(value, (list, tuple)):
+        cleaned = None
+        for position, item in enumerate(value):
+            new_item = _drop_non_finite(item, f"{field}[{position}]", document_id)
+            if new_item is not item and cleaned is None:
+                cleaned = list(value[:position])
+            if cleaned is None:
+                continue
+            if new_item is not item and isinstance(item, dict):
+                # Uma entrada nested sem o vetor não serve para a busca: sai inteira
+                print(f"⚠️ Entry {field}[{position}] of document {document_id} not written")
+            elif new_item is not _DROPPED:
+                cleaned.append(new_item)
+        return value if cleaned is None else cleaned
+    return value
+
+
+def drop_non_finite_vectors(data: Any, document_id: Any = None) -> Any:
+    """
+    Remove de um documento os vetores numpy com NaN ou infinito, que não são
+    JSON válido (o fallback escreveria nan/inf e o bulk inteiro falharia) e
+    que um campo dense_vector rejeitaria. Percorre os dicionários (ex.: o
+    "doc" de um update) e as listas (ex.: as entradas {"vector": ...} dos
+    campos nested formula_vectors, slt_vectors, ...): um vetor inválido em
+    um campo remove o campo, e em uma entrada de lista remove a entrada.
+    Cada remoção é logada com o id do documento. Sem vetores inválidos, o
+    próprio `data` é devolvido.
+    """
+    if not isinstance(data, dict):
+        return data
+    return _drop_non_finite(data, "", document_id)
+
+
+def numpy_json_dumps(data: Any, default) -> bytes:
+    """
+    JSON de `data` em bytes. Com orjson, os arrays numpy são escritos
+    direto do buffer (float32 com a menor representação exata, sem listas
+    Python intermediárias); sem orjson, usa o fallback formatado acima.
+    Vetores com NaN ou infinito são removidos (drop_non_finite_vectors).
+    """
+    data = drop_non_finite_vectors(data)
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return _fallback_dumps(data, default).encode("utf-8", "surrogatepass")
+
+
+class NumpyJsonSerializer(JsonSerializer):
+    """Serializer JSON do cliente Elasticsearch que entende arrays numpy"""
+
+    def dumps(self, data: Any) -> bytes:
+        if isinstance(data, str):
+            return data.encode("utf-8", "surrogatepass")
+        if isinstance(data, bytes):
+            return data
+        return numpy_json_dumps(data, self.default)
+
+
+class NumpyNdjsonSerializer(NdjsonSerializer):
+    """Serializer NDJSON (usado pelo _bulk e _msearch) que entende arrays numpy"""
+
+    def dumps(self, data: Any) -> bytes:
+        if isinstance(data, (str, bytes)):
+            data = (data,)
+        buffer = bytearray()
+        for line in data:
+            if isinstance(line, str):
+                line = line.encode("utf-8", "surrogatepass")
+            if isinstance(line, bytes):
+                buffer += line
+                # Linhas já serializadas (ex.: BulkWriter) podem vir sem o "\n"
+                if not line.endswith(b"\n"):
+                    buffer += b"\n"
+            else:
+                buffer += numpy_json_dumps(line, self.default)
+                buffer += b"\n"
+        return bytes(buffer)
+
+
+def numpy_serializers():
+    """Serializers para o parâmetro `serializers=` dos clientes Elasticsearch"""
+    return {
+        "application/json": NumpyJsonSerializer(),
+        "application/x-ndjson": NumpyNdjsonSerializer(),
+    }
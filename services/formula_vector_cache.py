@@ -0,0 +1,223 @@
+import glob
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Configuração do cache, ajustável por variáveis de ambiente
+FORMULA_VECTOR_CACHE_SIZE = int(os.environ.get("FORMULA_VECTOR_CACHE_SIZE", "10000"))
+FORMULA_VECTOR_CACHE_TTL = os.environ.get("FORMULA_VECTOR_CACHE_TTL")
+FORMULA_VECTOR_CACHE_PATH = os.environ.get("FORMULA_VECTOR_CACHE_PATH")
+
+_whitespace_between_tags = re.compile(r">\s+<")
+_whitespace = re.compile(r"\s+")
+# Atributos que mudam a cada ocorrência da fórmula, mas não alteram a árvore
+_volatile_attributes = re.compile(r'\s(?:id|xml:id|alttext)="[^"]*"')
+
+
+class FormulaVectorCache:
+    """
+    Cache LRU (com TTL opcional) dos vetores de fórmulas de consulta.
+
+    A chave é o hash do MathML normalizado junto com os tipos de vetor
+    pedidos. Opcionalmente os vetores são gravados em um arquivo sqlite local,
+    para que o cache sobreviva a reinícios do servidor. O arquivo guarda a
+    impressão digital dos modelos (model_fingerprint) que geraram os vetores:
+    se ela mudar (modelo retreinado ou atualizado), o cache gravado é
+    descartado.
+    """
+
+    def __init__(
+        self,
+        max_size: int = FORMULA_VECTOR_CACHE_SIZE,
+        ttl_seconds: Optional[float] = None,
+        sqlite_path: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.sqlite_path = sqlite_path
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS formula_vectors "
+                "(key TEXT PRIMARY KEY, vectors BLOB, created_at REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value TEXT)"
+            )
+            if fingerprint is not None:
+                self._check_fingerprint(fingerprint)
+            self._db.commit()
+
+    def _check_fingerprint(self, fingerprint: str):
+        """Descarta os vetores gravados por outros modelos"""
+        row = self._db.execute(
+            "SELECT value FROM cache_meta WHERE name = 'model_fingerprint'"
+        ).fetchone()
+        if row is not None and row[0] == fingerprint:
+            return
+        dropped = self._db.execute("DELETE FROM formula_vectors").rowcount
+        if dropped:
+            print(
+                f"🔄 Models changed since the formula vector cache was written, "
+                f"{dropped} cached vectors dropped"
+            )
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache_meta VALUES ('model_fingerprint', ?)",
+            (fingerprint,),
+        )
+
+    @staticmethod
+    def make_key(formula: str, vector_types: List[str]) -> str:
+        """
+        Gera a chave do cache a partir do MathML normalizado e dos tipos de
+        vetor pedidos
+        """
+        normalized = _volatile_attributes.sub("", formula)
+        normalized = _whitespace_between_tags.sub("><", normalized)
+        normalized = _whitespace.sub(" ", normalized).strip()
+        types = ",".join(sorted(vt.lower() for vt in vector_types))
+        return hashlib.sha256(f"{types}|{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Retorna os vetores guardados para a chave, ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[1]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+
+            vectors = self._load(key) if self._db is not None else None
+            if vectors is not None:
+                self.disk_hits += 1
+                self._store(key, vectors[0], vectors[1])
+                return vectors[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vectors: Dict[str, np.ndarray]):
+        """Guarda os vetores calculados para a chave"""
+        created_at = time.time()
+        with self._lock:
+            self._store(key, vectors, created_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO formula_vectors VALUES (?, ?, ?)",
+                    (key, self._serialize(vectors), created_at),
+                )
+                self._db.commit()
+
+    def get_stats(self) -> dict:
+        """Retorna as métricas de acerto do cache"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (
+                    (self.hits + self.disk_hits) / lookups if lookups else 0.0
+                ),
+                "persistent": self._db is not None,
+            }
+
+    def _expired(self, created_at: float) -> bool:
+        return (
+            self.ttl_seconds is not None
+            and time.time() - created_at > self.ttl_seconds
+        )
+
+    def _store(self, key, vectors, created_at):
+        self._entries[key] = (vectors, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key):
+        row = self._db.execute(
+            "SELECT vectors, created_at FROM formula_vectors WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        return self._deserialize(row[0]), row[1]
+
+    @staticmethod
+    def _serialize(vectors: Dict[str, np.ndarray]) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, **vectors)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _deserialize(data: bytes) -> Dict[str, np.ndarray]:
+        with np.load(io.BytesIO(data)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+
+def model_fingerprint(model_paths, model_format: str = "full") -> str:
+    """
+    Impressão digital dos modelos: o formato carregado (full ou inference, que
+    dão vetores diferentes) e os arquivos dos modelos (nome, tamanho e mtime
+    de todos os arquivos de cada modelo: FastText, artefato de inferência e
+    tabela de tuplas). Os mapas de encoder não entram: só ganham ids novos,
+    os ids já usados não mudam sem que os modelos sejam retreinados.
+    """
+    digest = hashlib.sha256(f"{model_format}\n".encode("utf-8"))
+    for model_path in sorted(model_paths):
+        for path in sorted(glob.glob(glob.escape(model_path) + "*")):
+            stat = os.stat(path)
+            digest.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+_cache: Optional[FormulaVectorCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_formula_vector_cache() -> FormulaVectorCache:
+    """Retorna o cache de vetores de fórmulas compartilhado pelo processo"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                fingerprint = None
+                if FORMULA_VECTOR_CACHE_PATH:
+                    from services.model_manager import CFT_MODEL_FORMAT, MODEL_PATHS
+
+                    fingerprint = model_fingerprint(MODEL_PATHS.values(), CFT_MODEL_FORMAT)
+                _cache = FormulaVectorCache(
+                    max_size=FORMULA_VECTOR_CACHE_SIZE,
+                    ttl_seconds=(
+                        float(FORMULA_VECTOR_CACHE_TTL)
+                        if FORMULA_VECTOR_CACHE_TTL
+                        else None
+                    ),
+                    sqlite_path=FORMULA_VECTOR_CACHE_PATH,
+                    fingerprint=fingerprint,
+                )
+    return _cache
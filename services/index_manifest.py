@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Onde os manifestos dos jobs de indexação ficam, ajustável por variável de ambiente
+INDEX_MANIFEST_DIR = os.environ.get("INDEX_MANIFEST_DIR", "data/manifests")
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+
+def file_hash(paths: List[str]) -> str:
+    """Hash (blake2b) do conteúdo dos arquivos, na ordem dada"""
+    digest = hashlib.blake2b(digest_size=20)
+    for path in paths:
+        if path is None:
+            digest.update(b"\0")
+            continue
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """
+    Manifesto de um job de indexação retomável.
+
+    Para cada entrada (arquivo, tipo de grafo) guarda o hash do conteúdo
+    da entrada, o offset (em linhas da entrada) até onde todos os
+    documentos foram confirmados pelo Elasticsearch e o estado. Ao
+    reiniciar, arquivos já concluídos e com o mesmo hash são pulados e
+    arquivos interrompidos continuam do offset confirmado.
+
+        manifest = IndexManifest("formulas")
+        start_row = manifest.begin(path, "SLT")  # None: já concluído
+        ...
+        writer = elastic_service.bulk_writer(on_commit=manifest.commit)
+        writer.mark(manifest.offset(path, "SLT", rows))
+        writer.mark(manifest.offset(path, "SLT", rows, done=True))
+
+    O arquivo é regravado de forma atômica a cada commit.
+    """
+
+    def __init__(self, name: str, directory: str = INDEX_MANIFEST_DIR):
+        self.path = os.path.join(directory, f"{name}.json")
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                self.entries = json.load(file)["entries"]
+
+    @staticmethod
+    def key(path: str, graph_type: str) -> str:
+        return f"{graph_type}:{os.path.normpath(path)}"
+
+    def get(self, path: str, graph_type: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self.entries.get(self.key(path, graph_type))
+            return dict(entry) if entry is not None else None
+
+    def begin(
+        self, path: str, graph_type: str, inputs: Optional[List[str]] = None
+    ) -> Optional[int]:
+        """
+        Começa (ou retoma) uma entrada. `inputs` são os arquivos cujo
+        conteúdo define a entrada (por padrão, só `path`).
+
+        Returns:
+            Linha da entrada a partir da qual continuar (0 se o conteúdo mudou
+            ou se a entrada é nova), ou None se ela já foi concluída
+        """
+        inputs = inputs or [path]
+        key = self.key(path, graph_type)
+        signature = [
+            [os.path.getsize(p), os.path.getmtime(p)] if p is not None else None
+            for p in inputs
+        ]
+        with self._lock:
+            entry = self.entries.get(key)
+        # Mesmo tamanho e data de modificação: reaproveita o hash já calculado
+        if entry is not None and entry.get("signature") == signature:
+            content_hash = entry["hash"]
+        else:
+            content_hash = file_hash(inputs)
+
+        with self._lock:
+            if entry is not None and entry["hash"] == content_hash:
+                entry["signature"] = signature
+                self._save()
+                if entry["status"] == DONE:
+                    return None
+                return entry["rows"]
+
+            if entry is not None:
+                print(f"{path} changed since the last run, indexing it again")
+            self.entries[key] = {
+                "path": path,
+                "graph_type": graph_type,
+                "inputs": inputs,
+                "hash": content_hash,
+                "signature": signature,
+                "rows": 0,
+                "status": IN_PROGRESS,
+                "started_at": time.time(),
+                "updated_at": time.time(),
+            }
+            self._save()
+            return 0
+
+    def offset(self, path: str, graph_type: str, rows: int, done: bool = False):
+        """Offset para BulkWriter.mark(): as `rows` primeiras linhas da entrada"""
+        return (self.key(path, graph_type), rows, done)
+
+    def commit(self, offset):
+        """Registra um offset confirmado (callback on_commit do BulkWriter)"""
+        key, rows, done = offset
+        with self._lock:
+            entry = self.entries[key]
+            entry["rows"] = rows
+            entry["status"] = DONE if done else IN_PROGRESS
+            entry["updated_at"] = time.time()
+            self._save()
+
+    def update(self, path: str, graph_type: str, **values):
+        """Guarda valores extras na entrada"""
+        with self._lock:
+            self.entries[self.key(path, graph_type)].update(values)
+            self._save()
+
+    def report(self):
+        with self._lock:
+            entries = list(self.entries.values())
+        done = sum(1 for entry in entries if entry["status"] == DONE)
+        print(
+            f"📊 Manifest {self.path}: {done}/{len(entries)} entries done, "
+            f"{sum(entry['rows'] for entry in entries)} rows committed"
+        )
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"entries": self.entries}, file, indent=2)
+        os.replace(temp_path, self.path)
@@ -1,14 +1,37 @@
+import os
+import threading
+
 from services.tanget_cft_service import TangentCFTService
-from typing import Dict, Literal
+from services.text_embedding_service import TextEmbeddingService
+from typing import Dict, Literal, Optional
+
+TEXT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+MODEL_PATHS = {
+    "SLT": "./lib/tangentCFT/trained_model/slt_model",
+    "OPT": "./lib/tangentCFT/trained_model/opt_model",
+    "SLT_TYPE": "./lib/tangentCFT/trained_model/slt_type_model",
+}
+
+# full: FastText completo; inference: artefato compacto (scripts/export_inference_models.py).
+# Os dois dão vetores diferentes para tuplas fora do vocabulário (o artefato não tem os
+# buckets de n-gramas não usados no treino), então o índice de fórmulas precisa ser gerado
+# com o mesmo formato usado para servir as consultas: trocar de formato exige reindexar.
+CFT_MODEL_FORMAT = os.environ.get("CFT_MODEL_FORMAT", "full")
+# Mapeia os arrays dos modelos em memória (somente leitura), compartilhando as páginas entre workers
+CFT_MODEL_MMAP = os.environ.get("CFT_MODEL_MMAP", "false").lower() in ("1", "true")
 
 
 class ModelManager:
     """
     Gerenciador singleton para carregar e reutilizar modelos TangentCFT
+    e o modelo de embeddings de texto
     """
 
     _instance = None
     _models: Dict[str, TangentCFTService] = {}
+    _text_model: Optional[TextEmbeddingService] = None
+    _lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
@@ -24,18 +47,78 @@ class ModelManager:
         if model_type not in self._models:
             print(f"🔄 Carregando modelo {model_type} pela primeira vez...")
 
-            if model_type == "SLT":
-                model_path = "./lib/tangentCFT/trained_model/slt_model"
-            elif model_type == "OPT":
-                model_path = "./lib/tangentCFT/trained_model/opt_model"
-            else:  # SLT_TYPE
-                model_path = "./lib/tangentCFT/trained_model/slt_type_model"
-
-            self._models[model_type] = TangentCFTService(model_path)
+            self._models[model_type] = TangentCFTService(
+                MODEL_PATHS[model_type],
+                model_format=CFT_MODEL_FORMAT,
+                mmap=CFT_MODEL_MMAP,
+            )
             print(f"✅ Modelo {model_type} carregado com sucesso!")
 
         return self._models[model_type]
 
+    def get_text_model(self) -> TextEmbeddingService:
+        """
+        Retorna o motor de embeddings de texto, carregando apenas se necessário
+        """
+        if self._text_model is None:
+            with self._lock:
+                # Outra thread pode ter carregado o modelo enquanto esperávamos
+                if self._text_model is None:
+                    print(f"🔄 Carregando modelo de texto {TEXT_MODEL_NAME}...")
+                    text_model = TextEmbeddingService(TEXT_MODEL_NAME)
+                    ModelManager._text_model = text_model
+                    print(
+                        f"✅ Modelo de texto carregado em {text_model.load_time:.2f}s!"
+                    )
+
+        return self._text_model
+
+    def preload(self):
+        """
+        Carrega os três modelos TangentCFT e o modelo de texto
+        """
+        for model_type in MODEL_PATHS:
+            self.get_model(model_type)
+        self.get_text_model()
+
+    def get_stats(self) -> dict:
+        """Retorna as métricas dos modelos já carregados"""
+        return {
+            "formula_models_loaded": sorted(self._models.keys()),
+            "formula_models_mmap": CFT_MODEL_MMAP,
+            "pid": os.getpid(),
+            "text_model": (
+                self._text_model.get_stats() if self._text_model is not None else None
+            ),
+        }
+
 
 # Instância global
 model_manager = ModelManager()
+
+
+def check_formulas_index_format(elastic_service, indexing: bool = False):
+    """
+    Confere que o índice de fórmulas foi gerado com o formato de modelo
+    CFT_MODEL_FORMAT (os vetores das consultas precisam vir do mesmo
+    formato dos vetores indexados). Ao indexar (`indexing`), um índice
+    vazio passa a registrar o formato atual.
+
+    Raises:
+        RuntimeError: se o índice tem vetores de outro formato de modelo
+    """
+    if indexing and elastic_service.count_formulas() == 0:
+        elastic_service.set_formulas_model_format(CFT_MODEL_FORMAT)
+        return
+
+    index_format = elastic_service.get_formulas_model_format()
+    if index_format is not None and index_format != CFT_MODEL_FORMAT:
+        raise RuntimeError(
+            f"The {elastic_service.formulas_index_name} index was embedded with the "
+            f"{index_format} formula models, but CFT_MODEL_FORMAT={CFT_MODEL_FORMAT}: "
+            f"query vectors of out-of-vocabulary tuples would not match the index. "
+            f"Set CFT_MODEL_FORMAT={index_format}, or delete the index and index the "
+            f"formulas again with CFT_MODEL_FORMAT={CFT_MODEL_FORMAT}"
+        )
+    if indexing:
+        elastic_service.set_formulas_model_format(CFT_MODEL_FORMAT)
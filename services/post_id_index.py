@@ -0,0 +1,177 @@
+import json
+import os
+import time
+from typing import Iterable, Optional, Set
+
+import numpy as np
+
+# Onde o índice de post ids é guardado, ajustável por variável de ambiente
+POST_ID_INDEX_PATH = os.environ.get(
+    "POST_ID_INDEX_PATH", "data/arqmath/post_id_index"
+)
+
+BITMAP_SUFFIX = ".bitmap.npy"
+META_SUFFIX = ".json"
+
+
+class PostIdIndex:
+    """
+    Índice local dos post ids presentes no índice posts do Elasticsearch.
+
+    Os post ids numéricos ficam em um bitmap (1 bit por id, ~500 KB para 4
+    milhões de ids) e a consulta é O(1), sem ida ao Elasticsearch. Ids não
+    numéricos, se houver, ficam em um set.
+
+    O índice é exportado uma vez (point-in-time + search_after) e depois
+    atualizado de forma incremental, com os posts de id maior que o maior id
+    já conhecido e com todos os ids não numéricos (poucos, relidos a cada
+    atualização). Posts numéricos indexados fora de ordem, com id menor que
+    o maior conhecido, só entram com uma exportação completa (build):
+
+        post_id_index = PostIdIndex.load_or_build(POST_ID_INDEX_PATH, elastic_service)
+        existing = post_id_index.filter(post_ids)
+    """
+
+    def __init__(
+        self,
+        bits: Optional[np.ndarray] = None,
+        other_ids: Optional[Set[str]] = None,
+        max_post_id: int = -1,
+        count: int = 0,
+    ):
+        self.bits = bits if bits is not None else np.zeros(0, dtype=np.uint8)
+        self.other_ids = other_ids or set()
+        self.max_post_id = max_post_id
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, post_id) -> bool:
+        number = self._as_number(post_id)
+        if number is None:
+            return str(post_id) in self.other_ids
+        byte = number >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (128 >> (number & 7)))
+
+    def filter(self, post_ids: Iterable) -> Set[str]:
+        """Os post ids (como string) que existem no índice posts"""
+        return {str(post_id) for post_id in post_ids if post_id in self}
+
+    def add(self, post_ids: Iterable):
+        """Adiciona post ids ao índice"""
+        numbers = []
+        for post_id in post_ids:
+            number = self._as_number(post_id)
+            if number is None:
+                if str(post_id) not in self.other_ids:
+                    self.other_ids.add(str(post_id))
+                    self.count += 1
+            else:
+                numbers.append(number)
+        if not numbers:
+            return
+
+        numbers = np.unique(np.asarray(numbers, dtype=np.int64))
+        needed = int(numbers[-1] >> 3) + 1
+        if needed > len(self.bits):
+            # Cresce com folga para evitar cópias a cada atualização
+            grown = np.zeros(max(needed, len(self.bits) * 5 // 4), dtype=np.uint8)
+            grown[: len(self.bits)] = self.bits
+            self.bits = grown
+
+        masks = (128 >> (numbers & 7)).astype(np.uint8)
+        is_new = (self.bits[numbers >> 3] & masks) == 0
+        np.bitwise_or.at(self.bits, numbers >> 3, masks)
+        self.count += int(is_new.sum())
+        self.max_post_id = max(self.max_post_id, int(numbers[-1]))
+
+    def refresh(self, elastic_service) -> int:
+        """
+        Adiciona os posts indexados depois da última exportação: post id
+        maior que max_post_id, mais os ids não numéricos, que o bitmap não
+        ordena e são todos relidos. Retorna o número de ids novos.
+        """
+        before = len(self)
+        min_post_id = self.max_post_id if self.max_post_id >= 0 else None
+        batch = []
+        for post_id in elastic_service.iter_post_ids(min_post_id=min_post_id):
+            batch.append(post_id)
+            if len(batch) >= 100000:
+                self.add(batch)
+                batch = []
+        self.add(batch)
+        return len(self) - before
+
+    @classmethod
+    def build(cls, elastic_service) -> "PostIdIndex":
+        """Exporta todos os post ids do índice posts"""
+        post_id_index = cls()
+        post_id_index.refresh(elastic_service)
+        return post_id_index
+
+    def save(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.save(path + BITMAP_SUFFIX, self.bits)
+        with open(path + META_SUFFIX, "w") as file:
+            json.dump(
+                {
+                    "max_post_id": self.max_post_id,
+                    "count": self.count,
+                    "other_ids": sorted(self.other_ids),
+                    "updated_at": time.time(),
+                },
+                file,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "PostIdIndex":
+        with open(path + META_SUFFIX) as file:
+            meta = json.load(file)
+        return cls(
+            bits=np.load(path + BITMAP_SUFFIX),
+            other_ids=set(meta["other_ids"]),
+            max_post_id=meta["max_post_id"],
+            count=meta["count"],
+        )
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return os.path.exists(path + BITMAP_SUFFIX) and os.path.exists(path + META_SUFFIX)
+
+    @classmethod
+    def load_or_build(
+        cls, path: str, elastic_service, refresh: bool = True
+    ) -> "PostIdIndex":
+        """
+        Carrega o índice salvo e o atualiza de forma incremental, ou faz a
+        exportação completa se ele ainda não existe. O resultado é salvo.
+        """
+        start_time = time.perf_counter()
+        if cls.exists(path):
+            post_id_index = cls.load(path)
+            added = post_id_index.refresh(elastic_service) if refresh else 0
+            print(f"Loaded post id index {path}: {len(post_id_index)} posts, {added} new")
+        else:
+            print(f"Exporting the post ids of {elastic_service.posts_index_name}...")
+            post_id_index = cls.build(elastic_service)
+            print(f"Exported {len(post_id_index)} post ids")
+        post_id_index.save(path)
+        print(
+            f"Post id index ready in {time.perf_counter() - start_time:.1f}s "
+            f"(max post_id {post_id_index.max_post_id}, "
+            f"{post_id_index.bits.nbytes / 1024:.0f} KB)"
+        )
+        return post_id_index
+
+    @staticmethod
+    def _as_number(post_id) -> Optional[int]:
+        if isinstance(post_id, (int, np.integer)):
+            return int(post_id) if post_id >= 0 else None
+        post_id = str(post_id)
+        # Só ids canônicos ("012" não é o mesmo id que "12" no campo keyword)
+        if post_id.isdigit() and post_id.isascii() and (post_id == "0" or post_id[0] != "0"):
+            return int(post_id)
+        return None
@@ -19,21 +19,53 @@ class TangentCFTService:
     def __init__(
         self,
         model_file_path=None,
+        model_format: Literal["full", "inference"] = "full",
+        mmap: bool = False,
     ):
         """
         Inicializa o serviço TangentCFT com modelo e encoder
+
+        Args:
+            model_file_path: Caminho do modelo treinado
+            model_format: "full" carrega o FastText completo (necessário para treinar) e
+                "inference" carrega o artefato compacto gerado por
+                scripts/export_inference_models.py. Para tuplas fora do vocabulário o
+                artefato não dá os mesmos vetores do modelo completo: os vetores indexados
+                e os das consultas precisam vir do mesmo formato
+            mmap: Mapeia os arrays do modelo em memória somente leitura, para que vários
+                workers compartilhem as mesmas páginas
         """
         self.model = TangentCftModel()
+        if model_format not in ("full", "inference"):
+            raise ValueError(f"Unknown model format {model_format!r}, use 'full' or 'inference'")
         if model_file_path is not None:
-            print("Loading the model : ", model_file_path)
-            self.model.load_model(model_file_path)
+            mmap_mode = "r" if mmap else None
+            print(f"Loading the model ({model_format}) : ", model_file_path)
+            if model_format == "inference":
+                self.model.load_inference_model(model_file_path, mmap=mmap_mode)
+            else:
+                self.model.load_model(model_file_path, mmap=mmap_mode)
+            if self.model.load_tuple_table(model_file_path, mmap=mmap_mode):
+                print(
+                    f"Loaded tuple-vector table with {len(self.model.tuple_table)} tuples"
+                )
 
         # Usar o singleton EncoderManager
         self.encoder_manager = EncoderManager()
 
-    def train_model(self, configuration, lst_lst_encoded_tuples):
+        # Contadores de tuplas compostas por n-gramas (em vez de um log por tupla)
+        self.embedded_tuples = 0
+        self.oov_tuples = 0
+        self.unresolved_tuples = 0
+
+    def train_model(self, configuration, lst_lst_encoded_tuples=None, corpus_file=None):
+        """
+        Treina o modelo FastText. Com corpus_file, as fórmulas são gravadas nesse arquivo (se
+        lst_lst_encoded_tuples for dado) e o treino usa o modo corpus_file do gensim, com
+        configuration.workers threads (todos os cores por padrão)
+        """
         print("Setting Configuration")
-        self.model.train(configuration, lst_lst_encoded_tuples)
+        self.model.train(configuration, lst_lst_encoded_tuples, corpus_file=corpus_file)
         return self.model
 
     def save_model(self, model_file_path):
@@ -44,23 +76,18 @@ class TangentCFTService:
         Get dictionary of formula ids and their list of tuples and return matrix of tensors and a
         dictionary having formula id and their corresponding row id in the matrix
         """
-        numpy_lst = []
-        index_formula_id = {}
-        idx = 0
-        for formula in dictionary_formula_lst_encoded_tuples:
-            try:
-                xx = self.__get_vector_representation(
-                    dictionary_formula_lst_encoded_tuples[formula]
-                )
-                xx = xx.reshape(1, 300)
-                numpy_lst.append(xx)
-                index_formula_id[idx] = formula
-                idx += 1
-            except:
-                continue
-        temp = numpy.concatenate(numpy_lst, axis=0)
+        formula_ids = list(dictionary_formula_lst_encoded_tuples.keys())
+        vectors = self.embed_many(
+            [dictionary_formula_lst_encoded_tuples[formula] for formula in formula_ids]
+        )
+        # Formulas without any resolvable tuple are left out of the index
+        valid = ~numpy.isnan(vectors).any(axis=1)
+        index_formula_id = {
+            idx: formula_id
+            for idx, formula_id in enumerate(numpy.array(formula_ids, dtype=object)[valid])
+        }
         # Remover .cuda()
-        tensor_values = Variable(torch.tensor(temp).double())
+        tensor_values = Variable(torch.tensor(vectors[valid]).double())
         return tensor_values, index_formula_id
 
     def index_collection_to_numpy(self, dictionary_formula_lst_encoded_tuples):
@@ -68,15 +95,69 @@ class TangentCFTService:
         This methods takes in the dictionary of formula id and their corresponding list of tuples and returns a dictionary
         of formula id and their numpy vector representations
         """
+        formula_ids = list(dictionary_formula_lst_encoded_tuples.keys())
+        vectors = self.embed_many(
+            [dictionary_formula_lst_encoded_tuples[formula] for formula in formula_ids]
+        )
         index_formula_id = {}
-        for formula in dictionary_formula_lst_encoded_tuples:
-            vector = self.__get_vector_representation(
-                dictionary_formula_lst_encoded_tuples[formula]
-            )
-            vector = vector.reshape(1, 300)
-            index_formula_id[formula] = vector
+        for formula, vector in zip(formula_ids, vectors):
+            index_formula_id[formula] = vector.reshape(1, -1)
         return index_formula_id
 
+    def embed_many(self, list_of_tuple_lists):
+        """
+        Vector representation of many formulas at once. All distinct tuples of the batch are resolved in one
+        vectorized lookup and each formula vector is the mean of its tuple vectors.
+        :param list_of_tuple_lists: list of formulas, each one a list of encoded tuples
+        :return: float32 matrix with one row per formula; rows of formulas without any resolvable tuple are NaN
+        """
+        unique_tuples = {}
+        flat_rows = []
+        lengths = numpy.zeros(len(list_of_tuple_lists), dtype=numpy.int64)
+        for formula_idx, lst_encoded_tuples in enumerate(list_of_tuple_lists):
+            for encoded_tuple in lst_encoded_tuples:
+                flat_rows.append(
+                    unique_tuples.setdefault(encoded_tuple, len(unique_tuples))
+                )
+            lengths[formula_idx] = len(lst_encoded_tuples)
+
+        vector_size = self.model.model.wv.vector_size
+        result = numpy.full(
+            (len(list_of_tuple_lists), vector_size), numpy.nan, dtype=numpy.float32
+        )
+        if not flat_rows:
+            return result
+
+        unique_vectors, oov, resolved = self.model.get_vectors(list(unique_tuples))
+        flat_rows = numpy.asarray(flat_rows, dtype=numpy.int64)
+        formula_of_row = numpy.repeat(numpy.arange(len(list_of_tuple_lists)), lengths)
+
+        # if the tuple vector cannot be extracted due to unseen n-gram, then we pass over that tuple.
+        keep = resolved[flat_rows]
+        self.embedded_tuples += int(keep.sum())
+        self.oov_tuples += int(oov[flat_rows].sum())
+        self.unresolved_tuples += int((~keep).sum())
+
+        flat_rows = flat_rows[keep]
+        formula_of_row = formula_of_row[keep]
+        counts = numpy.bincount(formula_of_row, minlength=len(list_of_tuple_lists))
+        has_vector = counts > 0
+        if has_vector.any():
+            # formula_of_row is sorted, so each formula is a contiguous segment
+            starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+            sums = numpy.add.reduceat(
+                unique_vectors[flat_rows], starts[has_vector], axis=0
+            )
+            result[has_vector] = sums / counts[has_vector, None]
+        return result
+
+    def get_oov_stats(self):
+        return {
+            "embedded_tuples": self.embedded_tuples,
+            "oov_tuples": self.oov_tuples,
+            "unresolved_tuples": self.unresolved_tuples,
+        }
+
     def get_query_vector(self, lst_encoded_tuples):
         return self.__get_vector_representation(lst_encoded_tuples)
 
@@ -141,20 +222,7 @@ class TangentCFTService:
         :param lst_encoded_tuples: averaging vector representation for these tuples
         :return: vector representation for the formula
         """
-        temp_vector = None
-        first = True
-        counter = 0
-        for encoded_tuple in lst_encoded_tuples:
-            # if the tuple vector cannot be extracted due to unseen n-gram, then we pass over that tuple.
-            try:
-                if first:
-                    temp_vector = self.model.get_vector_representation(encoded_tuple)
-                    first = False
-                else:
-                    temp_vector = temp_vector + self.model.get_vector_representation(
-                        encoded_tuple
-                    )
-                counter = counter + 1
-            except Exception as e:
-                logging.exception(e)
-        return temp_vector / counter
+        vector = self.embed_many([lst_encoded_tuples])[0]
+        if numpy.isnan(vector).any():
+            raise ValueError("No tuple vector could be extracted for the formula")
+        return vector
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import List, Union
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+
+class TextEmbeddingService:
+    """
+    Motor de embeddings de texto compartilhado pelo processo.
+
+    Carrega o SentenceTransformer uma única vez (a carga preguiçosa é
+    protegida pelo ModelManager). As chamadas de encode rodam em paralelo:
+    a inferência não altera o modelo e o torch libera o GIL durante ela. O
+    lock protege só os contadores das métricas.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+
+        start_time = time.perf_counter()
+        self.model = SentenceTransformer(model_name)
+        self.load_time = time.perf_counter() - start_time
+
+        self.encode_calls = 0
+        self.encoded_texts = 0
+        self.total_encode_time = 0.0
+        self.last_encode_time = 0.0
+
+    def encode(
+        self,
+        texts: Union[str, List[str]],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+    ) -> np.ndarray:
+        """
+        Gera os embeddings dos textos informados
+
+        Args:
+            texts: Texto ou lista de textos
+            batch_size: Tamanho do lote usado pelo SentenceTransformer
+            normalize_embeddings: Normaliza os vetores (similaridade cosseno)
+
+        Returns:
+            Vetor (para um único texto) ou matriz (para uma lista de textos)
+        """
+        start_time = time.perf_counter()
+        embeddings = self.model.encode(
+            texts,
+            convert_to_numpy=True,
+            normalize_embeddings=normalize_embeddings,
+            batch_size=batch_size,
+            show_progress_bar=False,
+        )
+        elapsed = time.perf_counter() - start_time
+
+        with self._lock:
+            self.encode_calls += 1
+            self.encoded_texts += 1 if isinstance(texts, str) else len(texts)
+            self.total_encode_time += elapsed
+            self.last_encode_time = elapsed
+
+        return embeddings
+
+    def get_stats(self) -> dict:
+        """Retorna o tempo de carga do modelo e a latência das chamadas de encode"""
+        with self._lock:
+            calls = self.encode_calls
+            return {
+                "model_name": self.model_name,
+                "load_time_seconds": self.load_time,
+                "encode_calls": calls,
+                "encoded_texts": self.encoded_texts,
+                "total_encode_time_seconds": self.total_encode_time,
+                "mean_encode_latency_ms": (
+                    self.total_encode_time / calls * 1000 if calls else 0.0
+                ),
+                "last_encode_latency_ms": self.last_encode_time * 1000,
+            }
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from lib.tangentS.math_tan.math_extractor import MathExtractor
+
+# Caminho do arquivo sqlite do store; sem ele o store fica desativado.
+# Lido em get_tuple_store(), então os scripts podem alterá-lo antes do uso.
+TUPLE_STORE_PATH = os.environ.get("TUPLE_STORE_PATH")
+# Store usado por padrão pelos scripts de indexação e de treino
+DEFAULT_TUPLE_STORE_PATH = "data/arqmath/tuple_store.sqlite"
+# Versão do parser (lib/tangentS) que entra na chave do store: ao mudar a
+# conversão MathML -> tuplas, aumente este valor (ou defina a variável de
+# ambiente) e as tuplas antigas deixam de ser usadas. Apagar o arquivo
+# sqlite também invalida o store, e libera o espaço das chaves antigas.
+TUPLE_PARSER_VERSION = os.environ.get("TUPLE_PARSER_VERSION", "1")
+
+# Chaves por consulta no sqlite (limite de variáveis por statement)
+LOOKUP_BATCH_SIZE = 500
+
+# Árvores de um conteúdo MathML: (posição, forma canônica, tuplas) de cada
+# fórmula, ou None quando o conteúdo não pôde ser convertido
+ParsedTrees = Optional[List[Tuple[int, str, List[str]]]]
+
+
+def parse_trees(content: str, operator: bool, window: int = 2, eob: bool = True) -> ParsedTrees:
+    """
+    Converte o MathML (uma fórmula ou um documento inteiro) nas tuplas de
+    cada árvore SLT ou OPT. Lança exceção se o conteúdo não puder ser convertido.
+    """
+    trees = MathExtractor.parse_from_xml(
+        content,
+        content_id=1,
+        operator=operator,
+        missing_tags=None,
+        problem_files=None,
+    )
+    return [
+        (position, tree.tostring(), tree.get_pairs(window=window, eob=eob))
+        for position, tree in trees.items()
+    ]
+
+
+def parse_slt_opt_trees(
+    content: str, window: int = 2, eob: bool = True, operators=(False, True)
+) -> Dict[bool, ParsedTrees]:
+    """
+    Converte o MathML nas árvores SLT e OPT extraindo as expressões do
+    conteúdo (math_tokens, que também converte o LaTeX) uma única vez.
+    Cada representação falha de forma independente (None).
+
+    Returns:
+        {operator: árvores} para cada operator de `operators`
+    """
+    try:
+        math_tokens = MathExtractor.math_tokens(content)
+    except Exception:
+        return {operator: None for operator in operators}
+
+    result = {}
+    for operator in operators:
+        try:
+            trees = MathExtractor.parse_from_xml(
+                content,
+                content_id=1,
+                operator=operator,
+                missing_tags=None,
+                problem_files=None,
+                math_tokens=math_tokens,
+            )
+            result[operator] = [
+                (position, tree.tostring(), tree.get_pairs(window=window, eob=eob))
+                for position, tree in trees.items()
+            ]
+        except Exception:
+            result[operator] = None
+    return result
+
+
+class TupleStore:
+    """
+    Store persistente, endereçado por conteúdo, das tuplas das fórmulas.
+
+    A chave é o hash do MathML junto com os parâmetros da extração (operator,
+    window e eob) e a versão do parser (TUPLE_PARSER_VERSION): as tuplas de
+    um mesmo MathML nunca mudam, então uma nova indexação ou um novo treino
+    sobre a mesma coleção não precisa converter nada de novo. Conteúdos que
+    falharam não são guardados: a falha pode ser do ambiente (latexmlmath
+    ausente, por exemplo) e o conteúdo é convertido de novo na próxima vez.
+    """
+
+    def __init__(self, sqlite_path: str):
+        self.sqlite_path = sqlite_path
+        directory = os.path.dirname(sqlite_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # WAL: vários processos (workers de indexação) podem ler e escrever
+        self._db = sqlite3.connect(sqlite_path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS formula_tuples (key TEXT PRIMARY KEY, trees BLOB)"
+        )
+        self._db.commit()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    @staticmethod
+    def make_key(content: str, operator: bool, window: int = 2, eob: bool = True) -> str:
+        """Chave do store para o MathML e os parâmetros da extração"""
+        header = f"{TUPLE_PARSER_VERSION}|{int(operator)}|{window}|{int(eob)}|"
+        return hashlib.sha256((header + content).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, ParsedTrees]:
+        """Retorna as árvores guardadas para as chaves encontradas"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[i : i + LOOKUP_BATCH_SIZE]
+                rows = self._db.execute(
+                    "SELECT key, trees FROM formula_tuples WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, data in rows:
+                    found[key] = self._deserialize(data)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, ParsedTrees]):
+        """
+        Guarda as árvores de várias chaves em uma única transação. Conversões
+        que falharam (None) são ignoradas.
+        """
+        rows = [
+            (key, self._serialize(trees))
+            for key, trees in items.items()
+            if trees is not None
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO formula_tuples VALUES (?, ?)", rows
+            )
+            self._db.commit()
+            self.writes += len(rows)
+
+    def get(self, key: str) -> Tuple[bool, ParsedTrees]:
+        """(encontrado, árvores) de uma chave"""
+        found = self.get_many([key])
+        return key in found, found.get(key)
+
+    def put(self, key: str, trees: ParsedTrees):
+        self.put_many({key: trees})
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM formula_tuples").fetchone()[0]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.sqlite_path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def report(self, name: str = "Tuple store"):
+        stats = self.get_stats()
+        print(
+            f"📊 {name}: {stats['hits']} hits, {stats['misses']} misses "
+            f"({100 * stats['hit_rate']:.1f}% hit rate), {stats['writes']} written "
+            f"to {stats['path']}"
+        )
+
+    @staticmethod
+    def _serialize(trees: ParsedTrees) -> bytes:
+        return zlib.compress(json.dumps(trees, ensure_ascii=False).encode("utf-8"))
+
+    @staticmethod
+    def _deserialize(data: bytes) -> ParsedTrees:
+        trees = json.loads(zlib.decompress(data).decode("utf-8"))
+        if trees is None:
+            return None
+        return [(position, tree_string, tuples) for position, tree_string, tuples in trees]
+
+
+_stores: Dict[str, TupleStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_tuple_store() -> Optional[TupleStore]:
+    """
+    Retorna o store do processo para TUPLE_STORE_PATH, ou None se o store
+    estiver desativado
+    """
+    if not TUPLE_STORE_PATH:
+        return None
+    with _stores_lock:
+        if TUPLE_STORE_PATH not in _stores:
+            _stores[TUPLE_STORE_PATH] = TupleStore(TUPLE_STORE_PATH)
+        return _stores[TUPLE_STORE_PATH]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os testes importam os módulos do repositório (services, lib) a partir da raiz
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
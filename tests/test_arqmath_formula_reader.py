@@ -0,0 +1,49 @@
+from DataReader.arqmath_formula_reader import OptFormulaLookup, iter_formula_chunks
+from services.post_id_index import PostIdIndex
+
+HEADER = "id\tpost_id\tthread_id\ttype\tcomment_id\told_visual_id\tvisual_id\tissue\tformula\n"
+
+
+def write_tsv(path, kind, rows=10):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(HEADER)
+        for number in range(rows):
+            formula_type = "answer" if number % 4 == 3 else "question"
+            file.write(f"{number}\t{100 + number}\t1\t{formula_type}\t\t\t\t\t<{kind}>{number}</{kind}>\n")
+    return str(path)
+
+
+def read_all(slt_file, opt_lookup, start_row, chunk_rows=3):
+    post_id_index = PostIdIndex()
+    post_id_index.add(range(100, 110))
+    rows = []
+    for chunk, _, _ in iter_formula_chunks(
+        slt_file, opt_lookup, post_id_index, start_row=start_row, chunk_rows=chunk_rows
+    ):
+        rows.extend(chunk)
+    return rows
+
+
+def test_opt_text_of_each_formula(tmp_path):
+    slt_file = write_tsv(tmp_path / "slt.tsv", "slt")
+    with OptFormulaLookup(write_tsv(tmp_path / "opt.tsv", "opt")) as opt_lookup:
+        rows = read_all(slt_file, opt_lookup, start_row=0)
+
+    assert [row[0] for row in rows] == ["0", "1", "2", "4", "5", "6", "8", "9"]
+    assert all(opt_text == f"<opt>{formula_id}</opt>" for formula_id, _, _, opt_text in rows)
+
+
+def test_resume_keeps_the_opt_file_in_step(tmp_path):
+    slt_file = write_tsv(tmp_path / "slt.tsv", "slt")
+    opt_file = write_tsv(tmp_path / "opt.tsv", "opt")
+    with OptFormulaLookup(opt_file, lookahead_rows=2) as opt_lookup:
+        rows = read_all(slt_file, opt_lookup, start_row=6)
+        # Os ids já indexados não ficam no buffer nem são descartados dele
+        assert opt_lookup.dropped == 0
+        assert not opt_lookup.buffer
+
+    assert [(row[0], row[3]) for row in rows] == [
+        ("6", "<opt>6</opt>"),
+        ("8", "<opt>8</opt>"),
+        ("9", "<opt>9</opt>"),
+    ]
@@ -0,0 +1,158 @@
+import json
+import threading
+from types import SimpleNamespace
+
+from elasticsearch import ApiError
+
+from services.bulk_writer import BulkWriter
+from services.es_serializer import NumpyJsonSerializer
+
+
+class FakeSerializers:
+    def get_serializer(self, mimetype):
+        return NumpyJsonSerializer()
+
+
+class FakeTransport:
+    serializers = FakeSerializers()
+
+
+class FakeElasticsearch:
+    """
+    Cliente falso: o bulk responde com `statuses[_id]` (uma lista consumida a
+    cada envio do documento, ou 201 quando vazia)
+    """
+
+    def __init__(self, statuses=None, errors=None):
+        self.transport = FakeTransport()
+        self.statuses = statuses or {}
+        # Exceções lançadas pelas próximas requisições, na ordem
+        self.errors = list(errors or [])
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def options(self, **kwargs):
+        return self
+
+    def bulk(self, operations, refresh):
+        with self._lock:
+            error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        items = []
+        for line in operations:
+            operation = json.loads(line)
+            if "index" not in operation:
+                continue
+            doc_id = operation["index"]["_id"]
+            with self._lock:
+                self.sent.append(doc_id)
+                statuses = self.statuses.get(doc_id)
+                status = statuses.pop(0) if statuses else 201
+            items.append({"index": {"_id": doc_id, "status": status}})
+        return {"items": items}
+
+
+def actions(ids):
+    return [{"_index": "test", "_id": doc_id, "value": doc_id} for doc_id in ids]
+
+
+def test_commits_offsets_in_input_order():
+    es = FakeElasticsearch()
+    commits = []
+    with BulkWriter(es, chunk_size=2, max_in_flight=3, on_commit=commits.append) as writer:
+        for offset in range(1, 6):
+            writer.write(actions([f"{offset}a", f"{offset}b"]))
+            writer.mark(offset)
+
+    assert commits == [1, 2, 3, 4, 5]
+    assert writer.committed_offset == 5
+    assert writer.get_stats()["succeeded"] == 10
+
+
+def test_rejected_doc_blocks_later_commits():
+    es = FakeElasticsearch(statuses={"2b": [400]})
+    commits = []
+    with BulkWriter(es, chunk_size=2, max_in_flight=1, on_commit=commits.append) as writer:
+        for offset in range(1, 4):
+            writer.write(actions([f"{offset}a", f"{offset}b"]))
+            writer.mark(offset)
+
+    # O chunk do offset 2 teve um documento rejeitado de vez: o offset
+    # confirmado para antes dele, mesmo com o chunk seguinte gravado
+    assert commits == [1]
+    assert writer.committed_offset == 1
+    stats = writer.get_stats()
+    assert stats["rejected"] == 1
+    assert stats["succeeded"] == 5
+
+
+def test_retries_429_and_commits():
+    es = FakeElasticsearch(statuses={"1a": [429, 429]})
+    commits = []
+    with BulkWriter(
+        es, chunk_size=2, max_in_flight=1, initial_backoff=0, on_commit=commits.append
+    ) as writer:
+        writer.write(actions(["1a", "1b"]))
+        writer.mark(1)
+
+    assert commits == [1]
+    assert es.sent.count("1a") == 3
+    assert es.sent.count("1b") == 1
+    assert writer.get_stats()["retries"] == 2
+
+
+def test_429_after_max_retries_is_not_committed():
+    es = FakeElasticsearch(statuses={"1a": [429, 429, 429]})
+    commits = []
+    with BulkWriter(
+        es, chunk_size=2, max_retries=1, initial_backoff=0, on_commit=commits.append
+    ) as writer:
+        writer.write(actions(["1a", "1b"]))
+        writer.mark(1)
+
+    assert commits == []
+    assert writer.committed_offset is None
+
+
+def api_error(status):
+    return ApiError("error", meta=SimpleNamespace(status=status), body={})
+
+
+def test_retries_transient_overload_responses():
+    es = FakeElasticsearch(errors=[api_error(503), api_error(502), api_error(504)])
+    commits = []
+    with BulkWriter(
+        es, chunk_size=2, initial_backoff=0, on_commit=commits.append
+    ) as writer:
+        writer.write(actions(["1a", "1b"]))
+        writer.mark(1)
+
+    assert commits == [1]
+    assert writer.get_stats()["succeeded"] == 2
+
+
+def test_client_error_is_not_retried():
+    es = FakeElasticsearch(errors=[api_error(400)])
+    with BulkWriter(es, chunk_size=2, initial_backoff=0) as writer:
+        writer.write(actions(["1a", "1b"]))
+        writer.mark(1)
+
+    assert writer.committed_offset is None
+    assert writer.get_stats()["failed"] == 2
+    assert es.sent == []
+
+
+def test_unexpected_error_counts_the_chunk_as_failed(capsys):
+    es = FakeElasticsearch(errors=[KeyError("items")])
+    commits = []
+    with BulkWriter(es, chunk_size=2, max_in_flight=1, on_commit=commits.append) as writer:
+        writer.write(actions(["1a", "1b"]))
+        writer.mark(1)
+        writer.write(actions(["2a", "2b"]))
+        writer.mark(2)
+
+    assert commits == []
+    stats = writer.get_stats()
+    assert (stats["failed"], stats["succeeded"]) == (2, 2)
+    assert "KeyError" in capsys.readouterr().out
@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pytest
+
+from services import es_serializer
+from services.es_serializer import NumpyJsonSerializer, drop_non_finite_vectors
+
+
+@pytest.fixture(params=["orjson", "fallback"])
+def serializer(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(es_serializer, "orjson", None)
+    return NumpyJsonSerializer()
+
+
+def test_finite_vectors_round_trip(serializer):
+    vector = np.array([0.1, -2.5, 3e-8], dtype=np.float32)
+    data = json.loads(serializer.dumps({"formula_id": "1", "slt_vector": vector}))
+    np.testing.assert_array_equal(np.asarray(data["slt_vector"], dtype=np.float32), vector)
+
+
+@pytest.mark.parametrize("bad_value", [np.nan, np.inf, -np.inf])
+def test_non_finite_vector_is_not_written(serializer, bad_value, capsys):
+    document = {
+        "formula_id": "f-7",
+        "slt_vector": np.array([1.0, bad_value], dtype=np.float32),
+        "opt_vector": np.array([1.0, 2.0], dtype=np.float32),
+    }
+    data = json.loads(serializer.dumps(document))
+
+    assert "slt_vector" not in data
+    assert data["opt_vector"] == [1.0, 2.0]
+    assert "slt_vector of document f-7" in capsys.readouterr().out
+    # O documento original não é alterado
+    assert "slt_vector" in document
+
+
+def test_non_finite_vector_in_update_doc(serializer, capsys):
+    data = json.loads(
+        serializer.dumps({"doc": {"slt_vector": np.array([np.nan], dtype=np.float64), "post_id": "9"}})
+    )
+    assert data == {"doc": {"post_id": "9"}}
+    assert "document 9" in capsys.readouterr().out
+
+
+def test_non_finite_scalar_is_null(serializer):
+    data = json.loads(serializer.dumps({"score": np.float32("nan"), "rank": np.int64(3)}))
+    assert data == {"score": None, "rank": 3}
+
+
+def test_drop_uses_given_document_id(capsys):
+    data = {"vector": np.array([np.inf])}
+    assert drop_non_finite_vectors(data, "op-id") == {}
+    assert "document op-id" in capsys.readouterr().out
+
+    clean = {"vector": np.array([1.0])}
+    assert drop_non_finite_vectors(clean) is clean
+
+
+def test_non_finite_nested_entry_is_dropped(serializer, capsys):
+    # Documento no formato do índice posts: campos nested com entradas {"vector": ...}
+    document = {
+        "post_id": "42",
+        "formulas_ids": ["f1", "f2", "f3"],
+        "formula_vectors": [
+            {"vector": np.array([1.0, 2.0], dtype=np.float32), "formula_index": 0},
+            {"vector": np.array([np.nan, 2.0], dtype=np.float32), "formula_index": 1},
+            {"vector": np.array([3.0, 4.0], dtype=np.float32), "formula_index": 2},
+        ],
+        "slt_vectors": [{"vector": np.array([np.inf, 0.0], dtype=np.float32), "formula_index": 0}],
+    }
+    data = json.loads(serializer.dumps(document))
+
+    assert [entry["formula_index"] for entry in data["formula_vectors"]] == [0, 2]
+    assert data["formula_vectors"][1]["vector"] == [3.0, 4.0]
+    assert data["slt_vectors"] == []
+    assert data["formulas_ids"] == ["f1", "f2", "f3"]
+    output = capsys.readouterr().out
+    assert "formula_vectors[1] of document 42" in output
+    assert "slt_vectors[0] of document 42" in output
+    assert len(document["formula_vectors"]) == 3
+
+
+def test_nested_lists_without_bad_vectors_are_kept():
+    entries = [{"vector": np.array([1.0])}, {"vector": np.array([2.0])}]
+    data = {"post_id": "1", "opt_vectors": entries}
+    assert drop_non_finite_vectors(data) is data
+    assert drop_non_finite_vectors({"vectors": [np.array([np.nan]), np.array([1.0])]}) == {
+        "vectors": [np.array([1.0])]
+    }
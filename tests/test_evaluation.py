@@ -0,0 +1,71 @@
+import pytest
+
+from lib.tangentCFT.evaluation import (
+    FULL_RELEVANCE,
+    PARTIAL_RELEVANCE,
+    bpref,
+    evaluate,
+    read_qrels,
+    read_run,
+    write_run,
+)
+
+# Julgamentos NTCIR-12 (0-4): d1, d5 são relevantes (>= 3); d3, d4 só
+# parcialmente (>= 1); d2, d6 não relevantes. d4 não é recuperado.
+QRELS = {
+    "q1": {"d1": 4, "d2": 0, "d3": 2, "d4": 1, "d5": 3, "d6": 0},
+    "q2": {"e1": 3, "e2": 0},
+    "q4": {"g1": 0},
+}
+# Ranking de q1: d2, d1, dX (não julgado), d3, d5, d6
+RUN = {
+    "q1": {"d2": 0.9, "d1": 0.8, "dX": 0.7, "d3": 0.6, "d5": 0.5, "d6": 0.4},
+    "q2": {"e1": 0.9, "e2": 0.1},
+    "q3": {"f1": 1.0},
+    "q4": {"g1": 1.0},
+}
+
+
+def test_bpref_partial_relevance():
+    # R = {d1, d3, d4, d5}, N = {d2, d6}: bpref = 1/R * sum(1 - |n above r| / min(R, N))
+    # d1: 1 - 1/2, d3: 1 - 1/2, d5: 1 - 1/2, d4: 0  ->  1.5 / 4
+    mean, per_query = bpref(QRELS, RUN, PARTIAL_RELEVANCE)
+    assert per_query["q1"] == pytest.approx(0.375)
+    assert per_query["q2"] == pytest.approx(1.0)
+    # Sem documentos relevantes, bpref 0; q3 não tem julgamentos e fica de fora
+    assert per_query["q4"] == 0.0
+    assert "q3" not in per_query
+    assert mean == pytest.approx((0.375 + 1.0 + 0.0) / 3)
+
+
+def test_bpref_full_relevance():
+    # R = {d1, d5}, N = {d2, d3, d4, d6}: d1: 1 - 1/2, d5: 1 - min(2, 2)/2  ->  0.5 / 2
+    _, per_query = bpref(QRELS, RUN, FULL_RELEVANCE)
+    assert per_query["q1"] == pytest.approx(0.25)
+
+
+def test_bpref_cutoff():
+    # Só d2 e d1 entram: d1: 1 - 1/2  ->  0.5 / 4
+    _, per_query = bpref(QRELS, RUN, PARTIAL_RELEVANCE, cutoff=2)
+    assert per_query["q1"] == pytest.approx(0.125)
+
+
+def test_ties_are_broken_by_doc_id_descending():
+    qrels = {"q": {"a": 3, "b": 0}}
+    # Mesmo score: "b" vem antes de "a", então "a" tem um não relevante acima
+    _, per_query = bpref(qrels, {"q": {"a": 1.0, "b": 1.0}}, FULL_RELEVANCE)
+    assert per_query["q"] == 0.0
+
+
+def test_evaluate_from_files(tmp_path):
+    qrels_path = tmp_path / "qrels.txt"
+    qrels_path.write_text(
+        "".join(f"{query} 0 {doc} {relevance}\n" for query, docs in QRELS.items() for doc, relevance in docs.items())
+    )
+    run_path = tmp_path / "run.txt"
+    write_run(RUN, str(run_path), 1)
+
+    assert read_run(str(run_path)) == RUN
+    result = evaluate(read_qrels(str(qrels_path)), read_run(str(run_path)))
+    assert result["bpref_partial"] == pytest.approx((0.375 + 1.0) / 3)
+    assert result["bpref_full"] == pytest.approx((0.25 + 1.0) / 3)
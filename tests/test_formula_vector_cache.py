@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from services import formula_vector_cache
+from services.formula_vector_cache import FormulaVectorCache, model_fingerprint
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(formula_vector_cache.time, "time", clock.time)
+    return clock
+
+
+def vectors(value):
+    return {"slt": np.full(4, value, dtype=np.float32)}
+
+
+def test_key_ignores_volatile_attributes_and_whitespace():
+    key = FormulaVectorCache.make_key('<math id="a"><mi>x</mi></math>', ["SLT", "opt"])
+    same = FormulaVectorCache.make_key('<math id="b">\n  <mi>x</mi>\n</math>', ["opt", "slt"])
+    assert key == same
+    assert key != FormulaVectorCache.make_key('<math><mi>x</mi></math>', ["slt"])
+
+
+def test_ttl_expiry(clock):
+    cache = FormulaVectorCache(max_size=10, ttl_seconds=60)
+    cache.put("a", vectors(1))
+
+    clock.now += 59
+    assert cache.get("a")["slt"][0] == 1
+    clock.now += 2
+    assert cache.get("a") is None
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 0)
+
+
+def test_lru_eviction():
+    cache = FormulaVectorCache(max_size=2)
+    cache.put("a", vectors(1))
+    cache.put("b", vectors(2))
+    cache.get("a")
+    cache.put("c", vectors(3))
+
+    # "b" era a menos usada recentemente
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    FormulaVectorCache(sqlite_path=path, fingerprint="v1").put("a", vectors(1.5))
+
+    cache = FormulaVectorCache(sqlite_path=path, fingerprint="v1")
+    loaded = cache.get("a")
+    np.testing.assert_array_equal(loaded["slt"], vectors(1.5)["slt"])
+    assert loaded["slt"].dtype == np.float32
+    cache.get("a")
+    stats = cache.get_stats()
+    assert (stats["disk_hits"], stats["hits"]) == (1, 1)
+
+
+def test_persisted_entries_expire(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    FormulaVectorCache(ttl_seconds=60, sqlite_path=path).put("a", vectors(1))
+
+    clock.now += 61
+    assert FormulaVectorCache(ttl_seconds=60, sqlite_path=path).get("a") is None
+
+
+def test_fingerprint_change_drops_persisted_vectors(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    FormulaVectorCache(sqlite_path=path, fingerprint="v1").put("a", vectors(1))
+
+    cache = FormulaVectorCache(sqlite_path=path, fingerprint="v2")
+    assert cache.get("a") is None
+    cache.put("a", vectors(2))
+
+    # Os vetores do novo modelo continuam valendo enquanto ele não muda
+    assert FormulaVectorCache(sqlite_path=path, fingerprint="v2").get("a")["slt"][0] == 2
+
+
+def test_model_fingerprint_changes_with_model_files(tmp_path):
+    model_path = str(tmp_path / "slt_model")
+    with open(model_path, "wb") as file:
+        file.write(b"model")
+    before = model_fingerprint([model_path])
+    assert before == model_fingerprint([model_path])
+
+    with open(model_path + ".wv.vectors_ngrams.npy", "wb") as file:
+        file.write(b"ngrams")
+    assert model_fingerprint([model_path]) != before
+
+
+def test_model_fingerprint_changes_with_model_format(tmp_path):
+    model_path = str(tmp_path / "slt_model")
+    with open(model_path, "wb") as file:
+        file.write(b"model")
+    assert model_fingerprint([model_path], "full") != model_fingerprint([model_path], "inference")
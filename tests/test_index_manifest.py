@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+from services import index_manifest
+from services.index_manifest import IndexManifest
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "formulas.tsv"
+    path.write_text("1\t<math/>\n2\t<math/>\n3\t<math/>\n")
+    return str(path)
+
+
+def test_new_entry_starts_at_zero(tmp_path, input_file):
+    manifest = IndexManifest("formulas", str(tmp_path / "manifests"))
+    assert manifest.begin(input_file, "SLT") == 0
+    assert manifest.get(input_file, "SLT")["status"] == index_manifest.IN_PROGRESS
+
+
+def test_resume_from_committed_offset(tmp_path, input_file):
+    directory = str(tmp_path / "manifests")
+    manifest = IndexManifest("formulas", directory)
+    manifest.begin(input_file, "SLT")
+    manifest.commit(manifest.offset(input_file, "SLT", 2))
+
+    resumed = IndexManifest("formulas", directory)
+    assert resumed.begin(input_file, "SLT") == 2
+    # Outro tipo de grafo do mesmo arquivo é outra entrada
+    assert resumed.begin(input_file, "OPT") == 0
+
+
+def test_done_entry_is_skipped(tmp_path, input_file):
+    directory = str(tmp_path / "manifests")
+    manifest = IndexManifest("formulas", directory)
+    manifest.begin(input_file, "SLT")
+    manifest.commit(manifest.offset(input_file, "SLT", 3, done=True))
+
+    assert IndexManifest("formulas", directory).begin(input_file, "SLT") is None
+
+
+def test_changed_input_starts_again(tmp_path, input_file):
+    directory = str(tmp_path / "manifests")
+    manifest = IndexManifest("formulas", directory)
+    manifest.begin(input_file, "SLT")
+    manifest.commit(manifest.offset(input_file, "SLT", 3, done=True))
+
+    with open(input_file, "a") as file:
+        file.write("4\t<math/>\n")
+    assert IndexManifest("formulas", directory).begin(input_file, "SLT") == 0
+
+
+def test_save_is_atomic(tmp_path, input_file, monkeypatch):
+    directory = str(tmp_path / "manifests")
+    manifest = IndexManifest("formulas", directory)
+    manifest.begin(input_file, "SLT")
+    manifest.commit(manifest.offset(input_file, "SLT", 1))
+    assert os.listdir(directory) == ["formulas.json"]
+
+    def failing_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(index_manifest.os, "replace", failing_replace)
+    with pytest.raises(OSError):
+        manifest.commit(manifest.offset(input_file, "SLT", 2))
+
+    # O arquivo anterior continua inteiro e com o último commit gravado
+    with open(manifest.path) as file:
+        entries = json.load(file)["entries"]
+    assert entries[IndexManifest.key(input_file, "SLT")]["rows"] == 1
@@ -0,0 +1,45 @@
+import pytest
+
+from services import model_manager
+from services.model_manager import check_formulas_index_format
+
+
+class FakeElasticService:
+    formulas_index_name = "formulas"
+
+    def __init__(self, count=0, model_format=None):
+        self.count = count
+        self.model_format = model_format
+
+    def count_formulas(self):
+        return self.count
+
+    def get_formulas_model_format(self):
+        return self.model_format
+
+    def set_formulas_model_format(self, model_format):
+        self.model_format = model_format
+
+
+def test_serving_with_the_index_format(monkeypatch):
+    monkeypatch.setattr(model_manager, "CFT_MODEL_FORMAT", "full")
+    check_formulas_index_format(FakeElasticService(count=10, model_format="full"))
+    # Índice inexistente: nada a conferir
+    check_formulas_index_format(FakeElasticService(model_format=None))
+
+
+def test_serving_with_another_format_fails(monkeypatch):
+    monkeypatch.setattr(model_manager, "CFT_MODEL_FORMAT", "inference")
+    with pytest.raises(RuntimeError, match="CFT_MODEL_FORMAT=full"):
+        check_formulas_index_format(FakeElasticService(count=10, model_format="full"))
+
+
+def test_indexing_records_the_format(monkeypatch):
+    monkeypatch.setattr(model_manager, "CFT_MODEL_FORMAT", "inference")
+    # Índice vazio: o formato anterior não importa
+    elastic_service = FakeElasticService(count=0, model_format="full")
+    check_formulas_index_format(elastic_service, indexing=True)
+    assert elastic_service.model_format == "inference"
+
+    with pytest.raises(RuntimeError):
+        check_formulas_index_format(FakeElasticService(count=5, model_format="full"), indexing=True)
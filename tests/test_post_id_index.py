@@ -0,0 +1,78 @@
+import numpy as np
+
+from services.post_id_index import PostIdIndex
+
+
+class FakeElasticService:
+    """Simula o iter_post_ids do ElasticService sobre uma lista de ids"""
+
+    posts_index_name = "posts"
+
+    def __init__(self, post_ids):
+        self.post_ids = post_ids
+        self.calls = []
+
+    def iter_post_ids(self, min_post_id=None):
+        self.calls.append(min_post_id)
+        for post_id in self.post_ids:
+            number = PostIdIndex._as_number(post_id)
+            if number is None or min_post_id is None or number > min_post_id:
+                yield post_id
+
+
+def test_bitmap_membership():
+    post_id_index = PostIdIndex()
+    post_id_index.add([0, 7, 8, "15", np.int64(1000)])
+
+    for post_id in (0, "0", 7, 8, 15, "15", 1000, "1000"):
+        assert post_id in post_id_index
+    for post_id in (1, 6, 9, 16, 999, 1001, 10**9, -1):
+        assert post_id not in post_id_index
+    assert len(post_id_index) == 5
+    assert post_id_index.max_post_id == 1000
+
+
+def test_non_canonical_ids_go_to_side_set():
+    post_id_index = PostIdIndex()
+    post_id_index.add(["12", "012", "p-3", "١٢"])
+
+    assert post_id_index.other_ids == {"012", "p-3", "١٢"}
+    assert "012" in post_id_index
+    assert "p-3" in post_id_index
+    assert "12" in post_id_index
+    assert "0012" not in post_id_index
+    assert "p-4" not in post_id_index
+    assert post_id_index.filter(["12", "012", "13", "p-3"]) == {"12", "012", "p-3"}
+
+
+def test_add_counts_only_new_ids():
+    post_id_index = PostIdIndex()
+    post_id_index.add([1, 2, 2, "x"])
+    post_id_index.add([2, 3, "x", "y"])
+    assert len(post_id_index) == 5
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "post_id_index")
+    post_id_index = PostIdIndex()
+    post_id_index.add([3, 42, "abc"])
+    post_id_index.save(path)
+
+    assert PostIdIndex.exists(path)
+    loaded = PostIdIndex.load(path)
+    assert loaded.filter([3, 4, 42, "abc", "abd"]) == {"3", "42", "abc"}
+    assert len(loaded) == 3
+    assert loaded.max_post_id == 42
+
+
+def test_refresh_adds_new_numeric_and_all_side_set_ids():
+    elastic_service = FakeElasticService([5, 10, "a"])
+    post_id_index = PostIdIndex.build(elastic_service)
+    assert post_id_index.filter([5, 10, "a"]) == {"5", "10", "a"}
+
+    elastic_service.post_ids = [5, 10, 11, 20, "a", "b"]
+    added = post_id_index.refresh(elastic_service)
+
+    assert elastic_service.calls == [None, 10]
+    assert added == 3
+    assert post_id_index.filter([11, 20, "b"]) == {"11", "20", "b"}
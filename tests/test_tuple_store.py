@@ -0,0 +1,60 @@
+from services import tuple_store
+from services.tuple_store import TupleStore
+
+MATHML = '<math><mi>x</mi><mo>+</mo><mn>1</mn></math>'
+TREES = [
+    (0, "[V!x[+[N!1]]]", ["V!x\t+\tn", "+\tN!1\tn"]),
+    (3, "[V!y]", ["V!y\t0!\tn"]),
+]
+
+
+def test_key_depends_on_content_and_extraction_parameters():
+    key = TupleStore.make_key(MATHML, operator=False)
+    assert key == TupleStore.make_key(MATHML, operator=False, window=2, eob=True)
+    assert len(key) == 64
+
+    others = {
+        TupleStore.make_key(MATHML, operator=True),
+        TupleStore.make_key(MATHML, operator=False, window=3),
+        TupleStore.make_key(MATHML, operator=False, eob=False),
+        TupleStore.make_key(MATHML.replace("1", "2"), operator=False),
+    }
+    assert key not in others
+    assert len(others) == 4
+
+
+def test_round_trip(tmp_path):
+    store = TupleStore(str(tmp_path / "tuples.sqlite"))
+    slt_key = TupleStore.make_key(MATHML, operator=False)
+    failed_key = TupleStore.make_key("<math><broken", operator=False)
+    missing_key = TupleStore.make_key(MATHML, operator=True)
+
+    store.put_many({slt_key: TREES, failed_key: None})
+    found = store.get_many([slt_key, failed_key, missing_key, slt_key])
+
+    assert found == {slt_key: TREES}
+    # Conteúdo que falhou não é guardado: é convertido de novo na próxima vez
+    assert store.get(failed_key) == (False, None)
+    assert store.get(missing_key) == (False, None)
+    assert len(store) == 1
+
+    stats = store.get_stats()
+    assert stats["writes"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 4
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "store" / "tuples.sqlite")
+    key = TupleStore.make_key(MATHML, operator=False)
+    TupleStore(path).put(key, TREES)
+
+    assert TupleStore(path).get(key) == (True, TREES)
+
+
+def test_parser_version_invalidates_keys(tmp_path, monkeypatch):
+    store = TupleStore(str(tmp_path / "tuples.sqlite"))
+    store.put(TupleStore.make_key(MATHML, operator=False), TREES)
+
+    monkeypatch.setattr(tuple_store, "TUPLE_PARSER_VERSION", "2")
+    assert store.get(TupleStore.make_key(MATHML, operator=False)) == (False, None)